@@ -37,9 +37,9 @@ from collections import OrderedDict
 
 from overviewer_core import util
 from overviewer_core import logger
-from overviewer_core import textures
+from overviewer_core import textures, texturecache
 from overviewer_core import optimizeimages, world
-from overviewer_core import config_parser, tileset, assetmanager, dispatcher
+from overviewer_core import config_parser, tileset, assetmanager, dispatcher, storage
 from overviewer_core import cache
 from overviewer_core import observer
 from overviewer_core.nbt import CorruptNBTError
@@ -93,6 +93,9 @@ def main():
                         "number of CPU cores your computer has.")
 
     parser.add_argument("--pid", dest="pid", action="store", help="Specify the pid file to use.")
+    parser.add_argument("--watch", dest="watch", action="store_true",
+                        help="Keep running after the render, and render the changes to the "
+                        "world as they happen.")
     # Options that only apply to the config-less render usage
     parser.add_argument("--rendermodes", dest="rendermodes", action="store",
                         help="If you're not using a config file, specify which rendermodes to "
@@ -124,6 +127,9 @@ def main():
     parser.add_argument("--update-web-assets", dest='update_web_assets', action="store_true",
                         help="Update web assets. Will *not* render tiles or update "
                         "overviewerConfig.js.")
+    parser.add_argument("--export-tiles", dest="export_tiles", action="store_true",
+                        help="Unpack the tiles of renders with storage \"sqlite\" into the "
+                        "output directory, for the web viewer. Will *not* render tiles.")
 
     # Log level options:
     parser.add_argument("-q", "--quiet", dest="quiet", action="count", default=0,
@@ -338,6 +344,8 @@ def main():
     # the config
     if args.procs:
         mw_parser.set_config_item("processes", args.procs)
+    if args.watch:
+        mw_parser.set_config_item("watch", True)
 
     # Now parse and return the validated config
     try:
@@ -451,6 +459,18 @@ def main():
         logging.info("Web assets have been updated.")
         return 0
 
+    # Likewise for unpacking an SQLite tile store
+    if args.export_tiles:
+        renders = set(render_name for render_name, render in config['renders'].items()
+                      if render['storage'] == "sqlite")
+        storepath = os.path.join(destdir, storage.SQLiteStorage.filename)
+        if not renders or not os.path.exists(storepath):
+            logging.error("There are no tiles in an SQLite tile store to export.")
+            return 1
+        written = storage.export_tiles(storepath, destdir, renders)
+        logging.info("Exported %d tiles to '%s'.", written, destdir)
+        return 0
+
     # The changelist support.
     changelists = {}
     for render in config['renders'].values():
@@ -470,6 +490,22 @@ def main():
     worldcache = {}
     # same for textures
     texcache = {}
+    # and where they're saved to for the next time
+    texturecachedir = config['texturecache']
+    if texturecachedir is True:
+        texturecachedir = os.path.join(util.get_cache_dir(), "textures")
+        # Older versions kept them in the output directory, where they'd be
+        # published with the map
+        oldcachedir = os.path.join(destdir, ".texturecache")
+        if os.path.isdir(oldcachedir):
+            texturecache.remove_old_atlases(oldcachedir, 0)
+            try:
+                os.rmdir(oldcachedir)
+            except OSError:
+                pass
+    # and for the regionsets, so renders of the same world, dimension and
+    # orientation share them (see the multirender option)
+    rsetcache = {}
 
     # Set up the cache objects to use
     caches = []
@@ -497,10 +533,12 @@ def main():
             worldcache[render['world']] = w
 
         # find or create the textures object
-        texopts = util.dict_subset(render, ["texturepath", "bgcolor", "northdirection"])
+        texopts = util.dict_subset(render, ["texturepath", "bgcolor", "northdirection",
+                                            "texturesize"])
+        texopts['lazy'] = render['texturegeneration'] != "eager"
         texopts_key = tuple(texopts.items())
         if texopts_key not in texcache:
-            tex = textures.Textures(**texopts)
+            tex = textures.Textures(cachedir=texturecachedir or None, **texopts)
             logging.info("Generating textures...")
             tex.generate()
             logging.debug("Finished generating textures.")
@@ -508,43 +546,49 @@ def main():
         else:
             tex = texcache[texopts_key]
 
-        try:
-            logging.debug("Asking for regionset %r." % render['dimension'][1])
-            rset = w.get_regionset(render['dimension'][1])
-        except IndexError:
-            logging.error("Sorry, I can't find anything to render!  Are you sure there are .mca "
-                          "files in the world directory?")
-            return 1
-        if rset is None:    # indicates no such dimension was found
-            logging.warning("Sorry, you requested dimension '%s' for %s, but I couldn't find it.",
-                         render['dimension'][0], render_name)
-            continue
-
-        #################
-        # Apply any regionset transformations here
+        rsets_key = (render['world'], render['dimension'][1], render['northdirection'],
+                     tuple(tuple(zone) for zone in render.get('crop', [])))
+        if rsets_key in rsetcache:
+            rsets = rsetcache[rsets_key]
+        else:
+            try:
+                logging.debug("Asking for regionset %r." % render['dimension'][1])
+                rset = w.get_regionset(render['dimension'][1])
+            except IndexError:
+                logging.error("Sorry, I can't find anything to render!  Are you sure there are .mca "
+                              "files in the world directory?")
+                return 1
+            if rset is None:    # indicates no such dimension was found
+                logging.warning("Sorry, you requested dimension '%s' for %s, but I couldn't find it.",
+                             render['dimension'][0], render_name)
+                continue
 
-        # Insert a layer of caching above the real regionset. Any world
-        # tranformations will pull from this cache, but their results will not
-        # be cached by this layer. This uses a common pool of caches; each
-        # regionset cache pulls from the same underlying cache object.
-        rset = world.CachedRegionSet(rset, caches)
+            #################
+            # Apply any regionset transformations here
 
-        # If a crop is requested, wrap the regionset here
-        if "crop" in render:
-            rsets = []
-            for zone in render['crop']:
-                rsets.append(world.CroppedRegionSet(rset, *zone))
-        else:
-            rsets = [rset]
+            # Insert a layer of caching above the real regionset. Any world
+            # tranformations will pull from this cache, but their results will not
+            # be cached by this layer. This uses a common pool of caches; each
+            # regionset cache pulls from the same underlying cache object.
+            rset = world.CachedRegionSet(rset, caches)
 
-        # If this is to be a rotated regionset, wrap it in a RotatedRegionSet
-        # object
-        if (render['northdirection'] > 0):
-            newrsets = []
-            for r in rsets:
-                r = world.RotatedRegionSet(r, render['northdirection'])
-                newrsets.append(r)
-            rsets = newrsets
+            # If a crop is requested, wrap the regionset here
+            if "crop" in render:
+                rsets = []
+                for zone in render['crop']:
+                    rsets.append(world.CroppedRegionSet(rset, *zone))
+            else:
+                rsets = [rset]
+
+            # If this is to be a rotated regionset, wrap it in a RotatedRegionSet
+            # object
+            if (render['northdirection'] > 0):
+                newrsets = []
+                for r in rsets:
+                    r = world.RotatedRegionSet(r, render['northdirection'])
+                    newrsets.append(r)
+                rsets = newrsets
+            rsetcache[rsets_key] = rsets
 
         ###############################
         # Do the final prep and create the TileSet object
@@ -558,7 +602,10 @@ def main():
             "name", "imgformat", "renderchecks", "rerenderprob", "bgcolor", "defaultzoom",
             "imgquality", "imglossless", "optimizeimg", "rendermode", "worldname_orig", "title",
             "dimension", "changelist", "showspawn", "overlay", "base", "poititle", "maxzoom",
-            "showlocationmarker", "minzoom", "center"])
+            "showlocationmarker", "minzoom", "center", "layercache", "subtreelevels",
+            "writethreads", "optimizemode", "skipunchanged",
+            "chunkfingerprints", "tilemanifest", "storage", "skipblank", "deduplicate",
+            "zoomencoding", "texturegeneration"])
         tileSetOpts.update({"spawn": w.find_true_spawn()})  # TODO find a better way to do this
         for rset in rsets:
             tset = tileset.TileSet(w, rset, assetMrg, tex, tileSetOpts, tileset_dir)
@@ -583,7 +630,15 @@ def main():
     else:
         dispatch = dispatcher.MultiprocessingDispatcher(
             local_procs=config['processes'])
-    dispatch.render_all(tilesets, config['observer'])
+    # renders sharing a regionset can be done in one pass
+    if config['multirender']:
+        workers = tileset.group_tilesets(tilesets)
+    else:
+        workers = tilesets
+    dispatch.render_all(workers, config['observer'])
+    if config['watch']:
+        assetMrg.finalize(tilesets)
+        watch(config, list(worldcache.values()), tilesets, workers, dispatch, assetMrg)
     dispatch.close()
 
     assetMrg.finalize(tilesets)
@@ -604,6 +659,66 @@ def main():
     return 0
 
 
+def watch(config, worlds, tilesets, workers, dispatch, assetMrg):
+    """Renders the changes to the given worlds as they happen, until
+    interrupted. The tilesets must have been rendered once already, by
+    dispatching the given workers (see tileset.group_tilesets()). The
+    dispatcher's workers are kept between renders, along with their textures
+    and the region files and chunks they have loaded.
+
+    """
+    interval = config['watchinterval']
+    debounce = config['watchdebounce']
+    budget = config['watchbudget']
+    regionsets = [rset for w in worlds for rset in w.get_regionsets()]
+
+    # regiondirs with region files added or removed since the last render
+    layout_changed = set()
+    # when the first and the latest changes since the last render were seen
+    first_change = last_change = None
+    logging.info("Watching for changes to the world%s. Press Ctrl-C to stop.",
+                 "s" if len(worlds) != 1 else "")
+    while True:
+        try:
+            time.sleep(interval)
+            for rset in regionsets:
+                changed, added_or_removed = rset.refresh()
+                if changed:
+                    last_change = time.time()
+                    if first_change is None:
+                        first_change = last_change
+                if added_or_removed:
+                    layout_changed.add(rset.regiondir)
+        except KeyboardInterrupt:
+            logging.info("Stopped watching.")
+            return
+
+        postponed = any(ts.has_postponed_tiles() for ts in tilesets)
+        if first_change is None and not postponed:
+            continue
+        if first_change is not None and not postponed:
+            # Wait for the world to stay quiet for a bit, the server is likely
+            # to save more regions soon. But don't wait forever on a busy one.
+            now = time.time()
+            if now - last_change < debounce and now - first_change < 5 * debounce:
+                continue
+
+        logging.info("The world changed, rendering the changes...")
+        reload = False
+        for ts in tilesets:
+            if ts.prepare_update(ts.regionset.regiondir in layout_changed, budget):
+                reload = True
+        layout_changed.clear()
+        first_change = last_change = None
+
+        if reload and config['multirender']:
+            # The groups depend on the depths of the trees
+            workers = tileset.group_tilesets(tilesets)
+        dispatch.refresh_tilesets(reload)
+        dispatch.render_all(workers, config['observer'])
+        assetMrg.finalize(tilesets)
+
+
 def list_worlds():
     "Prints out a brief summary of saves found in the default directory"
     print()
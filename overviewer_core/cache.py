@@ -125,6 +125,10 @@ class LRUCache(object):
 
         cache[key] = link
 
+    def __iter__(self):
+        # Iterates over a copy of the keys, so items can be deleted meanwhile
+        return iter(list(self.cache))
+
     def __delitem__(self, key):
         # Used to flush the cache of this key
         cache = self.cache
@@ -13,6 +13,7 @@
 #    You should have received a copy of the GNU General Public License along
 #    with the Overviewer.  If not, see <http://www.gnu.org/licenses/>.
 
+import concurrent.futures
 import multiprocessing
 import multiprocessing.managers
 import queue
@@ -38,6 +39,10 @@ class Dispatcher:
         # list of (tileset, workitem, dependencies) tuples
         # keeps track of jobs waiting to run after dependencies finish
         self._pending_jobs = []
+        # list of (future, (tileset, workitem)) tuples
+        # keeps track of jobs whose do_work() returned but is still
+        # writing out its results in the background
+        self._background_jobs = []
 
     def render_all(self, tilesetlist, observer):
         """Render all of the tilesets in the given
@@ -134,6 +139,14 @@ class Dispatcher:
         for each work item."""
         pass
 
+    def refresh_tilesets(self, reload=False):
+        """Called between two render_all() calls with the same tilesets,
+        after the world changed. Subclasses that keep copies of the tilesets
+        elsewhere should have them call their refresh() method, or, if reload
+        is True, replace the copies since the tilesets changed in other ways
+        too."""
+        pass
+
     def dispatch(self, tileset, workitem):
         """Dispatch the given work item. The end result of this call
         should be running tileset.do_work(workitem) somewhere. This
@@ -141,10 +154,31 @@ class Dispatcher:
         that have completed since the last call. If tileset is None,
         then returning completed jobs is all this function should do.
         """
+        finished_jobs = []
         if tileset is not None:
-            tileset.do_work(workitem)
-            return [(tileset, workitem)]
-        return []
+            ret = tileset.do_work(workitem)
+            if isinstance(ret, concurrent.futures.Future):
+                self._background_jobs.append((ret, (tileset, workitem)))
+            else:
+                finished_jobs.append((tileset, workitem))
+        elif self._background_jobs:
+            # nothing new to do, so wait for some background work instead
+            concurrent.futures.wait([f for f, _ in self._background_jobs], timeout=1.0,
+                                    return_when=concurrent.futures.FIRST_COMPLETED)
+        finished_jobs += finish_background_jobs(self._background_jobs)
+        return finished_jobs
+
+
+def finish_background_jobs(jobs):
+    """Removes the jobs whose future is done from the given list of (future,
+    job) tuples, and returns those jobs. Errors that happened in the
+    background are raised here.
+    """
+    finished = [(f, job) for f, job in jobs if f.done()]
+    for f, job in finished:
+        jobs.remove((f, job))
+        f.result()
+    return [job for f, job in finished]
 
 
 class MultiprocessingDispatcherManager(multiprocessing.managers.BaseManager):
@@ -172,6 +206,8 @@ class MultiprocessingDispatcherManager(multiprocessing.managers.BaseManager):
         self.tilesets = []
         self.tileset_version = 0
         self.tileset_data = [[], 0]
+        # see MultiprocessingDispatcher.refresh_tilesets()
+        self.refresh_version = 0
 
         self.register("get_job_queue", callable=self._get_job_queue)
         self.register("get_result_queue", callable=self._get_results_queue)
@@ -217,6 +253,7 @@ class MultiprocessingDispatcherProcess(multiprocessing.Process):
         self.result_queue = manager.get_result_queue()
         self.signal_queue = manager.get_signal_queue()
         self.tileset_proxy = manager.get_tileset_data()
+        self.refresh_version = 0
 
     def update_tilesets(self):
         """A convenience function to update our local tilesets to the
@@ -224,6 +261,14 @@ class MultiprocessingDispatcherProcess(multiprocessing.Process):
         """
         self.tilesets, self.tileset_version = self.tileset_proxy._getvalue()
 
+    def refresh_tilesets(self, refresh_version):
+        """Has our local tilesets pick up changes to the world, see
+        MultiprocessingDispatcher.refresh_tilesets().
+        """
+        for tileset in self.tilesets:
+            tileset.refresh()
+        self.refresh_version = refresh_version
+
     def run(self):
         """The main work loop. Jobs are pulled from the job queue and
         executed, then the result is pushed onto the result
@@ -233,6 +278,12 @@ class MultiprocessingDispatcherProcess(multiprocessing.Process):
         """
         # per-process job get() timeout
         timeout = 1.0
+        # (future, (ti, workitem)) of jobs still writing in the background
+        background_jobs = []
+
+        def report_background_jobs():
+            for ti, workitem in finish_background_jobs(background_jobs):
+                self.result_queue.put((ti, workitem, None), False)
 
         # update our tilesets
         self.update_tilesets()
@@ -249,21 +300,34 @@ class MultiprocessingDispatcherProcess(multiprocessing.Process):
         self.result_queue.put(None, False)
         while True:
             try:
-                job = self.job_queue.get(True, timeout)
+                report_background_jobs()
+                # don't sit on finished background jobs for long
+                job = self.job_queue.get(True, 0.01 if background_jobs else timeout)
                 if job is None:
                     # this is a end-of-jobs sentinel
+                    concurrent.futures.wait([f for f, _ in background_jobs])
+                    report_background_jobs()
                     return
 
                 # unpack job
-                tv, ti, workitem = job
+                tv, rv, ti, workitem = job
 
                 if tv != self.tileset_version:
                     # our tilesets changed!
                     self.update_tilesets()
                     assert tv == self.tileset_version
+                    # and they're new, so up to date
+                    self.refresh_version = rv
+                elif rv != self.refresh_version:
+                    # the world changed
+                    self.refresh_tilesets(rv)
 
                 # do job
                 ret = self.tilesets[ti].do_work(workitem)
+                if isinstance(ret, concurrent.futures.Future):
+                    # it's only done once the background work is
+                    background_jobs.append((ret, (ti, workitem)))
+                    continue
                 result = (ti, workitem, ret,)
                 self.result_queue.put(result, False)
             except queue.Empty:
@@ -322,7 +386,18 @@ class MultiprocessingDispatcher(Dispatcher):
         self.pool = None
 
     def setup_tilesets(self, tilesets):
-        self.manager.set_tilesets(tilesets)
+        # Only send the tilesets over if they're not the ones the workers
+        # have already, which saves the workers from setting them up again
+        # (generating the textures, scanning the regions and so on)
+        if tilesets != self.manager.tilesets:
+            self.manager.set_tilesets(tilesets)
+
+    def refresh_tilesets(self, reload=False):
+        if reload:
+            self.manager.set_tilesets(self.manager.tilesets)
+        else:
+            # The workers refresh() their tilesets when they see this change
+            self.manager.refresh_version += 1
 
     def dispatch(self, tileset, workitem):
         # handle the no-new-work case
@@ -331,7 +406,8 @@ class MultiprocessingDispatcher(Dispatcher):
 
         # create and submit the job
         tileset_index = self.manager.tilesets.index(tileset)
-        self.job_queue.put((self.manager.tileset_version, tileset_index, workitem), False)
+        self.job_queue.put((self.manager.tileset_version, self.manager.refresh_version,
+                            tileset_index, workitem), False)
         self.outstanding_jobs += 1
 
         # make sure the queue doesn't fill up too much
@@ -0,0 +1,210 @@
+#    This file is part of the Minecraft Overviewer.
+#
+#    Minecraft Overviewer is free software: you can redistribute it and/or
+#    modify it under the terms of the GNU General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or (at
+#    your option) any later version.
+#
+#    Minecraft Overviewer is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+#    Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License along
+#    with the Overviewer.  If not, see <http://www.gnu.org/licenses/>.
+
+"""The renderer of the heightmap rendermode (see rendermodes.Heightmap).
+
+Instead of drawing every block with the C extension, it colors each column of
+a chunk after its topmost block, using the average color of that block's
+sprite, and draws the chunk as one flat layer. The whole chunk is done at
+once with numpy, which is a lot faster than a full render, so it makes for
+quick overview maps.
+
+The layer is drawn in the plane of the top faces of the blocks at DRAW_HEIGHT,
+so the tiles line up with the tiles of the other renders, and with the web
+viewer's coordinates.
+
+"""
+
+import numpy
+from PIL import Image
+
+from . import textures
+
+# The y the flat map is drawn at
+DRAW_HEIGHT = 64
+
+# Block ids that get biome colors, and the color table they use. See base.c;
+# the heightmap always uses the colors of the default biome, forest.
+_GRASS, _FOLIAGE, _WATER = range(3)
+_TINTED = {
+    2: _GRASS, 31: _GRASS, 104: _GRASS, 105: _GRASS, 106: _GRASS, 111: _GRASS, 175: _GRASS,
+    8: _WATER, 9: _WATER,
+    18: _FOLIAGE, 161: _FOLIAGE,
+}
+_FOREST_TEMPERATURE = 0.7
+_FOREST_RAINFALL = 0.8
+
+
+class BlockColors(object):
+    """The average colors of the block sprites of a Textures object.
+
+    The colors are worked out the first time they're asked for, from the top
+    half of the sprites (where the top face of full blocks is).
+
+    """
+    def __init__(self, texobj):
+        self.textures = texobj
+        self.colors = {}
+
+        temp = _FOREST_TEMPERATURE
+        rain = _FOREST_RAINFALL * temp
+        tablex = int(255 - 255 * temp)
+        tabley = int(255 - 255 * rain)
+        self.tints = {}
+        for table, colors in [(_GRASS, texobj.load_grass_color()),
+                              (_FOLIAGE, texobj.load_foliage_color()),
+                              (_WATER, texobj.load_water_color())]:
+            self.tints[table] = colors[tabley * 256 + tablex][:3]
+
+    def _get_sprite(self, blockid, data):
+        """Returns the sprite for the given block, or None. If there's no
+        sprite for this data value, the one for data 0 or else any other
+        sprite of the block is used instead.
+
+        """
+        if not 0 <= blockid < textures.max_blockid:
+            return None
+        blockmap = self.textures.blockmap
+        start = blockid * textures.max_data
+        indices = [start + data, start] + list(range(start + 1, start + textures.max_data))
+        for index in indices:
+            tex = blockmap[index]
+            if tex is textures.LAZY:
+                tex = self.textures.generate_block(index)
+            if tex is not None and tex[0] is not None:
+                return tex[0]
+        return None
+
+    def get(self, blockid, data):
+        """Returns the (r, g, b, a) color of the given block. The color is
+        opaque, unless the block has no sprite.
+
+        """
+        key = (blockid, data)
+        color = self.colors.get(key)
+        if color is not None:
+            return color
+
+        color = (0, 0, 0, 0)
+        sprite = self._get_sprite(blockid, data)
+        if sprite is not None:
+            size = sprite.size[0]
+            pixels = numpy.asarray(sprite.convert("RGBA").crop((0, 0, size, size // 2)),
+                                   dtype=numpy.float64)
+            alpha = pixels[:, :, 3:]
+            if alpha.sum() > 0:
+                rgb = (pixels[:, :, :3] * alpha).sum(axis=(0, 1)) / alpha.sum()
+                if blockid in _TINTED:
+                    rgb = rgb * self.tints[_TINTED[blockid]] / 255
+                color = tuple(int(c) for c in rgb) + (255,)
+        self.colors[key] = color
+        return color
+
+
+class HeightmapRenderer(object):
+    """Draws the chunks of a TileSet with a heightmap rendermode. primitive
+    is its rendermodes.Heightmap object.
+
+    """
+    def __init__(self, primitive, texobj):
+        self.shading = primitive.option_values['shading']
+        self.sealevel = primitive.option_values['sealevel']
+        self.texture_size = texobj.texture_size
+        self.colors = BlockColors(texobj)
+
+    def get_columns(self, chunk):
+        """Returns (blocks, data, height, light) arrays, indexed [z, x], of the
+        topmost block of each column of the given chunk. height is -1 and
+        blocks 0 for empty columns. light is the light level above the block.
+
+        """
+        shape = (16 * 16, 16, 16)
+        blocks = numpy.zeros(shape, dtype=numpy.uint16)
+        data = numpy.zeros(shape, dtype=numpy.uint8)
+        skylight = numpy.full(shape, 15, dtype=numpy.uint8)
+        blocklight = numpy.zeros(shape, dtype=numpy.uint8)
+        for section in chunk['Sections']:
+            y = section['Y']
+            if not 0 <= y < 16:
+                continue
+            ys = slice(y * 16, y * 16 + 16)
+            blocks[ys] = section['Blocks']
+            data[ys] = section['Data']
+            skylight[ys] = section['SkyLight']
+            blocklight[ys] = section['BlockLight']
+
+        nonair = blocks != 0
+        height = shape[0] - 1 - numpy.argmax(nonair[::-1], axis=0)
+        height[~nonair.any(axis=0)] = -1
+
+        z, x = numpy.indices((16, 16))
+        top = numpy.maximum(height, 0)
+        above = numpy.minimum(height + 1, shape[0] - 1)
+        light = numpy.maximum(skylight[above, z, x], blocklight[above, z, x])
+        light[height == shape[0] - 1] = 15
+        topblocks = numpy.where(height >= 0, blocks[top, z, x], 0)
+        return topblocks, data[top, z, x], height, light
+
+    def get_chunk_image(self, chunk):
+        """Returns a 16x16 RGBA image of the given chunk, one pixel per column
+        (x to the right, z down).
+
+        """
+        blocks, data, height, light = self.get_columns(chunk)
+
+        # Look up the color of each distinct block only once
+        keys, inverse = numpy.unique(blocks.astype(numpy.uint32) << 16 | data,
+                                     return_inverse=True)
+        palette = numpy.array([self.colors.get(int(k) >> 16, int(k) & 0xffff) for k in keys],
+                              dtype=numpy.float64)
+        pixels = palette[inverse.reshape(blocks.shape)]
+
+        rgb = pixels[:, :, :3]
+        if self.shading == "height":
+            # The same fading as the height-fading primitive
+            y = height * 128.0 / (2 * self.sealevel)
+            alpha = (1.0 / (1 + numpy.exp((70 - y) / 11.0))) * 0.6 - 0.55
+            alpha = alpha[:, :, numpy.newaxis]
+            rgb[:] = numpy.where(alpha < 0, rgb * (1 + alpha), rgb + (255 - rgb) * alpha)
+        elif self.shading == "light":
+            # The same light levels as the lighting primitive
+            rgb *= (0.8 ** (15 - light))[:, :, numpy.newaxis]
+
+        return Image.fromarray(numpy.clip(pixels, 0, 255).astype(numpy.uint8), "RGBA")
+
+    def render_chunk(self, regionset, chunkx, chunky, chunkz, img, xpos, ypos):
+        """Draws the given chunk onto img, like c_overviewer.render_loop()
+        would draw its chunk section chunky at xpos, ypos. The flat layer is
+        only drawn for the section containing DRAW_HEIGHT, the others are
+        skipped.
+
+        """
+        if chunky != DRAW_HEIGHT // 16:
+            return
+        chunk = regionset.get_chunk(chunkx, chunkz)
+        chunkimg = self.get_chunk_image(chunk)
+
+        # Map the columns onto the top faces of the blocks at DRAW_HEIGHT.
+        # Block x, z of the section is drawn at
+        #   (x + z) * ts / 2, (z - x + 15) * ts / 4 + 16 * ts / 2 - (y + 1) * ts / 2
+        # (see iterate.c), and its top face is the diamond in the top half
+        # of that.
+        ts = self.texture_size
+        invts = 1.0 / ts
+        layer = chunkimg.transform((16 * ts, 8 * ts), Image.AFFINE,
+                                   (invts, -2 * invts, 8, invts, 2 * invts, -8),
+                                   Image.NEAREST)
+        y = DRAW_HEIGHT % 16
+        img.paste(layer, (xpos, ypos + 8 * ts - (y + 1) * ts // 2), layer)
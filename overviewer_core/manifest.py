@@ -0,0 +1,277 @@
+#    This file is part of the Minecraft Overviewer.
+#
+#    Minecraft Overviewer is free software: you can redistribute it and/or
+#    modify it under the terms of the GNU General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or (at
+#    your option) any later version.
+#
+#    Minecraft Overviewer is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+#    Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License along
+#    with the Overviewer.  If not, see <http://www.gnu.org/licenses/>.
+
+"""This module keeps records about a TileSet's output directory, in SQLite
+databases inside it: which tiles were written (TileManifest), and what the
+chunks they were rendered from looked like (ChunkFingerprints).
+
+For the TileManifest, every worker process (and every writer thread in it)
+opens its own connection to the database, and they take turns recording the
+tiles they write. The database isn't in WAL mode, since that needs memory
+shared between the processes using it, which a network filesystem can't
+provide; output directories are often on one.
+
+"""
+
+import os
+import os.path
+import sqlite3
+import threading
+import time
+
+
+class TileManifest(object):
+    """Records each tile written: its size and mtime afterwards, when it was
+    written, and optionally a hash of its contents.
+
+    The hashes are used to tell whether a tile needs writing at all. A hash is
+    only trusted while the file still has the recorded size and mtime, so
+    tiles changed by anything else are never mistaken for unchanged. The sizes
+    and mtimes come from the TileSet's storage (see storage.py).
+
+    The mtimes can stand in for stat() calls on the tiles in check-tiles mode,
+    as long as every tile write since the manifest was last complete has been
+    recorded; TileSet keeps track of that.
+
+    Blank tiles that weren't stored at all (see the skipblank option) are
+    recorded too, with just their mtime, and the hashes let identical tiles
+    be found for the deduplicate option.
+
+    Whether the optimizers were run on a tile since it was written is
+    recorded as well, so tiles that are left alone aren't optimized again.
+
+    Paths are stored relative to the output directory.
+
+    """
+    filename = ".manifest.sqlite"
+
+    def __init__(self, outputdir):
+        self.outputdir = outputdir
+        self.path = os.path.join(outputdir, self.filename)
+        self._local = threading.local()
+
+    def _get_connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            # This also takes manifests made in WAL mode by older versions
+            # out of it
+            conn.execute("PRAGMA journal_mode=TRUNCATE")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS tiles ("
+                         "path TEXT PRIMARY KEY, hash BLOB, size INTEGER, mtime INTEGER, "
+                         "rendertime REAL, blank INTEGER, optimized INTEGER)")
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(tiles)")]
+            # made by an older version
+            if "blank" not in columns:
+                conn.execute("ALTER TABLE tiles ADD COLUMN blank INTEGER")
+            if "optimized" not in columns:
+                conn.execute("ALTER TABLE tiles ADD COLUMN optimized INTEGER")
+            conn.execute("CREATE INDEX IF NOT EXISTS tiles_hash ON tiles (hash)")
+            self._local.conn = conn
+        return conn
+
+    def _relpath(self, imgpath):
+        return os.path.relpath(imgpath, self.outputdir).replace(os.sep, "/")
+
+    def is_unchanged(self, imgpath, digest, stat):
+        """Returns True if imgpath was last written by set() with the same
+        digest. stat is the tile's current (size, mtime) as given by the
+        TileSet's storage, or None if it doesn't exist.
+
+        """
+        if stat is None:
+            return False
+        row = self._get_connection().execute(
+            "SELECT hash, size, mtime FROM tiles WHERE path = ?",
+            (self._relpath(imgpath),)).fetchone()
+        if row is None or row[0] is None or bytes(row[0]) != digest:
+            return False
+        return tuple(stat) == (row[1], row[2])
+
+    def set(self, imgpath, stat, digest=None, optimized=False):
+        """Records that imgpath was just written, with the given digest if
+        any. stat is its (size, mtime) once it's in place with its final
+        mtime. optimized tells whether the optimizers were run on it.
+
+        """
+        self._get_connection().execute(
+            "INSERT OR REPLACE INTO tiles (path, hash, size, mtime, rendertime, optimized) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (self._relpath(imgpath), digest, stat[0], stat[1], time.time(), int(optimized)))
+
+    def set_unchanged(self, imgpath, stat):
+        """Records that imgpath was rendered again, but left alone since it
+        was unchanged (see is_unchanged()), except for its mtime. stat is its
+        new (size, mtime).
+
+        """
+        self._get_connection().execute(
+            "UPDATE tiles SET size = ?, mtime = ?, rendertime = ? WHERE path = ?",
+            (stat[0], stat[1], time.time(), self._relpath(imgpath)))
+
+    def set_optimized(self, imgpath, stat):
+        """Records that the optimizers were run on imgpath, which changes its
+        size but not its contents. stat is its new (size, mtime).
+
+        """
+        self._get_connection().execute(
+            "UPDATE tiles SET size = ?, mtime = ?, optimized = 1 WHERE path = ?",
+            (stat[0], stat[1], self._relpath(imgpath)))
+
+    def is_optimized(self, imgpath, stat):
+        """Returns True if the optimizers were run on imgpath since it was
+        last written, and it wasn't changed since. stat is as for
+        is_unchanged().
+
+        """
+        if stat is None:
+            return False
+        row = self._get_connection().execute(
+            "SELECT optimized, size, mtime FROM tiles WHERE path = ?",
+            (self._relpath(imgpath),)).fetchone()
+        return row is not None and bool(row[0]) and tuple(stat) == (row[1], row[2])
+
+    def set_stat(self, imgpath, stat):
+        """Records the (size, mtime) of a tile that was already there. Any
+        hash recorded for it is forgotten, since it's not known whether the
+        file still matches it.
+
+        """
+        self._get_connection().execute(
+            "INSERT OR REPLACE INTO tiles (path, size, mtime) VALUES (?, ?, ?)",
+            (self._relpath(imgpath), stat[0], stat[1]))
+
+    def set_blank(self, imgpath, mtime):
+        """Records that imgpath is blank, and was not stored."""
+        self._get_connection().execute(
+            "INSERT OR REPLACE INTO tiles (path, mtime, rendertime, blank) VALUES (?, ?, ?, 1)",
+            (self._relpath(imgpath), int(mtime), time.time()))
+
+    def get_blank_mtime(self, imgpath):
+        """Returns the mtime recorded for the given tile if it is blank, or
+        None if it isn't, or there is no record of it.
+
+        """
+        row = self._get_connection().execute(
+            "SELECT mtime FROM tiles WHERE path = ? AND blank",
+            (self._relpath(imgpath),)).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def find(self, digest, mtime=None, limit=8):
+        """Returns up to limit (imgpath, (size, mtime)) tuples of tiles that
+        were written with the given digest, and also the given mtime if
+        that's not None. Whether they still have the recorded size and mtime
+        is up to the caller to check.
+
+        """
+        query = "SELECT path, size, mtime FROM tiles WHERE hash = ?"
+        args = (digest,)
+        if mtime is not None:
+            query += " AND mtime = ?"
+            args += (int(mtime),)
+        rows = self._get_connection().execute(query + " LIMIT ?", args + (limit,)).fetchall()
+        return [(os.path.join(self.outputdir, *path.split("/")), (size, mtime))
+                for path, size, mtime in rows]
+
+    def get_mtime(self, imgpath):
+        """Returns the mtime recorded for the given tile, or None if there is
+        no record of it.
+
+        """
+        row = self._get_connection().execute(
+            "SELECT mtime FROM tiles WHERE path = ?", (self._relpath(imgpath),)).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def has_tree(self, dirpath):
+        """Returns True if there are records of any tiles inside the given
+        directory.
+
+        """
+        prefix = self._relpath(dirpath) + "/"
+        # "0" is the character after "/"
+        row = self._get_connection().execute(
+            "SELECT 1 FROM tiles WHERE path >= ? AND path < ? LIMIT 1",
+            (prefix, prefix[:-1] + "0")).fetchone()
+        return row is not None
+
+    def remove(self, imgpath):
+        """Forgets the given tile."""
+        self._get_connection().execute(
+            "DELETE FROM tiles WHERE path = ?", (self._relpath(imgpath),))
+
+    def remove_tree(self, dirpath):
+        """Forgets all the tiles inside the given directory."""
+        prefix = self._relpath(dirpath) + "/"
+        self._get_connection().execute(
+            "DELETE FROM tiles WHERE path >= ? AND path < ?", (prefix, prefix[:-1] + "0"))
+
+    def clear(self):
+        """Forgets all tiles."""
+        self._get_connection().execute("DELETE FROM tiles")
+
+    def close(self):
+        """Closes this thread's connection, if it has one."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class ChunkFingerprints(object):
+    """Records a fingerprint of the contents of each chunk as of the last
+    render (see RegionSet.get_chunk_fingerprint()), so the chunk scan can tell
+    chunks that were really changed from ones that were only saved again.
+
+    This is only used by the master process, during the chunk scan. Changes
+    are only written out by commit().
+
+    """
+    filename = ".chunks.sqlite"
+
+    def __init__(self, outputdir):
+        self.path = os.path.join(outputdir, self.filename)
+        self.conn = sqlite3.connect(self.path, timeout=60)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS chunks ("
+                          "x INTEGER, z INTEGER, hash BLOB, PRIMARY KEY (x, z))")
+
+    def get(self, x, z):
+        """Returns the fingerprint recorded for the given chunk, or None."""
+        row = self.conn.execute("SELECT hash FROM chunks WHERE x = ? AND z = ?",
+                                (x, z)).fetchone()
+        if row is None:
+            return None
+        return bytes(row[0])
+
+    def set(self, x, z, fingerprint):
+        self.conn.execute("INSERT OR REPLACE INTO chunks (x, z, hash) VALUES (?, ?, ?)",
+                          (x, z, fingerprint))
+
+    def clear(self):
+        """Forgets all fingerprints, for when every tile gets rendered
+        anyways, or the fingerprints can't be trusted.
+
+        """
+        self.conn.execute("DELETE FROM chunks")
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
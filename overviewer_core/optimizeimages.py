@@ -16,6 +16,19 @@
 import os
 import subprocess
 
+from PIL import Image
+
+
+# The most images to pass to one run of an optimizer, to stay clear of
+# command line length limits
+MAX_BATCH = 64
+
+
+def batches(imgs):
+    """Splits a list of images into lists of at most MAX_BATCH images."""
+    imgs = list(imgs)
+    return [imgs[i:i + MAX_BATCH] for i in range(0, len(imgs), MAX_BATCH)]
+
 
 class Optimizer:
     binaryname = ""
@@ -27,6 +40,12 @@ class Optimizer:
     def optimize(self, img):
         raise NotImplementedError("I can't let you do that, Dave.")
 
+    def optimize_batch(self, imgs):
+        """Optimizes all of the given images. Optimizers that can take several
+        files at once should override this to do it with fewer processes."""
+        for img in imgs:
+            self.optimize(img)
+
     def fire_and_forget(self, args):
         subprocess.check_call(args)
 
@@ -104,6 +123,40 @@ class pngnq(NonAtomicOptimizer, PNGOptimizer):
         return False
 
 
+class pilquantize(Optimizer, PNGOptimizer):
+    """Quantizes tiles to a palette like pngnq does, but with Pillow, in the
+    worker process itself. No external program is needed."""
+
+    def __init__(self, colors=256, dither="n"):
+        if colors < 2 or colors > 256:
+            raise Exception("Invalid number of colors '%d' for pilquantize!" %
+                            colors)
+        if dither not in ["n", "f"]:
+            raise Exception("Invalid dither method '%s' for pilquantize!" %
+                            dither)
+        self.colors = colors
+        self.dither = dither
+
+    def check_availability(self):
+        pass
+
+    def optimize(self, img):
+        with Image.open(img) as src:
+            src = src.convert("RGBA")
+        # Pillow can only quantize RGBA images with the fast octree method
+        quantized = src.quantize(self.colors, method=Image.FASTOCTREE,
+                                 dither=Image.FLOYDSTEINBERG if self.dither == "f"
+                                 else Image.NONE)
+
+        # Write next to it and move it into place, so there's never a
+        # half-written tile
+        quantized.save(img + ".tmp", "png", optimize=True)
+        os.replace(img + ".tmp", img)
+
+    def is_crusher(self):
+        return False
+
+
 class pngcrush(NonAtomicOptimizer, PNGOptimizer):
     binarynames = ["pngcrush"]
 
@@ -130,8 +183,12 @@ class optipng(Optimizer, PNGOptimizer):
         self.olevel = olevel
 
     def optimize(self, img):
-        Optimizer.fire_and_forget(self, [self.binaryname, "-o" +
-                                         str(self.olevel), "-quiet", img])
+        self.optimize_batch([img])
+
+    def optimize_batch(self, imgs):
+        for batch in batches(imgs):
+            Optimizer.fire_and_forget(self, [self.binaryname, "-o" +
+                                             str(self.olevel), "-quiet"] + batch)
 
     def is_crusher(self):
         return True
@@ -145,8 +202,12 @@ class advpng(Optimizer, PNGOptimizer):
         self.olevel = olevel
 
     def optimize(self, img):
-        Optimizer.fire_and_forget(self, [self.binaryname, "-z" +
-                                         str(self.olevel), "-q", img])
+        self.optimize_batch([img])
+
+    def optimize_batch(self, imgs):
+        for batch in batches(imgs):
+            Optimizer.fire_and_forget(self, [self.binaryname, "-z" +
+                                             str(self.olevel), "-q"] + batch)
 
     def is_crusher(self):
         return True
@@ -169,6 +230,9 @@ class jpegoptim(Optimizer, JPEGOptimizer):
             self.target_size = target_size
 
     def optimize(self, img):
+        self.optimize_batch([img])
+
+    def optimize_batch(self, imgs):
         args = [self.binaryname, "-q", "-p"]
         if self.quality is not None:
             args.append("-m" + str(self.quality))
@@ -176,9 +240,8 @@ class jpegoptim(Optimizer, JPEGOptimizer):
         if self.target_size is not None:
             args.append("-S" + str(self.target_size))
 
-        args.append(img)
-
-        Optimizer.fire_and_forget(self, args)
+        for batch in batches(imgs):
+            Optimizer.fire_and_forget(self, args + batch)
 
     def is_crusher(self):
         # Technically, optimisation is lossless if input image quality
@@ -201,9 +264,13 @@ class oxipng(Optimizer, PNGOptimizer):
         self.threads = threads
 
     def optimize(self, img):
-        Optimizer.fire_and_forget(self, [self.binaryname, "-o" +
-                                         str(self.olevel), "-q", "-t" +
-                                         str(self.threads), img])
+        self.optimize_batch([img])
+
+    def optimize_batch(self, imgs):
+        for batch in batches(imgs):
+            Optimizer.fire_and_forget(self, [self.binaryname, "-o" +
+                                             str(self.olevel), "-q", "-t" +
+                                             str(self.threads)] + batch)
 
     def is_crusher(self):
         return True
@@ -217,3 +284,29 @@ def optimize_image(imgpath, imgformat, optimizers):
         elif imgformat == 'jpg':
             if isinstance(opt, JPEGOptimizer):
                 opt.optimize(imgpath)
+
+
+def optimize_images(imgpaths, imgformat, optimizers):
+    """Like optimize_image(), for a batch of images at once. The images keep
+    their mtimes, which the render checks rely on. Images that don't exist are
+    skipped."""
+    mtimes = []
+    for imgpath in imgpaths:
+        try:
+            mtimes.append((imgpath, os.stat(imgpath).st_mtime))
+        except OSError:
+            pass
+    imgpaths = [imgpath for imgpath, _ in mtimes]
+    if not imgpaths:
+        return
+
+    for opt in optimizers:
+        if imgformat == 'png':
+            if isinstance(opt, PNGOptimizer):
+                opt.optimize_batch(imgpaths)
+        elif imgformat == 'jpg':
+            if isinstance(opt, JPEGOptimizer):
+                opt.optimize_batch(imgpaths)
+
+    for imgpath, mtime in mtimes:
+        os.utime(imgpath, (mtime, mtime))
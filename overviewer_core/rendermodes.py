@@ -13,8 +13,10 @@
 #    You should have received a copy of the GNU General Public License along
 #    with the Overviewer.  If not, see <http://www.gnu.org/licenses/>.
 
+import numpy
 from PIL import Image
 from . import textures
+from .cache import LRUCache
 
 """The contents of this file are imported into the namespace of config files.
 It also defines the render primitive objects, which are used by the C code.
@@ -41,6 +43,17 @@ class RenderPrimitive(object):
             if not name in self.option_values:
                 self.option_values[name] = default
 
+    def _get_sized(self, name, size, make):
+        """Returns make(), cached under the given name and size. This is for
+        the images the C code needs at the size of the block sprites, see
+        Textures.texture_size.
+
+        """
+        sized = self.__dict__.setdefault("_sized", {})
+        if (name, size) not in sized:
+            sized[(name, size)] = make()
+        return sized[(name, size)]
+
 class Base(RenderPrimitive):
     name = "base"
     options = {
@@ -63,6 +76,15 @@ class HeightFading(RenderPrimitive):
     black_color = Image.new("RGB", (24,24), (0,0,0))
     white_color = Image.new("RGB", (24,24), (255,255,255))
 
+    def get_colors(self, size):
+        """Returns (black_color, white_color) for block sprites of the given
+        size."""
+        if size == 24:
+            return (self.black_color, self.white_color)
+        return self._get_sized("colors", size, lambda: (
+            Image.new("RGB", (size,size), (0,0,0)),
+            Image.new("RGB", (size,size), (255,255,255))))
+
 class Depth(RenderPrimitive):
     name = "depth"
     options = {
@@ -132,7 +154,17 @@ class Lighting(RenderPrimitive):
         facemasks = getattr(self, "_facemasks", None)
         if facemasks:
             return facemasks
-        
+        self._facemasks = self._build_facemasks()
+        return self._facemasks
+
+    def get_facemasks(self, size):
+        """Returns the facemasks for block sprites of the given size."""
+        if size == 24:
+            return self.facemasks
+        return self._get_sized("facemasks", size, lambda: tuple(
+            mask.resize((size,size), Image.NEAREST) for mask in self.facemasks))
+
+    def _build_facemasks(self):
         white = Image.new("L", (24,24), 255)
         
         top = Image.new("L", (24,24), 0)
@@ -159,8 +191,7 @@ class Lighting(RenderPrimitive):
         for x,y in [(13,11), (17,9), (21,7)]:
             right.putpixel((x,y), 0)
         
-        self._facemasks = (top, left, right)
-        return self._facemasks
+        return (top, left, right)
 
 class SmoothLighting(Lighting):
     name = "smooth-lighting"
@@ -199,6 +230,20 @@ class Overlay(RenderPrimitive):
         self._facemask_top = top
         return top
 
+    def get_whitecolor(self, size):
+        """Returns whitecolor for block sprites of the given size."""
+        if size == 24:
+            return self.whitecolor
+        return self._get_sized("whitecolor", size, lambda: Image.new(
+            "RGBA", (size,size), (255, 255, 255, 255)))
+
+    def get_facemask_top(self, size):
+        """Returns facemask_top for block sprites of the given size."""
+        if size == 24:
+            return self.facemask_top
+        return self._get_sized("facemask_top", size, lambda: self.facemask_top.resize(
+            (size,size), Image.NEAREST))
+
 class SpawnOverlay(Overlay):
     name = "overlay-spawn"
 
@@ -224,6 +269,53 @@ class MineralOverlay(Overlay):
         'minerals' : ('a list of (blockid, (r, g, b)) tuples for coloring minerals', None),
     }
 
+    def get_mineral_summary(self, regionset, chunkx, chunkz, blockids):
+        """Returns a summary of the given minerals in each column of the
+        given chunk, for the C code to read instead of scanning the columns
+        for every block it draws. The summary is a (best, lowest) tuple:
+
+        * lowest is indexed [mineral, z, x], and is the lowest y the mineral
+          is at in each column, or 0xffff if it isn't there.
+        * best is indexed [y, z, x], and is the index of the first mineral
+          in blockids that's at or below y in each column, or 255 if none is.
+
+        Summaries are cached for the last few chunks, as each one is drawn
+        one section at a time.
+
+        """
+        chunk = regionset.get_chunk(chunkx, chunkz)
+        summaries = self.__dict__.setdefault("_summaries", LRUCache(size=64))
+        key = (id(chunk), blockids)
+        try:
+            cached_chunk, summary = summaries[key]
+            if cached_chunk is chunk:
+                return summary
+        except KeyError:
+            pass
+
+        blocks = numpy.zeros((16 * 16, 16, 16), dtype=numpy.uint16)
+        for section in chunk['Sections']:
+            y = section['Y']
+            if 0 <= y < 16:
+                blocks[y * 16:(y + 1) * 16] = section['Blocks']
+
+        lowest = numpy.full((len(blockids), 16, 16), 0xffff, dtype=numpy.uint16)
+        for i, blockid in enumerate(blockids):
+            found = blocks == blockid
+            lowest[i] = numpy.where(found.any(axis=0), found.argmax(axis=0), 0xffff)
+
+        # the tops of the columns go up to y=256, the block above the world
+        best = numpy.full((16 * 16 + 1, 16, 16), 255, dtype=numpy.uint8)
+        if blockids:
+            heights = numpy.arange(16 * 16 + 1).reshape((-1, 1, 1, 1))
+            present = lowest[numpy.newaxis] <= heights
+            below = present.any(axis=1)
+            best[below] = present.argmax(axis=1)[below]
+
+        summary = (best, lowest)
+        summaries[key] = (chunk, summary)
+        return summary
+
 class BiomeOverlay(Overlay):
     name = "overlay-biomes"
     options = {
@@ -237,6 +329,18 @@ class Hide(RenderPrimitive):
         'blocks' : ('a list of blockids or (blockid, data) tuples of blocks to hide', []),
     }
 
+class Heightmap(RenderPrimitive):
+    """Unlike the other primitives, this one has no C code: a rendermode
+    made of it is drawn by the heightmap module instead, as a flat map of the
+    topmost block of each column. It can't be combined with other primitives.
+
+    """
+    name = "heightmap"
+    options = {
+        "shading": ("how to shade the map: \"height\", \"light\" or \"none\"", "height"),
+        "sealevel": ("target sea level, for the height shading", 64),
+    }
+
 # Built-in rendermodes for your convenience!
 normal = [Base(), EdgeLines()]
 lighting = [Base(), EdgeLines(), Lighting()]
@@ -250,3 +354,4 @@ nether = [Base(), EdgeLines(), Nether()]
 nether_lighting = [Base(), EdgeLines(), Nether(), Lighting()]
 nether_smooth_lighting = [Base(), EdgeLines(), Nether(), SmoothLighting()]
 cave = [Base(), EdgeLines(), Cave(), DepthTinting()]
+heightmap = [Heightmap()]
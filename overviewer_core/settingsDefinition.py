@@ -76,15 +76,30 @@ def get_default_config():
                 "imgquality": Setting(required=False, validator=validateImgQuality, default=95),
                 "imglossless": Setting(required=False, validator=validateBool,
                                     default=True),
+                "zoomencoding": Setting(required=False, validator=validateZoomEncoding,
+                                        default={}),
                 "bgcolor": Setting(required=True, validator=validateBGColor, default="1a1a1a"),
                 "defaultzoom": Setting(required=True, validator=validateDefaultZoom, default=1),
                 "optimizeimg": Setting(required=True, validator=validateOptImg, default=[]),
+                "optimizemode": Setting(required=True, validator=validateOptimizeMode, default="inline"),
                 "nomarkers": Setting(required=False, validator=validateBool, default=None),
                 "texturepath": Setting(required=False, validator=validateTexturePath, default=None),
+                "texturesize": Setting(required=True, validator=validateTextureSize, default=24),
+                "texturegeneration": Setting(required=True, validator=validateTextureGeneration,
+                                             default="eager"),
                 "renderchecks": Setting(required=False, validator=validateInt, default=None),
                 "rerenderprob": Setting(required=True, validator=validateRerenderprob, default=0),
                 "crop": Setting(required=False, validator=validateCrop, default=None),
                 "changelist": Setting(required=False, validator=validateStr, default=None),
+                "chunkfingerprints": Setting(required=True, validator=validateBool, default=False),
+                "layercache": Setting(required=True, validator=validateBool, default=False),
+                "skipunchanged": Setting(required=True, validator=validateBool, default=False),
+                "tilemanifest": Setting(required=True, validator=validateBool, default=False),
+                "storage": Setting(required=True, validator=validateStorage, default="files"),
+                "skipblank": Setting(required=True, validator=validateBool, default=False),
+                "deduplicate": Setting(required=True, validator=validateBool, default=False),
+                "subtreelevels": Setting(required=True, validator=validateSubtreeLevels, default=0),
+                "writethreads": Setting(required=True, validator=validateWriteThreads, default=0),
                 "markers": Setting(required=False, validator=validateMarkers, default=[]),
                 "overlay": Setting(required=False, validator=validateOverlays, default=[]),
                 "showspawn": Setting(required=False, validator=validateBool, default=True),
@@ -109,6 +124,18 @@ def get_default_config():
 
     conf['processes'] = Setting(required=True, validator=int, default=-1)
 
+    conf['multirender'] = Setting(required=True, validator=validateBool, default=False)
+
+    conf['texturecache'] = Setting(required=True, validator=validateTextureCache, default=True)
+
+    conf['watch'] = Setting(required=True, validator=validateBool, default=False)
+
+    conf['watchinterval'] = Setting(required=True, validator=validateWatchInterval, default=10)
+
+    conf['watchdebounce'] = Setting(required=True, validator=validateWatchDebounce, default=30)
+
+    conf['watchbudget'] = Setting(required=True, validator=validateWatchBudget, default=0)
+
     # TODO clean up this ugly in sys.argv hack
     if platform.system() == 'Windows' or not sys.stdout.isatty() or "--simple" in sys.argv:
         obs = LoggingObserver()
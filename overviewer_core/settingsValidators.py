@@ -102,6 +102,16 @@ def validateRenderMode(mode):
         if not isinstance(m, rendermodes.RenderPrimitive):
             raise ValidationException("%r is not a valid rendermode primitive." % m)
 
+    for m in mode:
+        if isinstance(m, rendermodes.Heightmap):
+            if len(mode) > 1:
+                raise ValidationException("The Heightmap primitive can't be combined with "
+                                          "other rendermode primitives.")
+            if m.option_values['shading'] not in ("height", "light", "none"):
+                raise ValidationException("%r is not a valid Heightmap shading. Valid values "
+                                          "are \"height\", \"light\" and \"none\"."
+                                          % m.option_values['shading'])
+
     return mode
 
 
@@ -135,6 +145,74 @@ def validateRerenderprob(s):
     return val
 
 
+def validateSubtreeLevels(levels):
+    val = int(levels)
+    if val < 0:
+        raise ValidationException("%r is not a valid number of subtree levels. "
+                                  "Should be 0 or more." % levels)
+    return val
+
+
+def validateOptimizeMode(mode):
+    if mode not in ("inline", "background", "deferred"):
+        raise ValidationException("%r is not a valid optimizemode. Should be "
+                                  "'inline', 'background' or 'deferred'." % mode)
+    return mode
+
+
+def validateStorage(storage):
+    if storage not in ("files", "sqlite"):
+        raise ValidationException("%r is not a valid storage. Should be "
+                                  "'files' or 'sqlite'." % storage)
+    return storage
+
+
+def validateTextureSize(size):
+    val = int(size)
+    if val not in (24, 12, 6):
+        raise ValidationException("%r is not a valid texturesize. Should be 24, 12 or 6." % size)
+    return val
+
+
+def validateTextureGeneration(mode):
+    if mode not in ("eager", "lazy", "prescan"):
+        raise ValidationException("%r is not a valid texturegeneration. Should be "
+                                  "'eager', 'lazy' or 'prescan'." % mode)
+    return mode
+
+
+def validateWriteThreads(threads):
+    val = int(threads)
+    if val < 0:
+        raise ValidationException("%r is not a valid number of write threads. "
+                                  "Should be 0 or more." % threads)
+    return val
+
+
+def validateWatchInterval(seconds):
+    val = float(seconds)
+    if val <= 0:
+        raise ValidationException("%r is not a valid number of seconds. "
+                                  "Should be more than 0." % seconds)
+    return val
+
+
+def validateWatchDebounce(seconds):
+    val = float(seconds)
+    if val < 0:
+        raise ValidationException("%r is not a valid number of seconds. "
+                                  "Should be 0 or more." % seconds)
+    return val
+
+
+def validateWatchBudget(budget):
+    val = int(budget)
+    if val < 0:
+        raise ValidationException("%r is not a valid watch budget. "
+                                  "Should be 0 or more." % budget)
+    return val
+
+
 def validateImgFormat(fmt):
     if fmt not in ("png", "jpg", "jpeg", "webp"):
         raise ValidationException("%r is not a valid image format." % fmt)
@@ -155,6 +233,46 @@ def validateImgQuality(qual):
     return intqual
 
 
+def validateZoomEncoding(value):
+    """Validates a dict mapping zoom levels (or "default") to dicts of
+    encoder settings.
+
+    """
+    if not isinstance(value, dict):
+        raise ValidationException("zoomencoding must be a dict mapping zoom levels to "
+                                  "dicts of encoder settings.")
+    validators = {
+        "compress_level": lambda v: validateRange(v, 0, 9, "compress_level"),
+        "quality": validateImgQuality,
+        "method": lambda v: validateRange(v, 0, 6, "method"),
+        "lossless": validateBool,
+        "optimize": validateBool,
+    }
+    zoomencoding = {}
+    for level, settings in value.items():
+        if level != "default" and not isinstance(level, int):
+            raise ValidationException("%r is not a valid zoom level for zoomencoding. Should be "
+                                      "an integer or 'default'." % (level,))
+        if not isinstance(settings, dict):
+            raise ValidationException("The encoder settings for zoom level %r must be a dict."
+                                      % (level,))
+        zoomencoding[level] = {}
+        for name, setting in settings.items():
+            if name not in validators:
+                raise ValidationException("%r is not a valid encoder setting. Should be one of "
+                                          "%s." % (name, ", ".join(sorted(validators))))
+            zoomencoding[level][name] = validators[name](setting)
+    return zoomencoding
+
+
+def validateRange(value, low, high, name):
+    val = int(value)
+    if val < low or val > high:
+        raise ValidationException("%r is not a valid %s. Should be between %d and %d."
+                                  % (value, name, low, high))
+    return val
+
+
 def validateBGColor(color):
     """BG color must be an HTML color, with an option leading # (hash symbol)
     returns an (r,b,g) 3-tuple
@@ -251,6 +369,14 @@ def validateOutputDir(d):
     return expand_path(d)
 
 
+def validateTextureCache(value):
+    # True means the default place, in the user's cache directory
+    if value is True or not value:
+        return bool(value)
+    checkBadEscape(value)
+    return expand_path(value)
+
+
 def validateCrop(value):
     if not isinstance(value, list):
         value = [value]
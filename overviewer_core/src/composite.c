@@ -24,6 +24,23 @@
 
 #include "overviewer.h"
 
+#if defined(__SSE2__) || defined(_M_X64) || (defined(_M_IX86_FP) && _M_IX86_FP >= 2)
+#include <emmintrin.h>
+#define OV_COMPOSITE_SSE2
+/* AVX2 kernels are built with a target attribute and only used if the CPU
+   turns out to support them at runtime */
+#if defined(__GNUC__) && (defined(__x86_64__) || defined(__i386__))
+#include <immintrin.h>
+#define OV_COMPOSITE_AVX2
+#define OV_TARGET_AVX2 __attribute__((target("avx2")))
+#endif
+#endif
+
+#if defined(__ARM_NEON) || defined(__ARM_NEON__)
+#include <arm_neon.h>
+#define OV_COMPOSITE_NEON
+#endif
+
 typedef struct {
     PyObject_HEAD
         Imaging image;
@@ -92,6 +109,530 @@ setup_source_destination(Imaging src, Imaging dest,
         *ysize = dest->ysize - *dy;
 }
 
+/* Row kernels
+ *
+ * Nearly all the time spent in alpha_over_full and resize_half goes into
+ * their inner pixel loops, so those loops live in the row functions
+ * below. Every kernel comes in a plain C version, plus SSE2 / AVX2 / NEON
+ * versions where the compiler and CPU support them. The vector versions
+ * only take the shortcuts that are exact (fully transparent or fully
+ * opaque pixels for alpha_over, everything for resize_half) and hand the
+ * rest to the plain C code, so all implementations give bit-identical
+ * results. init_composite() picks the best one at import time;
+ * set_composite_impl() can override that (mostly useful for testing).
+ */
+
+/* plain C alpha_over for one row of pixels
+ * inmask points at the first alpha byte of the mask, and src_stride is
+ * 4 for sources with an alpha channel, 3 otherwise
+ */
+static void
+alpha_over_row_scalar(UINT8* out, const UINT8* in, const UINT8* inmask,
+                      int32_t xsize, int32_t src_stride, int32_t mask_stride,
+                      UINT8 overall_alpha_int) {
+    UINT8* outmask = out + 3;
+    /* iteration variables */
+    int32_t x;
+    uint32_t i;
+    /* temporary calculation variables */
+    int32_t tmp1, tmp2, tmp3;
+
+    for (x = 0; x < xsize; x++) {
+        UINT8 in_alpha;
+
+        /* apply overall_alpha */
+        if (overall_alpha_int != 255 && *inmask != 0) {
+            in_alpha = OV_MULDIV255(*inmask, overall_alpha_int, tmp1);
+        } else {
+            in_alpha = *inmask;
+        }
+
+        /* special cases */
+        if (in_alpha == 255 || (*outmask == 0 && in_alpha > 0)) {
+            *outmask = in_alpha;
+
+            *out = *in;
+            out++, in++;
+            *out = *in;
+            out++, in++;
+            *out = *in;
+            out++, in++;
+        } else if (in_alpha == 0) {
+            /* do nothing -- source is fully transparent */
+            out += 3;
+            in += 3;
+        } else {
+            /* general case */
+            int32_t alpha = in_alpha + OV_MULDIV255(*outmask, 255 - in_alpha, tmp1);
+            for (i = 0; i < 3; i++) {
+                /* general case */
+                *out = OV_MULDIV255(*in, in_alpha, tmp1) +
+                       OV_MULDIV255(OV_MULDIV255(*out, *outmask, tmp2), 255 - in_alpha, tmp3);
+
+                *out = (*out * 255) / alpha;
+                out++, in++;
+            }
+
+            *outmask = alpha;
+        }
+
+        out++;
+        in += src_stride - 3;
+        outmask += 4;
+        inmask += mask_stride;
+    }
+}
+
+/* plain C resize_half for one destination row, for any source/dest
+ * alpha combination
+ */
+static void
+resize_half_row_generic(UINT8* out, const UINT8* in_row1, const UINT8* in_row2,
+                        uint32_t dest_width, int32_t src_has_alpha, int32_t dest_has_alpha) {
+    /* iteration variables */
+    uint32_t x;
+    /* temp color variables */
+    uint32_t r, g, b, a;
+
+    /* set to fully opaque if source has no alpha channel */
+    if (!src_has_alpha)
+        a = 0xFF << 2;
+
+    for (x = 0; x < dest_width; x++) {
+
+        // read first column
+        r = *in_row1;
+        r += *in_row2;
+        in_row1++;
+        in_row2++;
+        g = *in_row1;
+        g += *in_row2;
+        in_row1++;
+        in_row2++;
+        b = *in_row1;
+        b += *in_row2;
+        in_row1++;
+        in_row2++;
+
+        if (src_has_alpha) {
+            a = *in_row1;
+            a += *in_row2;
+            in_row1++;
+            in_row2++;
+        }
+
+        // read second column
+        r += *in_row1;
+        r += *in_row2;
+        in_row1++;
+        in_row2++;
+        g += *in_row1;
+        g += *in_row2;
+        in_row1++;
+        in_row2++;
+        b += *in_row1;
+        b += *in_row2;
+        in_row1++;
+        in_row2++;
+
+        if (src_has_alpha) {
+            a += *in_row1;
+            a += *in_row2;
+            in_row1++;
+            in_row2++;
+        }
+
+        // write blended color
+        *out = (UINT8)(r >> 2);
+        out++;
+        *out = (UINT8)(g >> 2);
+        out++;
+        *out = (UINT8)(b >> 2);
+        out++;
+
+        if (dest_has_alpha) {
+            *out = (UINT8)(a >> 2);
+            out++;
+        }
+    }
+}
+
+/* plain C resize_half for 4-byte source and destination pixels */
+static void
+resize_half_row_scalar(UINT8* out, const UINT8* in_row1, const UINT8* in_row2,
+                       uint32_t dest_width) {
+    resize_half_row_generic(out, in_row1, in_row2, dest_width, 1, 1);
+}
+
+#ifdef OV_COMPOSITE_SSE2
+static void
+alpha_over_row_sse2(UINT8* out, const UINT8* in, const UINT8* inmask,
+                    int32_t xsize, int32_t src_stride, int32_t mask_stride,
+                    UINT8 overall_alpha_int) {
+    const __m128i zero = _mm_setzero_si128();
+    const __m128i full = _mm_set1_epi32(255);
+    const __m128i rgb = _mm_set1_epi32(0x00FFFFFF);
+    const __m128i overall = _mm_set1_epi32(overall_alpha_int);
+    const __m128i round = _mm_set1_epi32(128);
+    int32_t x = 0;
+
+    if (src_stride != 4) {
+        alpha_over_row_scalar(out, in, inmask, xsize, src_stride, mask_stride, overall_alpha_int);
+        return;
+    }
+
+    /* four pixels at a time, one per 32-bit lane */
+    for (; x + 4 <= xsize; x += 4) {
+        __m128i in_alpha, dst, copy, skip;
+
+        if (mask_stride == 4) {
+            in_alpha = _mm_srli_epi32(_mm_loadu_si128((const __m128i*)(inmask - 3)), 24);
+        } else {
+            int32_t m;
+            memcpy(&m, inmask, 4);
+            in_alpha = _mm_unpacklo_epi16(_mm_unpacklo_epi8(_mm_cvtsi32_si128(m), zero), zero);
+        }
+
+        /* apply overall_alpha, same as OV_MULDIV255 (fits in 16 bits) */
+        if (overall_alpha_int != 255) {
+            __m128i tmp = _mm_add_epi16(_mm_mullo_epi16(in_alpha, overall), round);
+            in_alpha = _mm_srli_epi16(_mm_add_epi16(_mm_srli_epi16(tmp, 8), tmp), 8);
+        }
+
+        dst = _mm_loadu_si128((const __m128i*)out);
+        skip = _mm_cmpeq_epi32(in_alpha, zero);
+        copy = _mm_or_si128(_mm_cmpeq_epi32(in_alpha, full),
+                            _mm_andnot_si128(skip, _mm_cmpeq_epi32(_mm_srli_epi32(dst, 24), zero)));
+
+        if (_mm_movemask_epi8(_mm_or_si128(copy, skip)) != 0xFFFF) {
+            /* at least one pixel needs the general case */
+            alpha_over_row_scalar(out, in, inmask, 4, src_stride, mask_stride, overall_alpha_int);
+        } else if (_mm_movemask_epi8(copy) != 0) {
+            __m128i src = _mm_loadu_si128((const __m128i*)in);
+            src = _mm_or_si128(_mm_and_si128(src, rgb), _mm_slli_epi32(in_alpha, 24));
+            dst = _mm_or_si128(_mm_and_si128(copy, src), _mm_andnot_si128(copy, dst));
+            _mm_storeu_si128((__m128i*)out, dst);
+        }
+
+        out += 16;
+        in += 16;
+        inmask += 4 * mask_stride;
+    }
+
+    alpha_over_row_scalar(out, in, inmask, xsize - x, src_stride, mask_stride, overall_alpha_int);
+}
+
+static void
+resize_half_row_sse2(UINT8* out, const UINT8* in_row1, const UINT8* in_row2,
+                     uint32_t dest_width) {
+    const __m128i zero = _mm_setzero_si128();
+    uint32_t x = 0;
+
+    /* eight source pixels from each row make four output pixels */
+    for (; x + 4 <= dest_width; x += 4) {
+        __m128i sum[2];
+        int32_t i;
+
+        for (i = 0; i < 2; i++) {
+            __m128i a = _mm_loadu_si128((const __m128i*)(in_row1 + 16 * i));
+            __m128i b = _mm_loadu_si128((const __m128i*)(in_row2 + 16 * i));
+            /* add the two rows, 16 bits per channel */
+            __m128i lo = _mm_add_epi16(_mm_unpacklo_epi8(a, zero), _mm_unpacklo_epi8(b, zero));
+            __m128i hi = _mm_add_epi16(_mm_unpackhi_epi8(a, zero), _mm_unpackhi_epi8(b, zero));
+            /* then neighbouring columns */
+            sum[i] = _mm_add_epi16(_mm_unpacklo_epi64(lo, hi), _mm_unpackhi_epi64(lo, hi));
+            sum[i] = _mm_srli_epi16(sum[i], 2);
+        }
+
+        _mm_storeu_si128((__m128i*)out, _mm_packus_epi16(sum[0], sum[1]));
+        out += 16;
+        in_row1 += 32;
+        in_row2 += 32;
+    }
+
+    resize_half_row_scalar(out, in_row1, in_row2, dest_width - x);
+}
+#endif /* OV_COMPOSITE_SSE2 */
+
+#ifdef OV_COMPOSITE_AVX2
+static OV_TARGET_AVX2 void
+alpha_over_row_avx2(UINT8* out, const UINT8* in, const UINT8* inmask,
+                    int32_t xsize, int32_t src_stride, int32_t mask_stride,
+                    UINT8 overall_alpha_int) {
+    const __m256i zero = _mm256_setzero_si256();
+    const __m256i full = _mm256_set1_epi32(255);
+    const __m256i rgb = _mm256_set1_epi32(0x00FFFFFF);
+    const __m256i overall = _mm256_set1_epi32(overall_alpha_int);
+    const __m256i round = _mm256_set1_epi32(128);
+    int32_t x = 0;
+
+    if (src_stride != 4) {
+        alpha_over_row_scalar(out, in, inmask, xsize, src_stride, mask_stride, overall_alpha_int);
+        return;
+    }
+
+    /* eight pixels at a time, one per 32-bit lane */
+    for (; x + 8 <= xsize; x += 8) {
+        __m256i in_alpha, dst, copy, skip;
+
+        if (mask_stride == 4) {
+            in_alpha = _mm256_srli_epi32(_mm256_loadu_si256((const __m256i*)(inmask - 3)), 24);
+        } else {
+            in_alpha = _mm256_cvtepu8_epi32(_mm_loadl_epi64((const __m128i*)inmask));
+        }
+
+        /* apply overall_alpha, same as OV_MULDIV255 (fits in 16 bits) */
+        if (overall_alpha_int != 255) {
+            __m256i tmp = _mm256_add_epi16(_mm256_mullo_epi16(in_alpha, overall), round);
+            in_alpha = _mm256_srli_epi16(_mm256_add_epi16(_mm256_srli_epi16(tmp, 8), tmp), 8);
+        }
+
+        dst = _mm256_loadu_si256((const __m256i*)out);
+        skip = _mm256_cmpeq_epi32(in_alpha, zero);
+        copy = _mm256_or_si256(_mm256_cmpeq_epi32(in_alpha, full),
+                               _mm256_andnot_si256(skip, _mm256_cmpeq_epi32(_mm256_srli_epi32(dst, 24), zero)));
+
+        if (_mm256_movemask_epi8(_mm256_or_si256(copy, skip)) != -1) {
+            /* at least one pixel needs the general case */
+            alpha_over_row_scalar(out, in, inmask, 8, src_stride, mask_stride, overall_alpha_int);
+        } else if (_mm256_movemask_epi8(copy) != 0) {
+            __m256i src = _mm256_loadu_si256((const __m256i*)in);
+            src = _mm256_or_si256(_mm256_and_si256(src, rgb), _mm256_slli_epi32(in_alpha, 24));
+            dst = _mm256_blendv_epi8(dst, src, copy);
+            _mm256_storeu_si256((__m256i*)out, dst);
+        }
+
+        out += 32;
+        in += 32;
+        inmask += 8 * mask_stride;
+    }
+
+    alpha_over_row_sse2(out, in, inmask, xsize - x, src_stride, mask_stride, overall_alpha_int);
+}
+
+static OV_TARGET_AVX2 void
+resize_half_row_avx2(UINT8* out, const UINT8* in_row1, const UINT8* in_row2,
+                     uint32_t dest_width) {
+    const __m256i zero = _mm256_setzero_si256();
+    uint32_t x = 0;
+
+    /* sixteen source pixels from each row make eight output pixels
+     * (the 256-bit unpacks work within each 128-bit half, so the
+     * results come out shuffled and are put back in order at the end)
+     */
+    for (; x + 8 <= dest_width; x += 8) {
+        __m256i sum[2];
+        int32_t i;
+
+        for (i = 0; i < 2; i++) {
+            __m256i a = _mm256_loadu_si256((const __m256i*)(in_row1 + 32 * i));
+            __m256i b = _mm256_loadu_si256((const __m256i*)(in_row2 + 32 * i));
+            __m256i lo = _mm256_add_epi16(_mm256_unpacklo_epi8(a, zero), _mm256_unpacklo_epi8(b, zero));
+            __m256i hi = _mm256_add_epi16(_mm256_unpackhi_epi8(a, zero), _mm256_unpackhi_epi8(b, zero));
+            sum[i] = _mm256_add_epi16(_mm256_unpacklo_epi64(lo, hi), _mm256_unpackhi_epi64(lo, hi));
+            sum[i] = _mm256_srli_epi16(sum[i], 2);
+        }
+
+        _mm256_storeu_si256((__m256i*)out,
+                            _mm256_permute4x64_epi64(_mm256_packus_epi16(sum[0], sum[1]),
+                                                     _MM_SHUFFLE(3, 1, 2, 0)));
+        out += 32;
+        in_row1 += 64;
+        in_row2 += 64;
+    }
+
+    resize_half_row_sse2(out, in_row1, in_row2, dest_width - x);
+}
+#endif /* OV_COMPOSITE_AVX2 */
+
+#ifdef OV_COMPOSITE_NEON
+/* true if any lane of v is non-zero */
+static inline int32_t
+neon_any(uint8x8_t v) {
+    return vget_lane_u64(vreinterpret_u64_u8(v), 0) != 0;
+}
+
+static void
+alpha_over_row_neon(UINT8* out, const UINT8* in, const UINT8* inmask,
+                    int32_t xsize, int32_t src_stride, int32_t mask_stride,
+                    UINT8 overall_alpha_int) {
+    const uint8x8_t zero = vdup_n_u8(0);
+    const uint8x8_t full = vdup_n_u8(255);
+    const uint8x8_t overall = vdup_n_u8(overall_alpha_int);
+    const uint16x8_t round = vdupq_n_u16(128);
+    int32_t x = 0;
+
+    if (src_stride != 4) {
+        alpha_over_row_scalar(out, in, inmask, xsize, src_stride, mask_stride, overall_alpha_int);
+        return;
+    }
+
+    /* eight pixels at a time, split into channels by vld4 */
+    for (; x + 8 <= xsize; x += 8) {
+        uint8x8x4_t dst;
+        uint8x8_t in_alpha, copy, skip;
+
+        if (mask_stride == 4) {
+            in_alpha = vld4_u8(inmask - 3).val[3];
+        } else {
+            in_alpha = vld1_u8(inmask);
+        }
+
+        /* apply overall_alpha, same as OV_MULDIV255 */
+        if (overall_alpha_int != 255) {
+            uint16x8_t tmp = vmlal_u8(round, in_alpha, overall);
+            in_alpha = vshrn_n_u16(vsraq_n_u16(tmp, tmp, 8), 8);
+        }
+
+        dst = vld4_u8(out);
+        skip = vceq_u8(in_alpha, zero);
+        copy = vorr_u8(vceq_u8(in_alpha, full),
+                       vbic_u8(vceq_u8(dst.val[3], zero), skip));
+
+        if (neon_any(vmvn_u8(vorr_u8(copy, skip)))) {
+            /* at least one pixel needs the general case */
+            alpha_over_row_scalar(out, in, inmask, 8, src_stride, mask_stride, overall_alpha_int);
+        } else if (neon_any(copy)) {
+            uint8x8x4_t src = vld4_u8(in);
+            dst.val[0] = vbsl_u8(copy, src.val[0], dst.val[0]);
+            dst.val[1] = vbsl_u8(copy, src.val[1], dst.val[1]);
+            dst.val[2] = vbsl_u8(copy, src.val[2], dst.val[2]);
+            dst.val[3] = vbsl_u8(copy, in_alpha, dst.val[3]);
+            vst4_u8(out, dst);
+        }
+
+        out += 32;
+        in += 32;
+        inmask += 8 * mask_stride;
+    }
+
+    alpha_over_row_scalar(out, in, inmask, xsize - x, src_stride, mask_stride, overall_alpha_int);
+}
+
+static void
+resize_half_row_neon(UINT8* out, const UINT8* in_row1, const UINT8* in_row2,
+                     uint32_t dest_width) {
+    uint32_t x = 0;
+
+    /* sixteen source pixels from each row make eight output pixels */
+    for (; x + 8 <= dest_width; x += 8) {
+        uint8x16x4_t a = vld4q_u8(in_row1);
+        uint8x16x4_t b = vld4q_u8(in_row2);
+        uint8x8x4_t res;
+        int32_t i;
+
+        for (i = 0; i < 4; i++) {
+            res.val[i] = vshrn_n_u16(vpadalq_u8(vpaddlq_u8(a.val[i]), b.val[i]), 2);
+        }
+
+        vst4_u8(out, res);
+        out += 32;
+        in_row1 += 64;
+        in_row2 += 64;
+    }
+
+    resize_half_row_scalar(out, in_row1, in_row2, dest_width - x);
+}
+#endif /* OV_COMPOSITE_NEON */
+
+typedef struct {
+    const char* name;
+    /* returns true if the running CPU can use these kernels, or NULL if
+       the compiler already guarantees it */
+    int32_t (*supported)(void);
+    void (*alpha_over_row)(UINT8* out, const UINT8* in, const UINT8* inmask,
+                           int32_t xsize, int32_t src_stride, int32_t mask_stride,
+                           UINT8 overall_alpha_int);
+    void (*resize_half_row)(UINT8* out, const UINT8* in_row1, const UINT8* in_row2,
+                            uint32_t dest_width);
+} CompositeKernels;
+
+#ifdef OV_COMPOSITE_AVX2
+static int32_t
+cpu_has_avx2(void) {
+    __builtin_cpu_init();
+    return __builtin_cpu_supports("avx2");
+}
+#endif
+
+/* in order of preference, worst first */
+static const CompositeKernels composite_kernels[] = {
+    {"scalar", NULL, alpha_over_row_scalar, resize_half_row_scalar},
+#ifdef OV_COMPOSITE_SSE2
+    {"sse2", NULL, alpha_over_row_sse2, resize_half_row_sse2},
+#endif
+#ifdef OV_COMPOSITE_AVX2
+    {"avx2", cpu_has_avx2, alpha_over_row_avx2, resize_half_row_avx2},
+#endif
+#ifdef OV_COMPOSITE_NEON
+    {"neon", NULL, alpha_over_row_neon, resize_half_row_neon},
+#endif
+};
+
+/* the kernels currently in use */
+static const CompositeKernels* composite_impl = &composite_kernels[0];
+
+/* picks the fastest kernels the running CPU supports */
+void init_composite(void) {
+    uint32_t i;
+    for (i = 0; i < COUNT_OF(composite_kernels); i++) {
+        if (composite_kernels[i].supported == NULL || composite_kernels[i].supported())
+            composite_impl = &composite_kernels[i];
+    }
+}
+
+/* returns the name of the kernels in use */
+PyObject*
+get_composite_impl(PyObject* self, PyObject* args) {
+    return PyUnicode_FromString(composite_impl->name);
+}
+
+/* returns a list of the names of all kernels this CPU can use */
+PyObject*
+get_composite_impls(PyObject* self, PyObject* args) {
+    PyObject* names = PyList_New(0);
+    uint32_t i;
+    if (!names)
+        return NULL;
+
+    for (i = 0; i < COUNT_OF(composite_kernels); i++) {
+        if (composite_kernels[i].supported == NULL || composite_kernels[i].supported()) {
+            PyObject* name = PyUnicode_FromString(composite_kernels[i].name);
+            if (!name || PyList_Append(names, name) < 0) {
+                Py_XDECREF(name);
+                Py_DECREF(names);
+                return NULL;
+            }
+            Py_DECREF(name);
+        }
+    }
+    return names;
+}
+
+/* switches to the named kernels */
+PyObject*
+set_composite_impl(PyObject* self, PyObject* args) {
+    const char* name;
+    uint32_t i;
+
+    if (!PyArg_ParseTuple(args, "s", &name))
+        return NULL;
+
+    for (i = 0; i < COUNT_OF(composite_kernels); i++) {
+        if (strcmp(composite_kernels[i].name, name) != 0)
+            continue;
+        if (composite_kernels[i].supported != NULL && !composite_kernels[i].supported()) {
+            PyErr_Format(PyExc_ValueError, "composite kernels \"%s\" are not supported on this CPU", name);
+            return NULL;
+        }
+        composite_impl = &composite_kernels[i];
+        Py_RETURN_NONE;
+    }
+
+    PyErr_Format(PyExc_ValueError, "unknown composite kernels \"%s\"", name);
+    return NULL;
+}
+
 /* convenience alpha_over with 1.0 as overall_alpha */
 inline PyObject* alpha_over(PyObject* dest, PyObject* src, PyObject* mask,
                             int32_t dx, int32_t dy, int32_t xsize, int32_t ysize) {
@@ -109,14 +650,11 @@ alpha_over_full(PyObject* dest, PyObject* src, PyObject* mask, float overall_alp
     /* libImaging handles */
     Imaging imDest, imSrc, imMask;
     /* cached blend properties */
-    int32_t src_has_alpha, mask_offset, mask_stride;
+    int32_t src_stride, mask_offset, mask_stride;
     /* source position */
     int32_t sx, sy;
     /* iteration variables */
-    int32_t x, y;
-    uint32_t i;
-    /* temporary calculation variables */
-    int32_t tmp1, tmp2, tmp3;
+    int32_t y;
     /* integer [0, 255] version of overall_alpha */
     UINT8 overall_alpha_int = 255 * overall_alpha;
 
@@ -158,7 +696,7 @@ alpha_over_full(PyObject* dest, PyObject* src, PyObject* mask, float overall_alp
     }
 
     /* set up flags for the src/mask type */
-    src_has_alpha = (imSrc->pixelsize == 4 ? 1 : 0);
+    src_stride = (imSrc->pixelsize == 4 ? 4 : 3);
     /* how far into image the first alpha byte resides */
     mask_offset = (imMask->pixelsize == 4 ? 3 : 0);
     /* how many bytes to skip to get to the next alpha byte */
@@ -175,55 +713,11 @@ alpha_over_full(PyObject* dest, PyObject* src, PyObject* mask, float overall_alp
 
     for (y = 0; y < ysize; y++) {
         UINT8* out = (UINT8*)imDest->image[dy + y] + dx * 4;
-        UINT8* outmask = (UINT8*)imDest->image[dy + y] + dx * 4 + 3;
         UINT8* in = (UINT8*)imSrc->image[sy + y] + sx * (imSrc->pixelsize);
         UINT8* inmask = (UINT8*)imMask->image[sy + y] + sx * mask_stride + mask_offset;
 
-        for (x = 0; x < xsize; x++) {
-            UINT8 in_alpha;
-
-            /* apply overall_alpha */
-            if (overall_alpha_int != 255 && *inmask != 0) {
-                in_alpha = OV_MULDIV255(*inmask, overall_alpha_int, tmp1);
-            } else {
-                in_alpha = *inmask;
-            }
-
-            /* special cases */
-            if (in_alpha == 255 || (*outmask == 0 && in_alpha > 0)) {
-                *outmask = in_alpha;
-
-                *out = *in;
-                out++, in++;
-                *out = *in;
-                out++, in++;
-                *out = *in;
-                out++, in++;
-            } else if (in_alpha == 0) {
-                /* do nothing -- source is fully transparent */
-                out += 3;
-                in += 3;
-            } else {
-                /* general case */
-                int32_t alpha = in_alpha + OV_MULDIV255(*outmask, 255 - in_alpha, tmp1);
-                for (i = 0; i < 3; i++) {
-                    /* general case */
-                    *out = OV_MULDIV255(*in, in_alpha, tmp1) +
-                           OV_MULDIV255(OV_MULDIV255(*out, *outmask, tmp2), 255 - in_alpha, tmp3);
-
-                    *out = (*out * 255) / alpha;
-                    out++, in++;
-                }
-
-                *outmask = alpha;
-            }
-
-            out++;
-            if (src_has_alpha)
-                in++;
-            outmask += 4;
-            inmask += mask_stride;
-        }
+        composite_impl->alpha_over_row(out, in, inmask, xsize, src_stride, mask_stride,
+                                       overall_alpha_int);
     }
 
     return dest;
@@ -237,10 +731,12 @@ alpha_over_wrap(PyObject* self, PyObject* args) {
     PyObject *dest, *src, *pos = NULL, *mask = NULL;
     /* destination position and size */
     int32_t dx, dy, xsize, ysize;
+    /* mask multiplier */
+    float overall_alpha = 1.0f;
     /* return value: dest image on success */
     PyObject* ret;
 
-    if (!PyArg_ParseTuple(args, "OO|OO", &dest, &src, &pos, &mask))
+    if (!PyArg_ParseTuple(args, "OO|OOf", &dest, &src, &pos, &mask, &overall_alpha))
         return NULL;
 
     if (mask == NULL)
@@ -266,7 +762,7 @@ alpha_over_wrap(PyObject* self, PyObject* args) {
         }
     }
 
-    ret = alpha_over(dest, src, mask, dx, dy, xsize, ysize);
+    ret = alpha_over_full(dest, src, mask, overall_alpha, dx, dy, xsize, ysize);
     if (ret == dest) {
         /* Python needs us to own our return value */
         Py_INCREF(dest);
@@ -514,9 +1010,7 @@ resize_half(PyObject* dest, PyObject* src) {
     /* alpha properties */
     int32_t src_has_alpha, dest_has_alpha;
     /* iteration variables */
-    uint32_t x, y;
-    /* temp color variables */
-    uint32_t r, g, b, a;
+    uint32_t y;
     /* size values for source and destination */
     uint32_t src_width, src_height, dest_width, dest_height;
 
@@ -561,72 +1055,17 @@ resize_half(PyObject* dest, PyObject* src) {
         return dest;
     }
 
-    /* set to fully opaque if source has no alpha channel */
-    if (!src_has_alpha)
-        a = 0xFF << 2;
-
     for (y = 0; y < dest_height; y++) {
 
         UINT8* out = (UINT8*)imDest->image[y];
         UINT8* in_row1 = (UINT8*)imSrc->image[y * 2];
         UINT8* in_row2 = (UINT8*)imSrc->image[y * 2 + 1];
 
-        for (x = 0; x < dest_width; x++) {
-
-            // read first column
-            r = *in_row1;
-            r += *in_row2;
-            in_row1++;
-            in_row2++;
-            g = *in_row1;
-            g += *in_row2;
-            in_row1++;
-            in_row2++;
-            b = *in_row1;
-            b += *in_row2;
-            in_row1++;
-            in_row2++;
-
-            if (src_has_alpha) {
-                a = *in_row1;
-                a += *in_row2;
-                in_row1++;
-                in_row2++;
-            }
-
-            // read second column
-            r += *in_row1;
-            r += *in_row2;
-            in_row1++;
-            in_row2++;
-            g += *in_row1;
-            g += *in_row2;
-            in_row1++;
-            in_row2++;
-            b += *in_row1;
-            b += *in_row2;
-            in_row1++;
-            in_row2++;
-
-            if (src_has_alpha) {
-                a += *in_row1;
-                a += *in_row2;
-                in_row1++;
-                in_row2++;
-            }
-
-            // write blended color
-            *out = (UINT8)(r >> 2);
-            out++;
-            *out = (UINT8)(g >> 2);
-            out++;
-            *out = (UINT8)(b >> 2);
-            out++;
-
-            if (dest_has_alpha) {
-                *out = (UINT8)(a >> 2);
-                out++;
-            }
+        if (src_has_alpha && dest_has_alpha) {
+            composite_impl->resize_half_row(out, in_row1, in_row2, dest_width);
+        } else {
+            resize_half_row_generic(out, in_row1, in_row2, dest_width,
+                                    src_has_alpha, dest_has_alpha);
         }
     }
 
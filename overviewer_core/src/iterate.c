@@ -31,6 +31,7 @@ static PyObject* solid_blocks = NULL;
 static PyObject* fluid_blocks = NULL;
 static PyObject* nospawn_blocks = NULL;
 static PyObject* nodata_blocks = NULL;
+static PyObject* lazy_texture = NULL;
 
 PyObject* init_chunk_render(void) {
 
@@ -79,6 +80,9 @@ PyObject* init_chunk_render(void) {
     nodata_blocks = PyObject_GetAttrString(textures, "nodata_blocks");
     if (!nodata_blocks)
         return NULL;
+    lazy_texture = PyObject_GetAttrString(textures, "LAZY");
+    if (!lazy_texture)
+        return NULL;
 
     block_properties = calloc(max_blockid, sizeof(uint8_t));
     for (i = 0; i < max_blockid; i++) {
@@ -497,6 +501,21 @@ generate_pseudo_data(RenderState* state, uint16_t ancilData) {
     return 0;
 }
 
+/* returns the blockmap entry at index as a borrowed reference, generating
+ * the sprite first if it's still lazy. Returns NULL on error. */
+static inline PyObject*
+get_texture(RenderState* state, PyObject* blockmap, uint32_t index) {
+    PyObject* t = PyList_GET_ITEM(blockmap, index);
+    if (t == lazy_texture) {
+        PyObject* ret = PyObject_CallMethod(state->textures, "generate_block", "I", index);
+        if (ret == NULL)
+            return NULL;
+        Py_DECREF(ret);
+        t = PyList_GET_ITEM(blockmap, index);
+    }
+    return t;
+}
+
 /* TODO triple check this to make sure reference counting is correct */
 PyObject*
 chunk_render(PyObject* self, PyObject* args) {
@@ -520,10 +539,21 @@ chunk_render(PyObject* self, PyObject* args) {
     int32_t i, j;
 
     PyObject* t = NULL;
+    int32_t ts, imgybase;
+    uint16_t hidden;
 
     if (!PyArg_ParseTuple(args, "OOiiiOiiOO", &state.world, &state.regionset, &state.chunkx, &state.chunky, &state.chunkz, &state.img, &xoff, &yoff, &modeobj, &state.textures))
         return NULL;
 
+    /* get the size of the block sprites, the render modes need it too */
+    t = PyObject_GetAttrString(state.textures, "texture_size");
+    if (t == NULL)
+        return NULL;
+    ts = state.texture_size = PyLong_AsLong(t);
+    Py_DECREF(t);
+    if (ts == -1 && PyErr_Occurred())
+        return NULL;
+
     /* set up the render mode */
     state.rendermode = rendermode = render_mode_create(modeobj, &state);
     if (rendermode == NULL) {
@@ -580,6 +610,9 @@ chunk_render(PyObject* self, PyObject* args) {
     blocks_py = state.blocks = state.chunks[1][1].sections[state.chunky].blocks;
     state.blockdatas = state.chunks[1][1].sections[state.chunky].data;
 
+    /* find the blocks the render mode hides, all at once */
+    render_mode_hidden_mask(rendermode);
+
     /* set up the random number generator again for each chunk
        so tallgrass is in the same place, no matter what mode is used */
     srand(1);
@@ -587,15 +620,28 @@ chunk_render(PyObject* self, PyObject* args) {
     for (state.x = 15; state.x > -1; state.x--) {
         for (state.z = 0; state.z < 16; state.z++) {
 
-            /* set up the render coordinates */
-            state.imgx = xoff + state.x * 12 + state.z * 12;
+            /* set up the render coordinates. With 24px sprites, each block
+             * is 12px over and 6px down or up the x and z axes, and 12px up
+             * the y axis. Those are ts/2 and ts/4, the latter worked out
+             * over the whole offset so 6px sprites round consistently. */
+            state.imgx = xoff + (state.x + state.z) * ts / 2;
             /* 16*12 -- offset for y direction, 15*6 -- offset for x */
-            state.imgy = yoff - state.x * 6 + state.z * 6 + 16 * 12 + 15 * 6;
+            imgybase = yoff + (state.z - state.x + 15) * ts / 4 + 16 * ts / 2;
+
+            hidden = rendermode->hidden[state.x][state.z];
+            if (hidden == 0xffff) {
+                /* nothing to draw in this column */
+                continue;
+            }
 
             for (state.y = 0; state.y < 16; state.y++) {
                 uint16_t ancilData;
 
-                state.imgy -= 12;
+                if (hidden & (1 << state.y)) {
+                    continue;
+                }
+
+                state.imgy = imgybase - (state.y + 1) * ts / 2;
                 /* get blockid */
                 state.block = getArrayShort3D(blocks_py, state.x, state.y, state.z);
                 if (state.block == block_air || render_mode_hidden(rendermode, state.x, state.y, state.z)) {
@@ -603,10 +649,10 @@ chunk_render(PyObject* self, PyObject* args) {
                 }
 
                 /* make sure we're rendering inside the image boundaries */
-                if ((state.imgx >= imgsize0 + 24) || (state.imgx <= -24)) {
+                if ((state.imgx >= imgsize0 + ts) || (state.imgx <= -ts)) {
                     continue;
                 }
-                if ((state.imgy >= imgsize1 + 24) || (state.imgy <= -24)) {
+                if ((state.imgy >= imgsize1 + ts) || (state.imgy <= -ts)) {
                     continue;
                 }
 
@@ -643,10 +689,16 @@ chunk_render(PyObject* self, PyObject* args) {
                     continue;
 
                 /* get the texture */
-                t = PyList_GET_ITEM(blockmap, max_data * state.block + ancilData);
+                t = get_texture(&state, blockmap, max_data * state.block + ancilData);
                 /* if we don't get a texture, try it again with 0 data */
-                if ((t == NULL || t == Py_None) && ancilData != 0)
-                    t = PyList_GET_ITEM(blockmap, max_data * state.block);
+                if (t == Py_None && ancilData != 0)
+                    t = get_texture(&state, blockmap, max_data * state.block);
+                if (t == NULL) {
+                    render_mode_destroy(rendermode);
+                    Py_DECREF(blockmap);
+                    unload_all_chunks(&state);
+                    return NULL;
+                }
 
                 /* if we found a proper texture, render it! */
                 if (t != NULL && t != Py_None) {
@@ -662,8 +714,8 @@ chunk_render(PyObject* self, PyObject* args) {
 
                     if (do_rand) {
                         /* add a random offset to the postion of the tall grass to make it more wild */
-                        randx = rand() % 6 + 1 - 3;
-                        randy = rand() % 6 + 1 - 3;
+                        randx = SPRITE_PX(&state, rand() % 6 + 1 - 3);
+                        randy = SPRITE_PX(&state, rand() % 6 + 1 - 3);
                         state.imgx += randx;
                         state.imgy += randy;
                     }
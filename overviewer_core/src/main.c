@@ -29,6 +29,15 @@ static PyMethodDef COverviewerMethods[] = {
     {"resize_half", resize_half_wrap, METH_VARARGS,
      "downscale image to half size"},
 
+    {"composite_impl", get_composite_impl, METH_VARARGS,
+     "Returns the name of the compositing kernels in use"},
+
+    {"composite_impls", get_composite_impls, METH_VARARGS,
+     "Returns the names of the compositing kernels this CPU supports"},
+
+    {"set_composite_impl", set_composite_impl, METH_VARARGS,
+     "Selects the compositing kernels to use"},
+
     {"render_loop", chunk_render, METH_VARARGS,
      "Renders stuffs"},
 
@@ -66,5 +75,6 @@ PyInit_c_overviewer(void) {
     }
 
     init_endian();
+    init_composite();
     return mod;
 }
@@ -31,7 +31,7 @@
 
 // increment this value if you've made a change to the c extension
 // and want to force users to rebuild
-#define OVERVIEWER_EXTENSION_VERSION 91
+#define OVERVIEWER_EXTENSION_VERSION 99
 
 #include <stdbool.h>
 #include <stdint.h>
@@ -73,6 +73,10 @@ PyObject* draw_triangle(PyObject* dest, int32_t inclusive,
                         int32_t tux, int32_t tuy, int32_t* touchups, uint32_t num_touchups);
 PyObject* resize_half(PyObject* dest, PyObject* src);
 PyObject* resize_half_wrap(PyObject* self, PyObject* args);
+void init_composite(void);
+PyObject* get_composite_impl(PyObject* self, PyObject* args);
+PyObject* get_composite_impls(PyObject* self, PyObject* args);
+PyObject* set_composite_impl(PyObject* self, PyObject* args);
 
 /* forward declaration of RenderMode object */
 typedef struct _RenderMode RenderMode;
@@ -105,8 +109,9 @@ typedef struct {
     /* the current render mode in use */
     RenderMode* rendermode;
 
-    /* the Texture object */
+    /* the Texture object, and the size of its block sprites */
     PyObject* textures;
+    int32_t texture_size;
 
     /* the block position and type, and the block array */
     int32_t x, y, z;
@@ -121,6 +126,10 @@ typedef struct {
     /* 3x3 array of this and neighboring chunk columns */
     ChunkData chunks[3][3];
 } RenderState;
+/* scales a length in pixels on a 24px block sprite to the size of the block
+ * sprites in use */
+#define SPRITE_PX(state, px) ((px) * (state)->texture_size / 24)
+
 PyObject* init_chunk_render(void);
 /* returns true on error, x,z relative */
 bool load_chunk(RenderState* state, int32_t x, int32_t z, uint8_t required);
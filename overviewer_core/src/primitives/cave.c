@@ -59,27 +59,15 @@ cave_occluded(void* data, RenderState* state, int32_t x, int32_t y, int32_t z) {
     return false;
 }
 
+/* check for lakes and seas and don't render them
+ * this is used on blocks without skylight, since a deep sea can be
+ * completely dark
+ */
 static bool
-cave_hidden(void* data, RenderState* state, int32_t x, int32_t y, int32_t z) {
-    RenderPrimitiveCave* self;
+in_open_water(RenderState* state, int32_t x, int32_t y, int32_t z) {
     int32_t dy = 0;
     uint16_t blockID;
     uint32_t blockUpID;
-    self = (RenderPrimitiveCave*)data;
-
-    /* check if the block is touching skylight */
-    if (touches_light(state, SKYLIGHT, x, y, z)) {
-        return true;
-    }
-
-    if (self->only_lit && !touches_light(state, BLOCKLIGHT, x, y, z)) {
-        return true;
-    }
-
-    /* check for lakes and seas and don't render them
-     * at this point of the code the block has no skylight
-     * but a deep sea can be completely dark
-     */
 
     blockID = getArrayShort3D(state->blocks, x, y, z);
     blockUpID = get_data(state, BLOCKS, x, y + 1, z);
@@ -97,6 +85,26 @@ cave_hidden(void* data, RenderState* state, int32_t x, int32_t y, int32_t z) {
             }
         }
     }
+    return false;
+}
+
+static bool
+cave_hidden(void* data, RenderState* state, int32_t x, int32_t y, int32_t z) {
+    RenderPrimitiveCave* self;
+    self = (RenderPrimitiveCave*)data;
+
+    /* check if the block is touching skylight */
+    if (touches_light(state, SKYLIGHT, x, y, z)) {
+        return true;
+    }
+
+    if (self->only_lit && !touches_light(state, BLOCKLIGHT, x, y, z)) {
+        return true;
+    }
+
+    if (in_open_water(state, x, y, z)) {
+        return true;
+    }
 
     /* unfortunate side-effect of lit cave mode: we need to count occluded
      * blocks as hidden for the lighting to look right, since technically our
@@ -105,6 +113,90 @@ cave_hidden(void* data, RenderState* state, int32_t x, int32_t y, int32_t z) {
     return cave_occluded(data, state, x, y, z);
 }
 
+/* returns a bitmask of the given column (x and z may be one block outside the
+   chunk) with bit y set where the data of the given type is not 0, for y
+   from 0 to 16 */
+static uint32_t
+nonzero_column(RenderState* state, DataType type, int32_t x, int32_t z) {
+    uint32_t bits = 0;
+    int32_t y;
+    for (y = 0; y <= 16; y++) {
+        if (get_data(state, type, x, y, z))
+            bits |= 1 << y;
+    }
+    return bits;
+}
+
+/* the same as touches_light() for the whole column x, z */
+static uint16_t
+column_touches_light(uint32_t columns[18][18], int32_t x, int32_t z) {
+    return (columns[x + 1][z + 1] >> 1 |
+            columns[x + 2][z + 1] | columns[x][z + 1] |
+            columns[x + 1][z + 2] | columns[x + 1][z]) &
+           0xffff;
+}
+
+static void
+cave_hidden_mask(void* data, RenderState* state, uint16_t hidden[16][16]) {
+    RenderPrimitiveCave* self = (RenderPrimitiveCave*)data;
+    uint32_t skylight[18][18], blocklight[18][18];
+    /* bit y of opaque[x + 1][z] is set where the block at x, y, z is not
+       known to be transparent, for y from 0 to 16 */
+    uint32_t opaque[17][17];
+    int32_t x, y, z;
+
+    for (x = -1; x <= 16; x++) {
+        for (z = -1; z <= 16; z++) {
+            /* the corners aren't needed */
+            if ((x < 0 || x > 15) && (z < 0 || z > 15))
+                continue;
+            skylight[x + 1][z + 1] = nonzero_column(state, SKYLIGHT, x, z);
+            if (self->only_lit)
+                blocklight[x + 1][z + 1] = nonzero_column(state, BLOCKLIGHT, x, z);
+        }
+    }
+
+    for (x = -1; x < 16; x++) {
+        for (z = 0; z <= 16; z++) {
+            if (x < 0 && z > 15)
+                continue;
+            opaque[x + 1][z] = 0;
+            for (y = 0; y <= 16; y++) {
+                bool is_opaque = !is_known_transparent(get_data(state, BLOCKS, x, y, z));
+                if (is_opaque)
+                    opaque[x + 1][z] |= 1 << y;
+            }
+        }
+    }
+
+    for (x = 0; x < 16; x++) {
+        for (z = 0; z < 16; z++) {
+            uint16_t mask = column_touches_light(skylight, x, z);
+
+            if (self->only_lit)
+                mask |= ~column_touches_light(blocklight, x, z);
+
+            /* the same as cave_occluded(), see there */
+            mask |= opaque[x][z] & opaque[x + 1][z + 1] & opaque[x + 1][z] >> 1;
+            if (x == 0 && (!(state->chunks[0][1].loaded) || state->chunks[0][1].sections[state->chunky].blocks == NULL))
+                mask = 0xffff;
+            if (state->chunky + 1 >= SECTIONS_PER_CHUNK || state->chunks[1][1].sections[state->chunky + 1].blocks == NULL)
+                mask |= 1 << 15;
+            if (z == 15 && (!(state->chunks[1][2].loaded) || state->chunks[1][2].sections[state->chunky].blocks == NULL))
+                mask = 0xffff;
+
+            /* lakes and seas are rare enough to check block by block */
+            for (y = 0; y < 16; y++) {
+                if (!(mask & (1 << y)) && getArrayShort3D(state->blocks, x, y, z) != block_air &&
+                    in_open_water(state, x, y, z))
+                    mask |= 1 << y;
+            }
+
+            hidden[x][z] |= mask;
+        }
+    }
+}
+
 static bool
 cave_start(void* data, RenderState* state, PyObject* support) {
     RenderPrimitiveCave* self;
@@ -124,4 +216,5 @@ RenderPrimitiveInterface primitive_cave = {
     cave_occluded,
     cave_hidden,
     NULL,
+    cave_hidden_mask,
 };
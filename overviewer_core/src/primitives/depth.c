@@ -44,6 +44,23 @@ depth_hidden(void* data, RenderState* state, int32_t x, int32_t y, int32_t z) {
     return false;
 }
 
+static void
+depth_hidden_mask(void* data, RenderState* state, uint16_t hidden[16][16]) {
+    int32_t x, y, z;
+    uint16_t column = 0;
+
+    /* every column of the section is the same */
+    for (y = 0; y < 16; y++) {
+        if (depth_hidden(data, state, 0, y, 0))
+            column |= 1 << y;
+    }
+    for (x = 0; x < 16; x++) {
+        for (z = 0; z < 16; z++) {
+            hidden[x][z] |= column;
+        }
+    }
+}
+
 RenderPrimitiveInterface primitive_depth = {
     "depth",
     sizeof(PrimitiveDepth),
@@ -52,4 +69,5 @@ RenderPrimitiveInterface primitive_depth = {
     NULL,
     depth_hidden,
     NULL,
+    depth_hidden_mask,
 };
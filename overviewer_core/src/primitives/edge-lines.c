@@ -44,9 +44,9 @@ edge_lines_draw(void* data, RenderState* state, PyObject* src, PyObject* mask, P
 
         int32_t increment = 0;
         if (block_class_is_subset(state->block, (mc_block_t[]){block_wooden_slab, block_stone_slab}, 2) && ((state->block_data & 0x8) == 0)) // half-steps BUT no upsidown half-steps
-            increment = 6;
+            increment = SPRITE_PX(state, 6);
         else if (block_class_is_subset(state->block, (mc_block_t[]){block_snow_layer, block_unpowered_repeater, block_powered_repeater}, 3)) // snow, redstone repeaters (on and off)
-            increment = 9;
+            increment = SPRITE_PX(state, 9);
 
         /* +X side */
         side_block = get_data(state, BLOCKS, x + 1, y, z);
@@ -54,8 +54,8 @@ edge_lines_draw(void* data, RenderState* state, PyObject* src, PyObject* mask, P
             /* WARNING: ugly special case approaching */
             /* if the block is a slab and the side block is a stair don't draw anything, it can give very ugly results */
             !(block_class_is_subset(state->block, (mc_block_t[]){block_wooden_slab, block_stone_slab}, 2) && (block_class_is_subset(side_block, block_class_stair, block_class_stair_len)))) {
-            ImagingDrawLine(img_i, state->imgx + 12, state->imgy + 1 + increment, state->imgx + 22 + 1, state->imgy + 5 + 1 + increment, &ink, 1);
-            ImagingDrawLine(img_i, state->imgx + 12, state->imgy + increment, state->imgx + 22 + 1, state->imgy + 5 + increment, &ink, 1);
+            ImagingDrawLine(img_i, state->imgx + SPRITE_PX(state, 12), state->imgy + 1 + increment, state->imgx + SPRITE_PX(state, 22) + 1, state->imgy + SPRITE_PX(state, 5) + 1 + increment, &ink, 1);
+            ImagingDrawLine(img_i, state->imgx + SPRITE_PX(state, 12), state->imgy + increment, state->imgx + SPRITE_PX(state, 22) + 1, state->imgy + SPRITE_PX(state, 5) + increment, &ink, 1);
         }
 
         /* -Z side */
@@ -65,8 +65,8 @@ edge_lines_draw(void* data, RenderState* state, PyObject* src, PyObject* mask, P
             /* if the block is a slab and the side block is a stair don't draw anything, it can give very ugly results */
             !(
                 block_class_is_subset(state->block, (mc_block_t[]){block_stone_slab, block_wooden_slab}, 2) && (block_class_is_subset(side_block, block_class_stair, block_class_stair_len)))) {
-            ImagingDrawLine(img_i, state->imgx, state->imgy + 6 + 1 + increment, state->imgx + 12 + 1, state->imgy + 1 + increment, &ink, 1);
-            ImagingDrawLine(img_i, state->imgx, state->imgy + 6 + increment, state->imgx + 12 + 1, state->imgy + increment, &ink, 1);
+            ImagingDrawLine(img_i, state->imgx, state->imgy + SPRITE_PX(state, 6) + 1 + increment, state->imgx + SPRITE_PX(state, 12) + 1, state->imgy + 1 + increment, &ink, 1);
+            ImagingDrawLine(img_i, state->imgx, state->imgy + SPRITE_PX(state, 6) + increment, state->imgx + SPRITE_PX(state, 12) + 1, state->imgy + increment, &ink, 1);
         }
     }
 }
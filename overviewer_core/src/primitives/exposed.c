@@ -98,6 +98,64 @@ exposed_hidden(void* data, RenderState* state, int32_t x, int32_t y, int32_t z)
     return !(self->mode); /* Hide in normal mode, reveal in inverted mode */
 }
 
+/* returns the blocks of the given column (x and z may be one block outside
+ * the chunk) that are transparent, as a bitmask with bit y + 1 for each y
+ * from -1 to 16. Blocks in sections that don't exist are never transparent,
+ * like the valid flags above.
+ */
+static uint32_t
+transparent_column(RenderState* state, int32_t x, int32_t z) {
+    ChunkData* chunk = &(state->chunks[1 + (x > 15) - (x < 0)][1 + (z > 15) - (z < 0)]);
+    uint32_t bits = 0;
+    int32_t y, sectiony;
+
+    for (y = -1; y <= 16; y++) {
+        sectiony = state->chunky + (y > 15) - (y < 0);
+        if (sectiony < 0 || sectiony >= SECTIONS_PER_CHUNK || chunk->sections[sectiony].blocks == NULL)
+            continue;
+        if (is_transparent(get_data(state, BLOCKS, x, y, z)))
+            bits |= 1 << (y + 1);
+    }
+    return bits;
+}
+
+static void
+exposed_hidden_mask(void* data, RenderState* state, uint16_t hidden[16][16]) {
+    PrimitiveExposed* self = (PrimitiveExposed*)data;
+    uint32_t columns[18][18];
+    int32_t x, z;
+
+    /* whether the neighbouring sections exist decides which blocks on the
+     * edges count as exposed, so make sure the chunks are loaded */
+    load_chunk(state, -1, 0, 0);
+    load_chunk(state, 1, 0, 0);
+    load_chunk(state, 0, -1, 0);
+    load_chunk(state, 0, 1, 0);
+
+    for (x = -1; x <= 16; x++) {
+        for (z = -1; z <= 16; z++) {
+            /* the corners aren't needed */
+            if ((x < 0 || x > 15) && (z < 0 || z > 15))
+                continue;
+            columns[x + 1][z + 1] = transparent_column(state, x, z);
+        }
+    }
+
+    for (x = 0; x < 16; x++) {
+        for (z = 0; z < 16; z++) {
+            uint32_t column = columns[x + 1][z + 1];
+            /* a block is exposed if any of the 6 blocks next to it is
+             * transparent: the ones below and above are bits y and y + 2
+             * of its column, the others bit y + 1 of theirs */
+            uint16_t exposed = ((column | column >> 2 |
+                                 columns[x][z + 1] >> 1 | columns[x + 2][z + 1] >> 1 |
+                                 columns[x + 1][z] >> 1 | columns[x + 1][z + 2] >> 1) &
+                                0xffff);
+            hidden[x][z] |= self->mode ? exposed : ~exposed;
+        }
+    }
+}
+
 RenderPrimitiveInterface primitive_exposed = {
     "exposed",
     sizeof(PrimitiveExposed),
@@ -106,4 +164,5 @@ RenderPrimitiveInterface primitive_exposed = {
     NULL,
     exposed_hidden,
     NULL,
+    exposed_hidden_mask,
 };
@@ -26,12 +26,21 @@ typedef struct {
 static bool
 height_fading_start(void* data, RenderState* state, PyObject* support) {
     PrimitiveHeightFading* self = (PrimitiveHeightFading*)data;
+    PyObject* colors;
 
     if (!render_mode_parse_option(support, "sealevel", "I", &(self->sealevel)))
         return true;
 
-    self->black_color = PyObject_GetAttrString(support, "black_color");
-    self->white_color = PyObject_GetAttrString(support, "white_color");
+    colors = PyObject_CallMethod(support, "get_colors", "i", state->texture_size);
+    if (colors == NULL)
+        return true;
+    if (!PyArg_ParseTuple(colors, "OO", &(self->black_color), &(self->white_color))) {
+        Py_DECREF(colors);
+        return true;
+    }
+    Py_INCREF(self->black_color);
+    Py_INCREF(self->white_color);
+    Py_DECREF(colors);
 
     return false;
 }
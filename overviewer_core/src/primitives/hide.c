@@ -107,6 +107,35 @@ hide_hidden(void* data, RenderState* state, int32_t x, int32_t y, int32_t z) {
     return false;
 }
 
+static void
+hide_hidden_mask(void* data, RenderState* state, uint16_t hidden[16][16]) {
+    RenderPrimitiveHide* self = (RenderPrimitiveHide*)data;
+    int32_t x, y, z;
+    uint32_t i;
+
+    if (self->rules == NULL)
+        return;
+
+    for (x = 0; x < 16; x++) {
+        for (z = 0; z < 16; z++) {
+            for (y = 0; y < 16; y++) {
+                mc_block_t block = getArrayShort3D(state->blocks, x, y, z);
+                if (block == block_air)
+                    continue;
+
+                for (i = 0; self->rules[i].blockid != block_air; i++) {
+                    if (block == self->rules[i].blockid &&
+                        (!(self->rules[i].has_data) ||
+                         getArrayByte3D(state->blockdatas, x, y, z) == self->rules[i].data)) {
+                        hidden[x][z] |= 1 << y;
+                        break;
+                    }
+                }
+            }
+        }
+    }
+}
+
 RenderPrimitiveInterface primitive_hide = {
     "hide",
     sizeof(RenderPrimitiveHide),
@@ -115,4 +144,5 @@ RenderPrimitiveInterface primitive_hide = {
     NULL,
     hide_hidden,
     NULL,
+    hide_hidden_mask,
 };
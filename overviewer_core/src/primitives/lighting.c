@@ -256,7 +256,9 @@ lighting_start(void* data, RenderState* state, PyObject* support) {
     if (!render_mode_parse_option(support, "color", "p", &(self->color)))
         return true;
 
-    self->facemasks_py = PyObject_GetAttrString(support, "facemasks");
+    self->facemasks_py = PyObject_CallMethod(support, "get_facemasks", "i", state->texture_size);
+    if (self->facemasks_py == NULL)
+        return true;
     // borrowed references, don't need to be decref'd
     self->facemasks[0] = PyTuple_GetItem(self->facemasks_py, 0);
     self->facemasks[1] = PyTuple_GetItem(self->facemasks_py, 1);
@@ -24,7 +24,20 @@ no_fluids_start(void* data, RenderState* state, PyObject* support) {
 
 static bool
 no_fluids_hidden(void* data, RenderState* state, int32_t x, int32_t y, int32_t z) {
-    return block_has_property(state->block, FLUID);
+    return block_has_property(get_data(state, BLOCKS, x, y, z), FLUID);
+}
+
+static void
+no_fluids_hidden_mask(void* data, RenderState* state, uint16_t hidden[16][16]) {
+    int32_t x, y, z;
+    for (x = 0; x < 16; x++) {
+        for (z = 0; z < 16; z++) {
+            for (y = 0; y < 16; y++) {
+                if (block_has_property(getArrayShort3D(state->blocks, x, y, z), FLUID))
+                    hidden[x][z] |= 1 << y;
+            }
+        }
+    }
 }
 
 RenderPrimitiveInterface primitive_no_fluids = {
@@ -35,4 +48,5 @@ RenderPrimitiveInterface primitive_no_fluids = {
     NULL,
     no_fluids_hidden,
     NULL,
+    no_fluids_hidden_mask,
 };
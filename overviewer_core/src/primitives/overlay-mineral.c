@@ -23,6 +23,10 @@ typedef struct {
     RenderPrimitiveOverlay parent;
 
     void* minerals;
+
+    /* the column summary of the chunk, see
+       MineralOverlay.get_mineral_summary() */
+    PyArrayObject *best, *lowest;
 } RenderPrimitiveMineral;
 
 struct MineralColor {
@@ -50,31 +54,57 @@ static struct MineralColor default_minerals[] = {
 static void get_color(void* data, RenderState* state,
                       uint8_t* r, uint8_t* g, uint8_t* b, uint8_t* a) {
 
-    int32_t x = state->x, z = state->z, y_max, y;
-    int32_t max_i = -1;
+    int32_t x = state->x, z = state->z, y_max, tmp;
+    uint8_t i;
     RenderPrimitiveMineral* self = (RenderPrimitiveMineral*)data;
     struct MineralColor* minerals = (struct MineralColor*)(self->minerals);
     *a = 0;
 
-    y_max = state->y + 1;
-    for (y = state->chunky * -16; y <= y_max; y++) {
-        int32_t i, tmp;
-        mc_block_t block = get_data(state, BLOCKS, x, y, z);
+    /* the most valuable mineral in the column, up to the block above this
+       one, and the lowest y it's at */
+    y_max = state->chunky * 16 + state->y + 1;
+    i = getArrayByte3D(self->best, x, y_max, z);
+    if (i == 255)
+        return;
 
-        for (i = 0; (max_i == -1 || i < max_i) && minerals[i].block != block_air; i++) {
-            if (minerals[i].block == block) {
-                *r = minerals[i].r;
-                *g = minerals[i].g;
-                *b = minerals[i].b;
+    *r = minerals[i].r;
+    *g = minerals[i].g;
+    *b = minerals[i].b;
 
-                tmp = (128 - y_max + y) * 2 - 40;
-                *a = OV_MIN(OV_MAX(0, tmp), 255);
+    tmp = (128 - y_max + getArrayShort3D(self->lowest, x, i, z)) * 2 - 40;
+    *a = OV_MIN(OV_MAX(0, tmp), 255);
+}
 
-                max_i = i;
-                break;
-            }
-        }
+/* Gets the column summary of the chunk from the Python side, where it's
+   worked out once per chunk with numpy. Returns true on error. */
+static bool
+load_summary(RenderPrimitiveMineral* self, RenderState* state, PyObject* support) {
+    struct MineralColor* minerals = (struct MineralColor*)(self->minerals);
+    PyObject *blockids, *summary;
+    Py_ssize_t count, i;
+
+    /* the list ends at the first air block */
+    for (count = 0; minerals[count].block != block_air; count++)
+        ;
+    blockids = PyTuple_New(count);
+    if (blockids == NULL)
+        return true;
+    for (i = 0; i < count; i++)
+        PyTuple_SET_ITEM(blockids, i, PyLong_FromLong(minerals[i].block));
+
+    summary = PyObject_CallMethod(support, "get_mineral_summary", "OiiO",
+                                  state->regionset, state->chunkx, state->chunkz, blockids);
+    Py_DECREF(blockids);
+    if (summary == NULL)
+        return true;
+    if (!PyArg_ParseTuple(summary, "OO", &(self->best), &(self->lowest))) {
+        Py_DECREF(summary);
+        return true;
     }
+    Py_INCREF(self->best);
+    Py_INCREF(self->lowest);
+    Py_DECREF(summary);
+    return false;
 }
 
 static bool
@@ -121,6 +151,13 @@ overlay_mineral_start(void* data, RenderState* state, PyObject* support) {
         self->minerals = default_minerals;
     }
 
+    if (load_summary(self, state, support)) {
+        if (self->minerals != default_minerals)
+            free(self->minerals);
+        self->minerals = NULL;
+        return true;
+    }
+
     /* setup custom color */
     self->parent.get_color = get_color;
 
@@ -135,6 +172,8 @@ overlay_mineral_finish(void* data, RenderState* state) {
     if (self->minerals && self->minerals != default_minerals) {
         free(self->minerals);
     }
+    Py_XDECREF(self->best);
+    Py_XDECREF(self->lowest);
 
     /* now, chain up */
     primitive_overlay.finish(data, state);
@@ -22,6 +22,8 @@ typedef struct {
     /* inherits from overlay */
     RenderPrimitiveOverlay parent;
     int64_t seed; // needs to be at least 64-bits
+    /* whether slimes spawn in this chunk, worked out once in start */
+    bool slime;
 } RenderPrimitiveSlime;
 
 /*
@@ -78,7 +80,7 @@ static void get_color(void* data, RenderState* state,
     /* default to no overlay, until told otherwise */
     *a = 0;
 
-    if (is_slime(self->seed, state->chunkx, state->chunkz)) {
+    if (self->slime) {
         /* slimes can spawn! */
         *a = self->parent.color->a;
     }
@@ -111,6 +113,9 @@ overlay_slime_start(void* data, RenderState* state, PyObject* support) {
     if (PyErr_Occurred())
         return true;
 
+    /* the answer is the same for the whole chunk */
+    self->slime = is_slime(self->seed, state->chunkx, state->chunkz);
+
     return false;
 }
 
@@ -21,14 +21,56 @@
 typedef struct {
     /* inherits from overlay */
     RenderPrimitiveOverlay parent;
+    /* the overlay alpha for each block of the section, from the light
+       above it, worked out on the first get_color (the chunks aren't
+       loaded yet in start) */
+    bool alpha_ready;
+    uint8_t alpha[16][16][16];
 } RenderPrimitiveSpawn;
 
+/* fills in self->alpha from the light arrays of the section and the one
+   above it */
+static void compute_alpha(RenderPrimitiveSpawn* self, RenderState* state) {
+    ChunkData* chunk = &(state->chunks[1][1]);
+    int32_t x, y, z;
+
+    for (y = 0; y < 16; y++) {
+        /* light is taken from the block above */
+        int32_t sectiony = state->chunky, y_light = y + 1;
+        PyArrayObject *skyarray = NULL, *blockarray = NULL;
+        if (y_light == 16) {
+            y_light = 0;
+            sectiony++;
+        }
+        if (sectiony < SECTIONS_PER_CHUNK) {
+            skyarray = chunk->sections[sectiony].skylight;
+            blockarray = chunk->sections[sectiony].blocklight;
+        }
+
+        for (z = 0; z < 16; z++) {
+            for (x = 0; x < 16; x++) {
+                /* same defaults as get_data() */
+                int32_t skylight = skyarray ? getArrayByte3D(skyarray, x, y_light, z) : 15;
+                int32_t blocklight = blockarray ? getArrayByte3D(blockarray, x, y_light, z) : 0;
+
+                if (OV_MAX(blocklight, skylight) <= 7) {
+                    /* hostile mobs spawn in daylight */
+                    self->alpha[y][z][x] = 240;
+                } else if (OV_MAX(blocklight, skylight - 11) <= 7) {
+                    /* hostile mobs spawn at night */
+                    self->alpha[y][z][x] = 150;
+                } else {
+                    self->alpha[y][z][x] = 0;
+                }
+            }
+        }
+    }
+    self->alpha_ready = true;
+}
+
 static void get_color(void* data, RenderState* state,
                       uint8_t* r, uint8_t* g, uint8_t* b, uint8_t* a) {
     RenderPrimitiveSpawn* self = (RenderPrimitiveSpawn*)data;
-    int32_t x = state->x, y = state->y, z = state->z;
-    int32_t y_light = y + 1;
-    uint8_t blocklight, skylight;
 
     /* set a nice, pretty red color */
     *r = self->parent.color->r;
@@ -43,16 +85,9 @@ static void get_color(void* data, RenderState* state,
         return;
     }
 
-    blocklight = get_data(state, BLOCKLIGHT, x, y_light, z);
-    skylight = get_data(state, SKYLIGHT, x, y_light, z);
-
-    if (OV_MAX(blocklight, skylight) <= 7) {
-        /* hostile mobs spawn in daylight */
-        *a = 240;
-    } else if (OV_MAX(blocklight, skylight - 11) <= 7) {
-        /* hostile mobs spawn at night */
-        *a = 150;
-    }
+    if (!self->alpha_ready)
+        compute_alpha(self, state);
+    *a = self->alpha[state->y][state->z][state->x];
 }
 
 static bool
@@ -18,13 +18,6 @@
 #include "../mc_id.h"
 #include "overlay.h"
 
-typedef struct {
-    /* inherits from overlay */
-    RenderPrimitiveOverlay parent;
-    void* structures;
-    int32_t numcolors;
-} RenderPrimitiveStructure;
-
 struct Condition {
     int32_t relx, rely, relz;
     mc_block_t block;
@@ -36,6 +29,183 @@ struct Color {
     uint8_t r, g, b, a;
 };
 
+/* The colors are compiled into a dispatch table when the primitive starts.
+ * The first condition of each color is its anchor. A probe is an offset some
+ * anchors are at, so for each y the block at each probe is looked up once,
+ * and only the colors anchored on that block have their other conditions
+ * checked. */
+struct Probe {
+    int32_t relx, rely, relz;
+    /* this probe's rules in the rules array, sorted by block */
+    int32_t first, count;
+};
+
+struct Rule {
+    mc_block_t block;
+    int32_t color;
+};
+
+/* no y of the column matches the color */
+#define NO_MATCH INT32_MAX
+
+typedef struct {
+    /* inherits from overlay */
+    RenderPrimitiveOverlay parent;
+    void* structures;
+    int32_t numcolors;
+
+    struct Probe* probes;
+    int32_t numprobes;
+    struct Rule* rules;
+
+    /* For each column of the chunk, the lowest y each color matches at, and
+     * whether the column was scanned yet. This saves scanning the whole
+     * column again for every block in it. */
+    int32_t* lowest;
+    uint8_t scanned[16][16];
+} RenderPrimitiveStructure;
+
+static void free_structures(RenderPrimitiveStructure* self) {
+    struct Color* structures = (struct Color*)(self->structures);
+    int32_t i;
+
+    if (structures) {
+        for (i = 0; i < self->numcolors; i++) {
+            free(structures[i].conditions);
+        }
+        free(structures);
+        self->structures = NULL;
+    }
+    free(self->probes);
+    self->probes = NULL;
+    free(self->rules);
+    self->rules = NULL;
+    free(self->lowest);
+    self->lowest = NULL;
+}
+
+static int compare_rules(const void* a, const void* b) {
+    const struct Rule* ra = (const struct Rule*)a;
+    const struct Rule* rb = (const struct Rule*)b;
+    if (ra->block != rb->block)
+        return ra->block < rb->block ? -1 : 1;
+    return ra->color - rb->color;
+}
+
+/* Builds the probes and rules of the dispatch table. Returns true on error. */
+static bool compile_structures(RenderPrimitiveStructure* self) {
+    struct Color* structures = (struct Color*)(self->structures);
+    struct Rule* rules;
+    int32_t col, i, numrules = 0;
+    int32_t* probe_of;
+
+    self->probes = calloc(self->numcolors, sizeof(struct Probe));
+    self->rules = calloc(self->numcolors, sizeof(struct Rule));
+    self->lowest = calloc(16 * 16 * self->numcolors, sizeof(int32_t));
+    probe_of = calloc(self->numcolors, sizeof(int32_t));
+    if (self->probes == NULL || self->rules == NULL || self->lowest == NULL || probe_of == NULL) {
+        free(probe_of);
+        PyErr_SetString(PyExc_MemoryError, "failed to allocate memory");
+        return true;
+    }
+
+    /* find the probe of each color */
+    self->numprobes = 0;
+    for (col = 0; col < self->numcolors; col++) {
+        struct Condition* anchor = structures[col].conditions;
+        probe_of[col] = -1;
+        if (structures[col].numconds == 0)
+            continue;
+        for (i = 0; i < self->numprobes; i++) {
+            struct Probe* p = &self->probes[i];
+            if (p->relx == anchor->relx && p->rely == anchor->rely && p->relz == anchor->relz)
+                break;
+        }
+        if (i == self->numprobes) {
+            self->probes[i].relx = anchor->relx;
+            self->probes[i].rely = anchor->rely;
+            self->probes[i].relz = anchor->relz;
+            self->numprobes++;
+        }
+        self->probes[i].count++;
+        probe_of[col] = i;
+    }
+
+    /* lay the rules out probe by probe, and sort each probe's by block */
+    for (i = 0; i < self->numprobes; i++) {
+        self->probes[i].first = numrules;
+        rules = &self->rules[numrules];
+        numrules += self->probes[i].count;
+        self->probes[i].count = 0;
+        for (col = 0; col < self->numcolors; col++) {
+            if (probe_of[col] != i)
+                continue;
+            rules[self->probes[i].count].block = structures[col].conditions[0].block;
+            rules[self->probes[i].count].color = col;
+            self->probes[i].count++;
+        }
+        qsort(rules, self->probes[i].count, sizeof(struct Rule), compare_rules);
+    }
+
+    free(probe_of);
+    return false;
+}
+
+/* Returns whether the other conditions of the given color hold at y, when
+ * its anchor does. */
+static inline bool check_conditions(RenderState* state, struct Color* color,
+                                    int32_t x, int32_t y, int32_t z) {
+    int32_t cond;
+    for (cond = 1; cond < color->numconds; cond++) {
+        struct Condition* c = &color->conditions[cond];
+        if (c->block != get_data(state, BLOCKS, x + c->relx, y + c->rely, z + c->relz))
+            return false;
+    }
+    return true;
+}
+
+/* Fills in lowest with the lowest y, from the bottom of the world up to
+ * the top of the chunk section, each color matches at in the given column. */
+static void scan_column(RenderPrimitiveStructure* self, RenderState* state,
+                        int32_t x, int32_t z, int32_t* lowest) {
+    struct Color* structures = (struct Color*)(self->structures);
+    int32_t col, y, i, remaining = 0;
+
+    for (col = 0; col < self->numcolors; col++) {
+        lowest[col] = NO_MATCH;
+        if (structures[col].numconds > 0)
+            remaining++;
+    }
+
+    /* get_color() needs the colors up to y + 1 of the top block */
+    for (y = state->chunky * -16; y <= 16 && remaining > 0; y++) {
+        for (i = 0; i < self->numprobes; i++) {
+            struct Probe* p = &self->probes[i];
+            struct Rule* rules = &self->rules[p->first];
+            mc_block_t block = get_data(state, BLOCKS, x + p->relx, y + p->rely, z + p->relz);
+            int32_t lo = 0, hi = p->count;
+
+            /* find the first rule for this block */
+            while (lo < hi) {
+                int32_t mid = (lo + hi) / 2;
+                if (rules[mid].block < block)
+                    lo = mid + 1;
+                else
+                    hi = mid;
+            }
+            for (; lo < p->count && rules[lo].block == block; lo++) {
+                col = rules[lo].color;
+                if (lowest[col] != NO_MATCH)
+                    continue;
+                if (check_conditions(state, &structures[col], x, y, z)) {
+                    lowest[col] = y;
+                    remaining--;
+                }
+            }
+        }
+    }
+}
+
 static void get_color(void* data,
                       RenderState* state,
                       uint8_t* r,
@@ -44,43 +214,39 @@ static void get_color(void* data,
                       uint8_t* a) {
     /**
      * Calculate the color at the current position and store the values to r,g,b,a.
+     * The first color whose conditions are all met at some y of the column,
+     * up to the block above the current one, wins.
      **/
     RenderPrimitiveStructure* self = (RenderPrimitiveStructure*)data;
-    int32_t x = state->x, z = state->z, y_max, y, col, cond;
+    int32_t x = state->x, z = state->z, col;
     struct Color* structures = (struct Color*)(self->structures);
-    struct Condition* c = NULL;
-    bool all = true;
-    y_max = state->y + 1;
+    int32_t* lowest;
 
-    /**
-     * Check for every color in every y level if all its Conditions are met.
-     * If all conditions are met for one y level set r,b,g,a accordingly.
-     **/
-    // iterate over all the colors
-    for (col = 0; col < self->numcolors; col++) {
-        // iterate over all y levels
-        for (y = state->chunky * -16; y <= y_max; y++) {
-            // iterate over all the conditions
-            for (cond = 0; cond < structures[col].numconds; cond++) {
-                all = true;
-                c = (struct Condition*)&structures[col].conditions[cond];
-                // check if the condition does apply and break from the conditions loop if not.
-                if (!(c->block == get_data(state, BLOCKS, x + c->relx, y + c->rely, z + c->relz))) {
-                    all = false;
-                    break;
-                }
-            }
-            if (all) {
-                // set the color
-                *r = structures[col].r;
-                *g = structures[col].g;
-                *b = structures[col].b;
-                *a = structures[col].a;
-                return;
-            }
+    if (self->numcolors == 0)
+        return;
+
+    /* a first color without conditions matches anything */
+    if (structures[0].numconds == 0) {
+        col = 0;
+    } else {
+        lowest = &self->lowest[(x * 16 + z) * self->numcolors];
+        if (!self->scanned[x][z]) {
+            scan_column(self, state, x, z, lowest);
+            self->scanned[x][z] = 1;
+        }
+        for (col = 0; col < self->numcolors; col++) {
+            if (lowest[col] <= state->y + 1)
+                break;
         }
+        if (col == self->numcolors)
+            return;
     }
-    return;
+
+    // set the color
+    *r = structures[col].r;
+    *g = structures[col].g;
+    *b = structures[col].b;
+    *a = structures[col].a;
 }
 
 static bool overlay_structure_start(void* data, RenderState* state, PyObject* support) {
@@ -110,8 +276,7 @@ static bool overlay_structure_start(void* data, RenderState* state, PyObject* su
     if (opt && opt != Py_None) {
         struct Color* structures = NULL;
         struct Condition* cond = NULL;
-        Py_ssize_t structures_size = 0, i, cond_size = 0, n = 0;
-        bool cont = true;
+        Py_ssize_t structures_size = 0, i, n = 0;
 
         opt = PySequence_Fast(opt, "expected a sequence");
         if (!opt) {
@@ -125,78 +290,77 @@ static bool overlay_structure_start(void* data, RenderState* state, PyObject* su
         self->numcolors = structures_size;
         if (structures == NULL) {
             PyErr_SetString(PyExc_MemoryError, "failed to allocate memory");
+            Py_DECREF(opt);
             return true;
         }
 
         /**
          * Try to parse the definitions of conditions and colors.
          **/
-        if (cont) {
-            for (i = 0; i < structures_size; i++) {
-                PyObject* structure = PyList_GET_ITEM(opt, i);
-                // condspy holding the conditions tuple of variable length (python object)
-                PyObject* condspy;
-                // colorpy holding the 4 tuple with r g b a values of the color
-                PyObject* colorpy;
-
-                // getting the condspy and colorpy out of the structures.
-                if (!PyArg_ParseTuple(structure, "OO", &condspy, &colorpy)) {
-                    // Exception set automatically
-                    free(structures);
-                    self->structures = NULL;
-                    return true;
-                }
+        for (i = 0; i < structures_size; i++) {
+            PyObject* structure = PySequence_Fast_GET_ITEM(opt, i);
+            // condspy holding the conditions tuple of variable length (python object)
+            PyObject* condspy;
+            // colorpy holding the 4 tuple with r g b a values of the color
+            PyObject* colorpy;
 
-                // Parse colorpy into a c-struct.
-                if (!PyArg_ParseTuple(colorpy, "bbbb",
-                                      &structures[i].r,
-                                      &structures[i].g,
-                                      &structures[i].b,
-                                      &structures[i].a)) {
-                    free(structures);
-                    self->structures = NULL;
-                    return true;
-                }
+            // getting the condspy and colorpy out of the structures.
+            // Parse colorpy into a c-struct.
+            if (!PyArg_ParseTuple(structure, "OO", &condspy, &colorpy) ||
+                !PyArg_ParseTuple(colorpy, "bbbb",
+                                  &structures[i].r,
+                                  &structures[i].g,
+                                  &structures[i].b,
+                                  &structures[i].a)) {
+                // Exception set automatically
+                free_structures(self);
+                Py_DECREF(opt);
+                return true;
+            }
 
-                // Convert condspy to a fast sequence
-                condspy = PySequence_Fast(condspy, "Failed to parse conditions");
-                if (condspy == NULL) {
-                    free(structures);
-                    self->structures = NULL;
-                    return true;
-                }
+            // Convert condspy to a fast sequence
+            condspy = PySequence_Fast(condspy, "Failed to parse conditions");
+            if (condspy == NULL) {
+                free_structures(self);
+                Py_DECREF(opt);
+                return true;
+            }
 
-                // get the number of conditions.
-                structures[i].numconds = PySequence_Fast_GET_SIZE(condspy);
-                // reserve enough memory for the conditions.
-                cond = calloc(structures[i].numconds, sizeof(struct Condition));
-                structures[i].conditions = cond;
+            // get the number of conditions.
+            structures[i].numconds = PySequence_Fast_GET_SIZE(condspy);
+            // reserve enough memory for the conditions.
+            cond = calloc(structures[i].numconds, sizeof(struct Condition));
+            structures[i].conditions = cond;
 
-                if (structures[i].conditions == NULL) {
-                    PyErr_SetString(PyExc_MemoryError, "failed to allocate memory");
-                    free(structures);
-                    self->structures = NULL;
-                    return true;
-                }
+            if (structures[i].conditions == NULL) {
+                PyErr_SetString(PyExc_MemoryError, "failed to allocate memory");
+                free_structures(self);
+                Py_DECREF(condspy);
+                Py_DECREF(opt);
+                return true;
+            }
 
-                // iterate over all the conditions and read them.
-                for (n = 0; n < structures[i].numconds; n++) {
-                    PyObject* ccond = PySequence_Fast_GET_ITEM(condspy, n);
-                    if (!PyArg_ParseTuple(ccond, "iiib",
-                                          &cond[n].relx,
-                                          &cond[n].rely,
-                                          &cond[n].relz,
-                                          &cond[n].block)) {
-                        int32_t x = 0;
-                        for (x = 0; x < structures_size; x++) {
-                            free(structures[x].conditions);
-                        }
-                        free(structures);
-                        self->structures = NULL;
-                        return true;
-                    }
+            // iterate over all the conditions and read them.
+            for (n = 0; n < structures[i].numconds; n++) {
+                PyObject* ccond = PySequence_Fast_GET_ITEM(condspy, n);
+                if (!PyArg_ParseTuple(ccond, "iiib",
+                                      &cond[n].relx,
+                                      &cond[n].rely,
+                                      &cond[n].relz,
+                                      &cond[n].block)) {
+                    free_structures(self);
+                    Py_DECREF(condspy);
+                    Py_DECREF(opt);
+                    return true;
                 }
             }
+            Py_DECREF(condspy);
+        }
+        Py_DECREF(opt);
+
+        if (compile_structures(self)) {
+            free_structures(self);
+            return true;
         }
     }
 
@@ -208,22 +372,7 @@ static bool overlay_structure_start(void* data, RenderState* state, PyObject* su
 
 static void overlay_structure_finish(void* data, RenderState* state) {
     /* first free all *our* stuff */
-    RenderPrimitiveStructure* self = (RenderPrimitiveStructure*)data;
-    int32_t i = 0;
-
-    if (self->structures) {
-        // freeing the nested structure
-        struct Color* m = self->structures;
-        for (i = 0; i < self->numcolors; i++) {
-            if (m[i].conditions)
-                free(m[i].conditions);
-        }
-    }
-
-    if (self->structures) {
-        free(self->structures);
-        self->structures = NULL;
-    }
+    free_structures((RenderPrimitiveStructure*)data);
 
     /* now, chain up */
     primitive_overlay.finish(data, state);
@@ -34,8 +34,12 @@ overlay_start(void* data, RenderState* state, PyObject* support) {
     OverlayColor* color = NULL;
     RenderPrimitiveOverlay* self = (RenderPrimitiveOverlay*)data;
 
-    self->facemask_top = PyObject_GetAttrString(support, "facemask_top");
-    self->white_color = PyObject_GetAttrString(support, "whitecolor");
+    self->facemask_top = PyObject_CallMethod(support, "get_facemask_top", "i", state->texture_size);
+    if (self->facemask_top == NULL)
+        return true;
+    self->white_color = PyObject_CallMethod(support, "get_whitecolor", "i", state->texture_size);
+    if (self->white_color == NULL)
+        return true;
     self->get_color = get_color;
 
     color = self->color = calloc(1, sizeof(OverlayColor));
@@ -86,9 +90,9 @@ void overlay_draw(void* data, RenderState* state, PyObject* src, PyObject* mask,
     // exactly analogous to edge-line code for these special blocks
     int32_t increment = 0;
     if (state->block == block_stone_slab) // half-step
-        increment = 6;
+        increment = SPRITE_PX(state, 6);
     else if (state->block == block_snow_layer) // snow
-        increment = 9;
+        increment = SPRITE_PX(state, 9);
 
     /* skip rendering the overlay if we can't see it */
     top_block = get_data(state, BLOCKS, state->x, state->y + 1, state->z);
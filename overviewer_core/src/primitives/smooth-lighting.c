@@ -21,9 +21,29 @@
 #include "../overviewer.h"
 #include "lighting.h"
 
+/* a light color, and whether it has been worked out yet */
+struct SmoothLightingColor {
+    uint8_t r, g, b;
+    bool ready;
+};
+
 typedef struct {
     /* inherits from lighting */
     RenderPrimitiveLighting parent;
+
+    /* the light colors of the blocks of the section and the ones around
+       it, indexed [y + 1][z + 1][x + 1] */
+    struct SmoothLightingColor blocks[18][18][18];
+
+    /* the shaded color of each face corner, for each face direction. The
+       corners of the faces of block x, y, z are at x..x + 1, y..y + 1,
+       z..z + 1 (along the two axes in the plane of the face), so this is
+       indexed [face][y][z][x] by corner. Neighbouring faces share their
+       corners, and all the blocks of a section share their arrays.
+
+       Both are filled in as they're needed, since most sections only draw
+       a few of their blocks. */
+    struct SmoothLightingColor corners[3][17][17][17];
 } RenderPrimitiveSmoothLighting;
 
 /* structure representing one corner of a face (see below) */
@@ -108,76 +128,111 @@ enum {
     FACE_RIGHT = 2,
 };
 
+/* returns the light color of the given block, which must be at most one
+   block outside the section */
+static inline struct SmoothLightingColor*
+get_block_color(RenderPrimitiveSmoothLighting* self, RenderState* state,
+                int32_t x, int32_t y, int32_t z) {
+    struct SmoothLightingColor* color = &(self->blocks[y + 1][z + 1][x + 1]);
+    if (!color->ready) {
+        get_lighting_color((RenderPrimitiveLighting*)self, state, x, y, z,
+                           &(color->r), &(color->g), &(color->b));
+        color->ready = true;
+    }
+    return color;
+}
+
+/* returns the shaded color of corner i of the given face of the current
+   block, from the four blocks around the corner */
+static inline struct SmoothLightingColor*
+get_corner_color(RenderPrimitiveSmoothLighting* self, RenderState* state,
+                 int32_t facei, struct SmoothLightingFace* face, int32_t i) {
+    struct SmoothLightingCorner* pt = &(face->corners[i]);
+    struct SmoothLightingColor* color;
+    int32_t cx = state->x + face->dx;
+    int32_t cy = state->y + face->dy;
+    int32_t cz = state->z + face->dz;
+
+    /* the corner's place in the grid, see RenderPrimitiveSmoothLighting */
+    int32_t vx = state->x + (pt->dx1 > 0) + (pt->dx2 > 0);
+    int32_t vy = state->y + (pt->dy1 > 0) + (pt->dy2 > 0);
+    int32_t vz = state->z + (pt->dz1 > 0) + (pt->dz2 > 0);
+
+    color = &(self->corners[facei][vy][vz][vx]);
+    if (!color->ready) {
+        float comp_shade_strength = 1.0 - self->parent.strength;
+        uint32_t rgather = 0, ggather = 0, bgather = 0;
+        struct SmoothLightingColor* around[4];
+        int32_t j;
+
+        around[0] = get_block_color(self, state, cx, cy, cz);
+        around[1] = get_block_color(self, state, cx + pt->dx1, cy + pt->dy1, cz + pt->dz1);
+        around[2] = get_block_color(self, state, cx + pt->dx2, cy + pt->dy2, cz + pt->dz2);
+        /* FIXME special far corner handling */
+        around[3] = get_block_color(self, state,
+                                    cx + pt->dx1 + pt->dx2, cy + pt->dy1 + pt->dy2, cz + pt->dz1 + pt->dz2);
+        for (j = 0; j < 4; j++) {
+            rgather += around[j]->r;
+            ggather += around[j]->g;
+            bgather += around[j]->b;
+        }
+
+        rgather += (255 * 4 - rgather) * comp_shade_strength;
+        ggather += (255 * 4 - ggather) * comp_shade_strength;
+        bgather += (255 * 4 - bgather) * comp_shade_strength;
+
+        color->r = rgather / 4;
+        color->g = ggather / 4;
+        color->b = bgather / 4;
+        color->ready = true;
+    }
+    return color;
+}
+
 static void
-do_shading_with_rule(RenderPrimitiveSmoothLighting* self, RenderState* state, struct SmoothLightingFace face) {
+do_shading_with_rule(RenderPrimitiveSmoothLighting* self, RenderState* state, int32_t facei) {
     int32_t i;
-    RenderPrimitiveLighting* lighting = (RenderPrimitiveLighting*)self;
+    struct SmoothLightingFace* face = &(lighting_rules[facei]);
     int32_t x = state->imgx, y = state->imgy;
-    struct SmoothLightingCorner* pts = face.corners;
-    float comp_shade_strength = 1.0 - lighting->strength;
+    struct SmoothLightingCorner* pts = face->corners;
     uint8_t pts_r[4] = {0, 0, 0, 0};
     uint8_t pts_g[4] = {0, 0, 0, 0};
     uint8_t pts_b[4] = {0, 0, 0, 0};
-    int32_t cx = state->x + face.dx;
-    int32_t cy = state->y + face.dy;
-    int32_t cz = state->z + face.dz;
+    int32_t px[4], py[4];
+    int32_t cx = state->x + face->dx;
+    int32_t cy = state->y + face->dy;
+    int32_t cz = state->z + face->dz;
 
     /* first, check for occlusion if the block is in the local chunk */
     if (lighting_is_face_occluded(state, 0, cx, cy, cz))
         return;
 
-    /* calculate the lighting colors for each point */
+    /* look up the lighting colors for each point */
     for (i = 0; i < 4; i++) {
-        uint8_t r, g, b;
-        uint32_t rgather = 0, ggather = 0, bgather = 0;
-
-        get_lighting_color(lighting, state, cx, cy, cz,
-                           &r, &g, &b);
-        rgather += r;
-        ggather += g;
-        bgather += b;
-
-        get_lighting_color(lighting, state,
-                           cx + pts[i].dx1, cy + pts[i].dy1, cz + pts[i].dz1,
-                           &r, &g, &b);
-        rgather += r;
-        ggather += g;
-        bgather += b;
-
-        get_lighting_color(lighting, state,
-                           cx + pts[i].dx2, cy + pts[i].dy2, cz + pts[i].dz2,
-                           &r, &g, &b);
-        rgather += r;
-        ggather += g;
-        bgather += b;
-
-        /* FIXME special far corner handling */
-        get_lighting_color(lighting, state,
-                           cx + pts[i].dx1 + pts[i].dx2, cy + pts[i].dy1 + pts[i].dy2, cz + pts[i].dz1 + pts[i].dz2,
-                           &r, &g, &b);
-        rgather += r;
-        ggather += g;
-        bgather += b;
-
-        rgather += (255 * 4 - rgather) * comp_shade_strength;
-        ggather += (255 * 4 - ggather) * comp_shade_strength;
-        bgather += (255 * 4 - bgather) * comp_shade_strength;
+        struct SmoothLightingColor* color = get_corner_color(self, state, facei, face, i);
+        pts_r[i] = color->r;
+        pts_g[i] = color->g;
+        pts_b[i] = color->b;
+    }
 
-        pts_r[i] = rgather / 4;
-        pts_g[i] = ggather / 4;
-        pts_b[i] = bgather / 4;
+    /* where the corners are on sprites of the size in use. The touch-up
+     * points are only right for 24px sprites */
+    for (i = 0; i < 4; i++) {
+        px[i] = x + SPRITE_PX(state, pts[i].imgx);
+        py[i] = y + SPRITE_PX(state, pts[i].imgy);
     }
 
     /* draw the face */
     draw_triangle(state->img, 1,
-                  x + pts[0].imgx, y + pts[0].imgy, pts_r[0], pts_g[0], pts_b[0],
-                  x + pts[1].imgx, y + pts[1].imgy, pts_r[1], pts_g[1], pts_b[1],
-                  x + pts[2].imgx, y + pts[2].imgy, pts_r[2], pts_g[2], pts_b[2],
-                  x, y, face.touch_up_points, face.num_touch_up_points);
+                  px[0], py[0], pts_r[0], pts_g[0], pts_b[0],
+                  px[1], py[1], pts_r[1], pts_g[1], pts_b[1],
+                  px[2], py[2], pts_r[2], pts_g[2], pts_b[2],
+                  x, y, state->texture_size == 24 ? face->touch_up_points : NULL,
+                  state->texture_size == 24 ? face->num_touch_up_points : 0);
     draw_triangle(state->img, 0,
-                  x + pts[0].imgx, y + pts[0].imgy, pts_r[0], pts_g[0], pts_b[0],
-                  x + pts[2].imgx, y + pts[2].imgy, pts_r[2], pts_g[2], pts_b[2],
-                  x + pts[3].imgx, y + pts[3].imgy, pts_r[3], pts_g[3], pts_b[3],
+                  px[0], py[0], pts_r[0], pts_g[0], pts_b[0],
+                  px[2], py[2], pts_r[2], pts_g[2], pts_b[2],
+                  px[3], py[3], pts_r[3], pts_g[3], pts_b[3],
                   x, y, NULL, 0);
 }
 
@@ -224,11 +279,11 @@ smooth_lighting_draw(void* data, RenderState* state, PyObject* src, PyObject* ma
     }
 
     if (light_top)
-        do_shading_with_rule(self, state, lighting_rules[FACE_TOP]);
+        do_shading_with_rule(self, state, FACE_TOP);
     if (light_left)
-        do_shading_with_rule(self, state, lighting_rules[FACE_LEFT]);
+        do_shading_with_rule(self, state, FACE_LEFT);
     if (light_right)
-        do_shading_with_rule(self, state, lighting_rules[FACE_RIGHT]);
+        do_shading_with_rule(self, state, FACE_RIGHT);
 }
 
 RenderPrimitiveInterface primitive_smooth_lighting = {
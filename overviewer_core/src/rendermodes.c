@@ -147,9 +147,16 @@ bool render_mode_occluded(RenderMode* self, int32_t x, int32_t y, int32_t z) {
 bool render_mode_hidden(RenderMode* self, int32_t x, int32_t y, int32_t z) {
     uint32_t i;
     bool hidden = false;
+    bool in_section = (x >= 0 && x < 16 && y >= 0 && y < 16 && z >= 0 && z < 16);
+
+    /* blocks of the section are looked up in the mask, for the primitives
+       that have one */
+    if (in_section && (self->hidden[x][z] & (1 << y)))
+        return true;
+
     for (i = 0; i < self->num_primitives; i++) {
         RenderPrimitive* prim = self->primitives[i];
-        if (prim->iface->hidden) {
+        if (prim->iface->hidden && !(in_section && prim->iface->hidden_mask)) {
             hidden |= prim->iface->hidden(prim->primitive, self->state, x, y, z);
         }
 
@@ -159,6 +166,19 @@ bool render_mode_hidden(RenderMode* self, int32_t x, int32_t y, int32_t z) {
     return hidden;
 }
 
+/* works out self->hidden for the current section, the section's chunk must
+   be loaded */
+void render_mode_hidden_mask(RenderMode* self) {
+    uint32_t i;
+    memset(self->hidden, 0, sizeof(self->hidden));
+    for (i = 0; i < self->num_primitives; i++) {
+        RenderPrimitive* prim = self->primitives[i];
+        if (prim->iface->hidden_mask) {
+            prim->iface->hidden_mask(prim->primitive, self->state, self->hidden);
+        }
+    }
+}
+
 void render_mode_draw(RenderMode* self, PyObject* img, PyObject* mask, PyObject* mask_light) {
     uint32_t i;
     for (i = 0; i < self->num_primitives; i++) {
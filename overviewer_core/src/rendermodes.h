@@ -61,6 +61,9 @@ typedef struct {
     bool (*hidden)(void*, RenderState*, int32_t, int32_t, int32_t);
     /* last two arguments are img and mask, from texture lookup */
     void (*draw)(void*, RenderState*, PyObject*, PyObject*, PyObject*);
+    /* optional, sets the bits of the blocks of the section to skip, like
+     * hidden does: bit y of hidden[x][z] for the block at x, y, z */
+    void (*hidden_mask)(void*, RenderState*, uint16_t hidden[16][16]);
 } RenderPrimitiveInterface;
 
 /* A quick note about the difference between occluded and hidden:
@@ -76,6 +79,13 @@ typedef struct {
  * job. For example, cave mode uses this to hide non-cave blocks. This check
  * should be *cheap*, as it's potentially called many times per block. For
  * example, in lighting mode it is called at most 4 times per block.
+ *
+ * Primitives whose hidden check needs to look at the neighboring blocks
+ * should also give a hidden_mask. It is called once per section, before
+ * anything is drawn, so it can work out the whole section at once (a column
+ * of 16 blocks at a time fits in a bitmask). The mask is then used for all
+ * the blocks of the section, and hidden only for blocks outside of it. The
+ * bits for air blocks don't matter.
  */
 
 /* convenience wrapper for a single primitive + interface */
@@ -89,6 +99,9 @@ struct _RenderMode {
     uint32_t num_primitives;
     RenderPrimitive** primitives;
     RenderState* state;
+    /* the blocks of the section hidden by the primitives with a
+       hidden_mask, see render_mode_hidden_mask() */
+    uint16_t hidden[16][16];
 };
 
 /* functions for creating / using rendermodes */
@@ -96,6 +109,7 @@ RenderMode* render_mode_create(PyObject* mode, RenderState* state);
 void render_mode_destroy(RenderMode* self);
 bool render_mode_occluded(RenderMode* self, int32_t x, int32_t y, int32_t z);
 bool render_mode_hidden(RenderMode* self, int32_t x, int32_t y, int32_t z);
+void render_mode_hidden_mask(RenderMode* self);
 void render_mode_draw(RenderMode* self, PyObject* img, PyObject* mask, PyObject* mask_light);
 
 /* helper function for reading in rendermode options
@@ -0,0 +1,529 @@
+#    This file is part of the Minecraft Overviewer.
+#
+#    Minecraft Overviewer is free software: you can redistribute it and/or
+#    modify it under the terms of the GNU General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or (at
+#    your option) any later version.
+#
+#    Minecraft Overviewer is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+#    Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License along
+#    with the Overviewer.  If not, see <http://www.gnu.org/licenses/>.
+
+"""This module holds the places a TileSet can keep its tiles in.
+
+A TileSet only ever refers to its tiles by the path they have in the directory
+layout the web viewer expects (outputdir/0/3/1.png and so on), and goes through
+its storage object for anything it does with them. FileStorage keeps the tiles
+in exactly that layout. SQLiteStorage keeps the tiles of all renders in a single
+SQLite database next to the render directories instead, which is much kinder
+to filesystems and backups than millions of small files; export_tiles() unpacks
+one into the directory layout for the web viewer.
+
+Both can store identical tiles only once: FileStorage with hardlinks, and
+SQLiteStorage by keeping each distinct image as a blob that any number of tiles
+refer to.
+
+The interface is:
+
+writer(imgpath, mtime)
+    A context manager that gives the name of a temporary file to write the
+    tile to. When the context exits without an error, the tile is put in place
+    with the given mtime.
+
+open(imgpath)
+    Returns a binary file object to read the tile from.
+
+get_stat(imgpath)
+    Returns a (size, mtime) tuple for the tile, or None if it doesn't exist.
+
+set_mtime(imgpath, mtime)
+    Sets the mtime of an existing tile, and only that tile.
+
+link(srcpath, imgpath, mtime)
+    Makes imgpath a copy of the existing tile srcpath, with the given mtime,
+    sharing its storage. Returns False if that can't be done, in which case
+    the tile has to be written as usual. If links_share_mtime is True, this is
+    only possible if srcpath already has that mtime.
+
+exists(imgpath), tree_exists(dirpath)
+    Whether the tile exists, or any tiles inside the given directory.
+
+makedirs(dirpath)
+    Makes sure tiles can be written into the given directory.
+
+remove(imgpath), remove_tree(dirpath)
+    Deletes the tile, or all tiles inside the given directory. Tiles that
+    don't exist are ignored.
+
+local_copies(imgpaths)
+    A context manager that gives a list of files holding the tiles that exist,
+    for the optimizers. Any changes to them are stored when the context exits,
+    keeping the tiles' mtimes.
+
+increase_depth(imgextension), decrease_depth(imgextension)
+    Moves the existing tiles into place for a tree one level deeper or
+    shallower. See TileSet._rearrange_tiles().
+
+cleanup()
+    Frees up any space no longer used by tiles. This is called by the master
+    process before the workers start.
+
+"""
+
+import contextlib
+import errno
+import functools
+import hashlib
+import io
+import logging
+import os
+import os.path
+import shutil
+import sqlite3
+import tempfile
+import threading
+
+from .files import FileReplacer
+
+
+class FileStorage(object):
+    """Keeps each tile in a file of its own, in the TileSet's output
+    directory.
+
+    """
+    # Hardlinked files have a single mtime
+    links_share_mtime = True
+
+    def __init__(self, outputdir, fs_caps):
+        self.outputdir = outputdir
+        self.fs_caps = fs_caps
+
+    @contextlib.contextmanager
+    def writer(self, imgpath, mtime):
+        with FileReplacer(imgpath, capabilities=self.fs_caps) as tmppath:
+            yield tmppath
+            try:
+                os.utime(tmppath, (mtime, mtime))
+            except OSError as e:
+                # Ignore errno ENOENT: file does not exist. Due to a race
+                # condition, two processes could conceivably try and update
+                # the same temp file at the same time
+                if e.errno != errno.ENOENT:
+                    raise
+
+    def open(self, imgpath):
+        return open(imgpath, "rb")
+
+    def get_stat(self, imgpath):
+        try:
+            st = os.stat(imgpath)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return None
+        return st.st_size, int(st.st_mtime)
+
+    def set_mtime(self, imgpath, mtime):
+        if self.fs_caps.get("rename_works") and os.stat(imgpath).st_nlink > 1:
+            # Don't change the mtime of the tiles this one is linked to, make
+            # it a file of its own first
+            with FileReplacer(imgpath, capabilities=self.fs_caps) as tmppath:
+                shutil.copyfile(imgpath, tmppath)
+                os.utime(tmppath, (mtime, mtime))
+        else:
+            os.utime(imgpath, (mtime, mtime))
+
+    def link(self, srcpath, imgpath, mtime):
+        if not self.fs_caps.get("rename_works"):
+            return False
+        try:
+            if int(os.stat(srcpath).st_mtime) != int(mtime):
+                return False
+            with FileReplacer(imgpath, capabilities=self.fs_caps) as tmppath:
+                os.link(srcpath, tmppath)
+        except OSError:
+            # Gone in the meantime, or no hardlinks on this filesystem
+            return False
+        return True
+
+    def exists(self, imgpath):
+        return os.path.exists(imgpath)
+
+    def tree_exists(self, dirpath):
+        return os.path.exists(dirpath)
+
+    def makedirs(self, dirpath):
+        if not os.path.exists(dirpath):
+            try:
+                os.makedirs(dirpath)
+            except OSError as e:
+                # Ignore errno EEXIST: file exists. Due to a race condition,
+                # two processes could conceivably try and create the same
+                # directory at the same time
+                if e.errno != errno.EEXIST:
+                    raise
+
+    def remove(self, imgpath):
+        try:
+            os.unlink(imgpath)
+        except OSError as e:
+            # Ignore errors if it's "file doesn't exist"
+            if e.errno != errno.ENOENT:
+                raise
+
+    def remove_tree(self, dirpath):
+        try:
+            shutil.rmtree(dirpath)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    @contextlib.contextmanager
+    def local_copies(self, imgpaths):
+        yield imgpaths
+
+    def cleanup(self):
+        pass
+
+    def increase_depth(self, imgextension):
+        getpath = functools.partial(os.path.join, self.outputdir)
+
+        # At top level of the tree:
+        # quadrant 0 is now 0/3
+        # 1 is now 1/2
+        # 2 is now 2/1
+        # 3 is now 3/0
+        # then all that needs to be done is to regenerate the new top level
+
+        def rollback_mkdir(dnum):
+            p = getpath("new" + str(dnum))
+            if os.path.exists(p):
+                os.rmdir(p)
+
+        def rollback_filerename(dnum):
+            newnum = (3, 2, 1, 0)[dnum]
+            qimg = getpath("new%d/%d.%s" % (dnum, newnum, imgextension))
+            qdir = getpath("new%d/%d" % (dnum, newnum))
+
+            if os.path.exists(qimg):
+                os.rename(qimg, getpath("%d.%s" % (dnum, imgextension)))
+            if os.path.exists(qdir):
+                os.rename(qdir, getpath(str(dnum)))
+
+        def rollback_dirrename(dnum):
+            os.rename(getpath(str(dnum)), getpath("new" + str(dnum)))
+
+        for dirnum in range(4):
+            newnum = (3, 2, 1, 0)[dirnum]
+
+            newdir = "new" + str(dirnum)
+            newdirpath = getpath(newdir)
+
+            files = [str(dirnum) + "." + imgextension, str(dirnum)]
+            newfiles = [str(newnum) + "." + imgextension, str(newnum)]
+
+            try:
+                try:
+                    os.mkdir(newdirpath)
+                    try:
+                        for f, newf in zip(files, newfiles):
+                            p = getpath(f)
+                            if os.path.exists(p):
+                                os.rename(p, getpath(newdir, newf))
+                    # We're catching BaseException here since we'll also want to do this on
+                    # exit.
+                    except BaseException:
+                        rollback_filerename(dirnum)
+                        raise
+                except BaseException:
+                    rollback_mkdir(dirnum)
+                    raise
+                os.rename(newdirpath, getpath(str(dirnum)))
+            except BaseException:
+                logging.warning("Overviewer was interrupted during tile "
+                                "re-arrangement.")
+                logging.warning("Rolling back changes...")
+                # Moonwalk the fuck out of here
+                for lastdir in range(dirnum - 1, -1, -1):
+                    rollback_dirrename(lastdir)
+                    rollback_filerename(lastdir)
+                    rollback_mkdir(lastdir)
+                raise
+
+    def decrease_depth(self, imgextension):
+        getpath = functools.partial(os.path.join, self.outputdir)
+
+        # quadrant 0/3 goes to 0
+        # 1/2 goes to 1
+        # 2/1 goes to 2
+        # 3/0 goes to 3
+        # Just worry about the directories here, the files at the top two
+        # levels are cheap enough to replace
+        for dirnum in range(4):
+            newnum = (3, 2, 1, 0)[dirnum]
+            if os.path.exists(getpath(str(dirnum), str(newnum))):
+                os.rename(getpath(str(dirnum), str(newnum)), getpath("new" + str(dirnum)))
+                shutil.rmtree(getpath(str(dirnum)))
+                os.rename(getpath("new" + str(dirnum)), getpath(str(dirnum)))
+
+        # Delete the files in the top directory to make sure they get re-created.
+        files = [str(num) + "." + imgextension for num in range(4)] + \
+            ["base." + imgextension]
+        for f in files:
+            self.remove(getpath(f))
+
+
+class SQLiteStorage(object):
+    """Keeps the tiles in a single SQLite database, shared by all renders in
+    the same output directory, in the style of MBTiles: a row for each tile,
+    keyed by (render, zoom, path), holding its mtime and the hash of its
+    image. The images themselves are in a table of their own, keyed by that
+    hash, so identical tiles are only stored once.
+
+    The render is the name of the TileSet's output directory, and the path is
+    relative to that, so the tiles can be unpacked into the same layout as
+    FileStorage uses.
+
+    Every worker process (and every writer thread in it) opens its own
+    connection to the database, which is in WAL mode, so they can all write
+    tiles at the same time.
+
+    """
+    filename = "tiles.sqlite"
+
+    links_share_mtime = False
+
+    def __init__(self, outputdir):
+        self.outputdir = outputdir
+        self.path = os.path.join(os.path.dirname(outputdir), self.filename)
+        self.render = os.path.basename(outputdir)
+        self._local = threading.local()
+
+    def _get_connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = connect(self.path)
+            self._local.conn = conn
+        return conn
+
+    def _key(self, imgpath):
+        path = os.path.relpath(imgpath, self.outputdir).replace(os.sep, "/")
+        # base.png is zoom level 0, 0.png is 1, 0/0.png is 2 and so on
+        if path.startswith("base."):
+            zoom = 0
+        else:
+            zoom = path.count("/") + 1
+        return self.render, zoom, path
+
+    def _tree_range(self, dirpath):
+        prefix = os.path.relpath(dirpath, self.outputdir).replace(os.sep, "/") + "/"
+        # "0" is the character after "/"
+        return self.render, prefix, prefix[:-1] + "0"
+
+    @contextlib.contextmanager
+    def writer(self, imgpath, mtime):
+        fd, tmppath = tempfile.mkstemp(suffix=".tmp", dir=self.outputdir)
+        os.close(fd)
+        try:
+            yield tmppath
+            with open(tmppath, "rb") as f:
+                data = f.read()
+            digest = hashlib.sha1(data).digest()
+            conn = self._get_connection()
+            conn.execute("INSERT OR IGNORE INTO blobs (hash, data) VALUES (?, ?)", (digest, data))
+            conn.execute("INSERT OR REPLACE INTO tiles (render, zoom, path, hash, mtime) "
+                         "VALUES (?, ?, ?, ?, ?)", self._key(imgpath) + (digest, int(mtime)))
+        finally:
+            os.remove(tmppath)
+
+    def open(self, imgpath):
+        row = self._get_connection().execute(
+            "SELECT data FROM tiles JOIN blobs USING (hash) "
+            "WHERE render = ? AND zoom = ? AND path = ?",
+            self._key(imgpath)).fetchone()
+        if row is None:
+            raise IOError(errno.ENOENT, "No such tile", imgpath)
+        return io.BytesIO(row[0])
+
+    def get_stat(self, imgpath):
+        row = self._get_connection().execute(
+            "SELECT length(data), mtime FROM tiles JOIN blobs USING (hash) "
+            "WHERE render = ? AND zoom = ? AND path = ?",
+            self._key(imgpath)).fetchone()
+        if row is None:
+            return None
+        return row[0], row[1]
+
+    def set_mtime(self, imgpath, mtime):
+        self._get_connection().execute(
+            "UPDATE tiles SET mtime = ? WHERE render = ? AND zoom = ? AND path = ?",
+            (int(mtime),) + self._key(imgpath))
+
+    def link(self, srcpath, imgpath, mtime):
+        cursor = self._get_connection().execute(
+            "INSERT OR REPLACE INTO tiles (render, zoom, path, hash, mtime) "
+            "SELECT render, ?, ?, hash, ? FROM tiles WHERE render = ? AND zoom = ? AND path = ?",
+            self._key(imgpath)[1:] + (int(mtime),) + self._key(srcpath))
+        return cursor.rowcount > 0
+
+    def exists(self, imgpath):
+        return self.get_stat(imgpath) is not None
+
+    def tree_exists(self, dirpath):
+        row = self._get_connection().execute(
+            "SELECT 1 FROM tiles WHERE render = ? AND path >= ? AND path < ? LIMIT 1",
+            self._tree_range(dirpath)).fetchone()
+        return row is not None
+
+    def makedirs(self, dirpath):
+        pass
+
+    def remove(self, imgpath):
+        self._get_connection().execute(
+            "DELETE FROM tiles WHERE render = ? AND zoom = ? AND path = ?", self._key(imgpath))
+
+    def remove_tree(self, dirpath):
+        self._get_connection().execute(
+            "DELETE FROM tiles WHERE render = ? AND path >= ? AND path < ?",
+            self._tree_range(dirpath))
+
+    @contextlib.contextmanager
+    def local_copies(self, imgpaths):
+        copies = []
+        try:
+            for imgpath in imgpaths:
+                stat = self.get_stat(imgpath)
+                if stat is None:
+                    continue
+                fd, tmppath = tempfile.mkstemp(suffix=".tmp", dir=self.outputdir)
+                with os.fdopen(fd, "wb") as out, self.open(imgpath) as f:
+                    out.write(f.read())
+                copies.append((imgpath, tmppath, stat[1]))
+            yield [tmppath for _, tmppath, _ in copies]
+
+            for imgpath, tmppath, mtime in copies:
+                with self.writer(imgpath, mtime) as writepath:
+                    os.replace(tmppath, writepath)
+        finally:
+            for _, tmppath, _ in copies:
+                if os.path.exists(tmppath):
+                    os.remove(tmppath)
+
+    def increase_depth(self, imgextension):
+        # Everything under quadrant 0 moves to 0/3, 1 to 1/2, 2 to 2/1 and 3
+        # to 3/0, like FileStorage does. The paths are moved out of the way
+        # first, so they never clash with paths that are still to be moved.
+        # It's all in one transaction, so an interruption changes nothing.
+        conn = self._get_connection()
+        with transaction(conn):
+            conn.execute("UPDATE tiles SET path = 'n' || path "
+                         "WHERE render = ? AND path >= '0' AND path < '4'", (self.render,))
+            for dirnum in range(4):
+                newnum = (3, 2, 1, 0)[dirnum]
+                conn.execute("UPDATE tiles SET zoom = zoom + 1, "
+                             "path = substr(path, 2, 1) || '/' || ? || substr(path, 3) "
+                             "WHERE render = ? AND substr(path, 1, 2) = ?",
+                             (str(newnum), self.render, "n" + str(dirnum)))
+
+    def decrease_depth(self, imgextension):
+        conn = self._get_connection()
+        with transaction(conn):
+            for dirnum in range(4):
+                newnum = (3, 2, 1, 0)[dirnum]
+                keep = "%d/%d/" % (dirnum, newnum)
+                if not conn.execute("SELECT 1 FROM tiles WHERE render = ? AND "
+                                    "substr(path, 1, 4) = ? LIMIT 1",
+                                    (self.render, keep)).fetchone():
+                    continue
+                conn.execute("DELETE FROM tiles WHERE render = ? AND path >= ? AND path < ? "
+                             "AND substr(path, 1, 4) != ?",
+                             (self.render, "%d/" % dirnum, "%d0" % dirnum, keep))
+                conn.execute("UPDATE tiles SET path = 'n' || ? || substr(path, 4) "
+                             "WHERE render = ? AND substr(path, 1, 4) = ?",
+                             (str(dirnum), self.render, keep))
+            conn.execute("UPDATE tiles SET zoom = zoom - 1, path = substr(path, 2) "
+                         "WHERE render = ? AND substr(path, 1, 1) = 'n'", (self.render,))
+
+            # Delete the tiles at the top to make sure they get re-created.
+            files = [str(num) + "." + imgextension for num in range(4)] + \
+                ["base." + imgextension]
+            for f in files:
+                conn.execute("DELETE FROM tiles WHERE render = ? AND path = ?", (self.render, f))
+
+    def cleanup(self):
+        """Deletes the images no tile refers to anymore."""
+        self._get_connection().execute(
+            "DELETE FROM blobs WHERE hash NOT IN "
+            "(SELECT hash FROM tiles WHERE hash IS NOT NULL)")
+
+
+def connect(path):
+    """Opens the SQLite tile store at the given path, creating it if needed.
+    The connection is in autocommit mode.
+
+    """
+    conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("CREATE TABLE IF NOT EXISTS tiles ("
+                 "render TEXT, zoom INTEGER, path TEXT, hash BLOB, mtime INTEGER, "
+                 "PRIMARY KEY (render, zoom, path))")
+    conn.execute("CREATE INDEX IF NOT EXISTS tiles_path ON tiles (render, path)")
+    conn.execute("CREATE INDEX IF NOT EXISTS tiles_hash ON tiles (hash)")
+    conn.execute("CREATE TABLE IF NOT EXISTS blobs (hash BLOB PRIMARY KEY, data BLOB)")
+    return conn
+
+
+@contextlib.contextmanager
+def transaction(conn):
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+def export_tiles(storepath, destdir, renders=None):
+    """Unpacks the tiles of an SQLite tile store into destdir, in the layout
+    the web viewer expects: destdir/<render>/<path>. Only the given renders
+    are exported if renders is given. Tiles that are already there with the
+    same size and mtime are skipped, so a previous export can be brought up
+    to date cheaply.
+
+    Returns the number of tiles written.
+
+    """
+    conn = connect(storepath)
+    written = 0
+    try:
+        rows = conn.execute("SELECT render, path, mtime, length(data) FROM tiles "
+                            "JOIN blobs USING (hash) ORDER BY render, path").fetchall()
+        for render, path, mtime, size in rows:
+            if renders is not None and render not in renders:
+                continue
+            imgpath = os.path.join(destdir, render, *path.split("/"))
+            try:
+                st = os.stat(imgpath)
+            except OSError:
+                pass
+            else:
+                if (st.st_size, int(st.st_mtime)) == (size, mtime):
+                    continue
+
+            data = conn.execute("SELECT data FROM tiles JOIN blobs USING (hash) "
+                                "WHERE render = ? AND path = ?", (render, path)).fetchone()[0]
+            os.makedirs(os.path.dirname(imgpath), exist_ok=True)
+            with FileReplacer(imgpath) as tmppath:
+                with open(tmppath, "wb") as f:
+                    f.write(data)
+                os.utime(tmppath, (mtime, mtime))
+            written += 1
+    finally:
+        conn.close()
+    return written
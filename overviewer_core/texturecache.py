@@ -0,0 +1,190 @@
+#    This file is part of the Minecraft Overviewer.
+#
+#    Minecraft Overviewer is free software: you can redistribute it and/or
+#    modify it under the terms of the GNU General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or (at
+#    your option) any later version.
+#
+#    Minecraft Overviewer is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+#    Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License along
+#    with the Overviewer.  If not, see <http://www.gnu.org/licenses/>.
+
+"""This module saves the textures generated by Textures.generate() to an
+atlas file, and loads them back, so they only have to be generated again when
+something they depend on changes.
+
+An atlas file is laid out as follows:
+
+* The magic bytes, then the length of the header as a 4 byte little-endian
+  integer.
+* The header, in JSON. It lists the images in the atlas, and where in the
+  pixel data each one is.
+* The pixel data: the raw bytes of each image, one after the other.
+
+The file is memory-mapped when it's loaded, and the images are made straight
+from the mapped pixel data without copying it, so loading an atlas takes next
+to no time, and processes that load the same atlas share its memory.
+
+Atlases are named after their cache key, so one is left behind whenever the
+key changes. Textures.generate() updates the mtime of the atlas it uses, and
+remove_old_atlases() deletes the ones that weren't used for a while.
+
+"""
+
+import hashlib
+import json
+import logging
+import mmap
+import os
+import os.path
+import struct
+import time
+
+from PIL import Image
+
+from .files import FileReplacer
+
+MAGIC = b"OVATLAS1"
+
+# Modes Image.frombuffer() can use without copying the data
+_SHARED_MODES = ("RGBA", "L")
+
+# How long an atlas is kept after it was last used, in seconds
+MAX_AGE = 30 * 24 * 60 * 60
+
+
+def get_source_stats(paths):
+    """Returns a list of (path, size, mtime) for the given files, and for
+    every file inside the given directories. Paths that don't exist are
+    left out.
+
+    """
+    stats = []
+    for path in paths:
+        if not path:
+            continue
+        if os.path.isdir(path):
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames.sort()
+                for name in sorted(filenames):
+                    stats.extend(get_source_stats([os.path.join(dirpath, name)]))
+        elif os.path.isfile(path):
+            st = os.stat(path)
+            stats.append((path, st.st_size, int(st.st_mtime)))
+    return stats
+
+
+def get_cache_key(*args):
+    """Returns a hex digest of the given JSON-serializable values, to name
+    the atlas file with.
+
+    """
+    return hashlib.sha1(json.dumps(args, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def remove_old_atlases(cachedir, max_age=MAX_AGE):
+    """Removes the atlas files in cachedir whose mtime is more than max_age
+    seconds old.
+
+    """
+    try:
+        names = os.listdir(cachedir)
+    except OSError:
+        return
+    now = time.time()
+    for name in names:
+        if not name.endswith(".atlas"):
+            continue
+        path = os.path.join(cachedir, name)
+        try:
+            if now - os.path.getmtime(path) >= max_age:
+                os.remove(path)
+                logging.debug("Removed the old texture atlas %s.", path)
+        except OSError:
+            # Removed by another process, or still in use (on Windows)
+            pass
+
+
+def save_atlas(path, blockmap, images):
+    """Writes an atlas file to path. blockmap is the list of sprite tuples
+    (or None) of a Textures object, images a dict mapping names to other
+    images to store. Any other entries in blockmap are placeholders for
+    sprites that weren't generated yet; their indices are stored, so they
+    come back as placeholders from load_atlas().
+
+    """
+    chunks = []
+    offset = 0
+
+    def add(img):
+        nonlocal offset
+        data = img.tobytes()
+        entry = dict(mode=img.mode, size=list(img.size), offset=offset, length=len(data))
+        chunks.append(data)
+        offset += len(data)
+        return entry
+
+    sprites = []
+    pending = []
+    for i, tex in enumerate(blockmap):
+        if tex is None:
+            continue
+        if not isinstance(tex, tuple):
+            pending.append(i)
+            continue
+        sprites.append([i] + [add(img) for img in tex])
+    images = dict((name, add(img)) for name, img in images.items())
+    header = dict(length=len(blockmap), sprites=sprites, pending=pending, images=images,
+                  datalength=offset)
+    header = json.dumps(header).encode('utf-8')
+
+    with FileReplacer(path) as tmppath:
+        with open(tmppath, "wb") as f:
+            f.write(MAGIC)
+            f.write(struct.pack("<I", len(header)))
+            f.write(header)
+            for data in chunks:
+                f.write(data)
+
+
+def load_atlas(path, placeholder=None):
+    """Loads the atlas file at path. Returns a tuple (blockmap, images) like
+    what was given to save_atlas(), or None if the file isn't there or isn't
+    an atlas. Sprites that weren't generated yet when the atlas was saved
+    are set to placeholder.
+
+    """
+    try:
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                logging.warning("%s is not a texture atlas, ignoring it.", path)
+                return None
+            (headerlen,) = struct.unpack("<I", f.read(4))
+            header = json.loads(f.read(headerlen).decode('utf-8'))
+            start = len(MAGIC) + 4 + headerlen
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError, struct.error):
+        return None
+    view = memoryview(data)[start:]
+    if len(view) != header['datalength']:
+        logging.warning("The texture atlas %s is damaged, ignoring it.", path)
+        return None
+
+    def get(entry):
+        size = tuple(entry['size'])
+        buf = view[entry['offset']:entry['offset'] + entry['length']]
+        if entry['mode'] in _SHARED_MODES:
+            return Image.frombuffer(entry['mode'], size, buf, "raw", entry['mode'], 0, 1)
+        return Image.frombytes(entry['mode'], size, bytes(buf))
+
+    blockmap = [None] * header['length']
+    for i in header.get('pending', []):
+        blockmap[i] = placeholder
+    for sprite in header['sprites']:
+        blockmap[sprite[0]] = tuple(get(entry) for entry in sprite[1:])
+    images = dict((name, get(entry)) for name, entry in header['images'].items())
+    return blockmap, images
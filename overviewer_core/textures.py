@@ -26,8 +26,10 @@ import numpy
 from PIL import Image, ImageEnhance, ImageOps, ImageDraw
 import logging
 import functools
+import atexit
+import tempfile
 
-from . import util
+from . import texturecache, util
 
 
 BLOCKTEX = "assets/minecraft/textures/block/"
@@ -46,6 +48,10 @@ fluid_blocks = set()
 nospawn_blocks = set()
 nodata_blocks = set()
 
+# Stands in the blockmap of lazily generated Textures for the sprites that
+# weren't needed yet, see Textures.generate_block()
+LAZY = object()
+
 
 # This is here for circular import reasons.
 # Please don't ask, I choose to repress these memories.
@@ -65,6 +71,30 @@ color_map = ["white", "orange", "magenta", "light_blue", "yellow", "lime", "pink
              "light_gray", "cyan", "purple", "blue", "brown", "green", "red", "black"]
 
 
+def get_versiondir():
+    """Returns the directory the installed minecraft client jars are in, or
+    "" if it's not known.
+    """
+    versiondir = ""
+    if "APPDATA" in os.environ and sys.platform.startswith("win"):
+        versiondir = os.path.join(os.environ['APPDATA'], ".minecraft", "versions")
+    elif "HOME" in os.environ:
+        # For linux:
+        versiondir = os.path.join(os.environ['HOME'], ".minecraft", "versions")
+        if not os.path.exists(versiondir) and sys.platform.startswith("darwin"):
+            # For Mac:
+            versiondir = os.path.join(os.environ['HOME'], "Library",
+                "Application Support", "minecraft", "versions")
+    return versiondir
+
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
 ##
 ## Textures object
 ##
@@ -72,31 +102,53 @@ class Textures(object):
     """An object that generates a set of block sprites to use while
     rendering. It accepts a background color, north direction, and
     local textures path.
+
+    If cachedir is given, the generated sprites are saved to an atlas file in
+    it, and loaded from there by later generate() calls, as long as nothing
+    the sprites depend on has changed (see get_cache_key()).
+
+    If lazy is True, generate() leaves the block sprites out, and each one is
+    generated the first time it's needed (see generate_block()).
+
+    texturesize is the size of the block sprites in pixels. The sprites are
+    made at 24px and scaled down to it.
     """
-    def __init__(self, texturepath=None, bgcolor=(26, 26, 26, 0), northdirection=0):
+    def __init__(self, texturepath=None, bgcolor=(26, 26, 26, 0), northdirection=0,
+                 cachedir=None, lazy=False, texturesize=24):
         self.bgcolor = bgcolor
         self.rotation = northdirection
         self.find_file_local_path = texturepath
+        self.cachedir = cachedir
+        self.lazy = lazy
         
-        # not yet configurable
-        self.texture_size = 24
+        self.texture_size = texturesize
         self.texture_dimensions = (self.texture_size, self.texture_size)
         
         # this is set in in generate()
         self.generated = False
 
+        # the atlas file the generated textures are in, if any, and whether
+        # sprites were generated since it was saved
+        self.atlaspath = None
+        self.unsaved = False
+
         # see load_image_texture()
         self.texture_cache = {}
 
-        # once we find a jarfile that contains a texture, we cache the ZipFile object here
+        # the ZipFile objects of the resource pack and client jars, and where
+        # each texture file is, see _get_file_index()
         self.jars = OrderedDict()
+        self._file_index = None
     
     ##
     ## pickle support
     ##
     
     def __getstate__(self):
-        # we must get rid of the huge image lists, and other images
+        # we must get rid of the huge image lists, and other images. They're
+        # loaded from the atlas file on the other side instead.
+        if self.generated and (self.unsaved or not self.atlaspath):
+            self._publish_atlas()
         attributes = self.__dict__.copy()
         for attr in ['blockmap', 'biome_grass_texture', 'watertexture', 'lavatexture', 'firetexture', 'portaltexture', 'lightcolor', 'grasscolor', 'foliagecolor', 'watercolor', 'texture_cache']:
             try:
@@ -104,6 +156,7 @@ class Textures(object):
             except KeyError:
                 pass
         attributes['jars'] = OrderedDict()
+        attributes['_file_index'] = None
         return attributes
     def __setstate__(self, attrs):
         # regenerate textures, if needed
@@ -111,13 +164,52 @@ class Textures(object):
             setattr(self, attr, val)
         self.texture_cache = {}
         if self.generated:
-            self.generate()
+            if not (self.atlaspath and self._load_atlas(self.atlaspath)):
+                self.generate()
     
     ##
     ## The big one: generate()
     ##
     
     def generate(self):
+        atlaspath = None
+        if self.cachedir:
+            atlaspath = os.path.join(self.cachedir, self.get_cache_key() + ".atlas")
+        if atlaspath and self._load_atlas(atlaspath):
+            logging.debug("Loaded the textures from %s.", atlaspath)
+            try:
+                # Still in use, see texturecache.remove_old_atlases()
+                os.utime(atlaspath)
+            except OSError:
+                pass
+        else:
+            self._generate_base()
+
+        if not self.lazy:
+            # generate the blocks
+            for i, tex in enumerate(self.blockmap):
+                if tex is LAZY:
+                    self.generate_block(i)
+
+        self.generated = True
+
+        if atlaspath and self.unsaved:
+            try:
+                if not os.path.isdir(self.cachedir):
+                    os.makedirs(self.cachedir)
+                self._save_atlas(atlaspath)
+                self.atlaspath = atlaspath
+                self.unsaved = False
+            except OSError as e:
+                logging.warning("Couldn't save the textures to %s: %s", atlaspath, e)
+        if self.cachedir:
+            texturecache.remove_old_atlases(self.cachedir)
+
+    def _generate_base(self):
+        """Loads the colormaps, generates the biome grass mask, and sets up a
+        blockmap with every block sprite still to be generated.
+
+        """
         # Make sure we have the foliage/grasscolor images available
         try:
             self.load_foliage_color()
@@ -132,29 +224,128 @@ class Textures(object):
         
         # generate biome grass mask
         self.biome_grass_texture = self.build_block(self.load_image_texture("assets/minecraft/textures/block/grass_block_top.png"), self.load_image_texture("assets/minecraft/textures/block/grass_block_side_overlay.png"))
-        
-        # generate the blocks
-        global blockmap_generators
-        global known_blocks, used_datas
-        self.blockmap = [None] * max_blockid * max_data
-        
-        for (blockid, data), texgen in list(blockmap_generators.items()):
-            tex = texgen(self, blockid, data)
-            self.blockmap[blockid * max_data + data] = self.generate_texture_tuple(tex)
-        
         if self.texture_size != 24:
-            # rescale biome grass
             self.biome_grass_texture = self.biome_grass_texture.resize(self.texture_dimensions, Image.ANTIALIAS)
-            
-            # rescale the rest
-            for i, tex in enumerate(blockmap):
-                if tex is None:
-                    continue
-                block = tex[0]
-                scaled_block = block.resize(self.texture_dimensions, Image.ANTIALIAS)
-                blockmap[i] = self.generate_texture_tuple(scaled_block)
         
-        self.generated = True
+        self.blockmap = [None] * max_blockid * max_data
+        for (blockid, data) in blockmap_generators:
+            self.blockmap[blockid * max_data + data] = LAZY
+        self.unsaved = True
+
+    def generate_block(self, index):
+        """Generates the sprite at the given index of the blockmap, which is
+        blockid * max_data + data, and returns it. This is called by the C
+        extension for sprites that are still LAZY when it comes to draw them.
+
+        """
+        blockid, data = divmod(index, max_data)
+        tex = None
+        texgen = blockmap_generators.get((blockid, data))
+        if texgen is not None:
+            tex = texgen(self, blockid, data)
+        if tex is not None and self.texture_size != 24:
+            tex = tex.resize(self.texture_dimensions, Image.ANTIALIAS)
+        tex = self.generate_texture_tuple(tex)
+        self.blockmap[index] = tex
+        self.unsaved = True
+        return tex
+
+    def generate_blocks(self, blockids):
+        """Generates all the sprites of the given block ids that weren't
+        generated yet.
+
+        """
+        for blockid in blockids:
+            if not 0 <= blockid < max_blockid:
+                continue
+            for i in range(blockid * max_data, (blockid + 1) * max_data):
+                if self.blockmap[i] is LAZY:
+                    self.generate_block(i)
+
+    ##
+    ## The texture cache
+    ##
+
+    # The images stored in the atlas besides the blockmap, and the files the
+    # colormaps are loaded from
+    _colormaps = {
+        'grasscolor': "assets/minecraft/textures/colormap/grass.png",
+        'foliagecolor': "assets/minecraft/textures/colormap/foliage.png",
+    }
+
+    def get_cache_key(self):
+        """Returns a key for the textures generate() would make, based on
+        the options, the Overviewer version, and the sizes and mtimes of all
+        the files find_file() may load textures from.
+
+        """
+        programdir = util.get_program_path()
+        sources = [os.path.join(programdir, "overviewer_core", "data", "textures"),
+                   os.path.join(programdir, "textures"),
+                   self.find_file_local_path,
+                   os.path.join(programdir, "assets"),
+                   os.path.abspath(__file__)]
+        if sys.platform.startswith("darwin"):
+            sources.append(os.path.join("/Applications/Minecraft", "assets"))
+        versiondir = get_versiondir()
+        if os.path.isdir(versiondir):
+            for version in sorted(os.listdir(versiondir)):
+                sources.append(os.path.join(versiondir, version, version + ".jar"))
+        return texturecache.get_cache_key(
+            util.findGitVersion(), util.findGitHash(), self.find_file_local_path,
+            self.rotation, list(self.bgcolor), self.texture_size, max_blockid, max_data,
+            texturecache.get_source_stats(sources))
+
+    def _save_atlas(self, path):
+        images = dict((name, self.load_image(filename))
+                      for name, filename in self._colormaps.items())
+        images['biome_grass_texture'] = self.biome_grass_texture
+        texturecache.save_atlas(path, self.blockmap, images)
+
+    def _load_atlas(self, path):
+        """Sets the blockmap and the other generated textures from the atlas
+        file at path. Returns False if there is no usable atlas there.
+
+        """
+        atlas = texturecache.load_atlas(path, LAZY)
+        if atlas is None:
+            return False
+        self.blockmap, images = atlas
+        if len(self.blockmap) != max_blockid * max_data:
+            return False
+        self.biome_grass_texture = images['biome_grass_texture']
+        for name in self._colormaps:
+            setattr(self, name, list(images[name].getdata()))
+        self.atlaspath = path
+        self.unsaved = False
+        return True
+
+    def _publish_atlas(self):
+        """Saves the generated textures to an atlas file, so other processes
+        can load them from there instead of generating them again. That's the
+        atlas they were loaded from or saved to if there is one, otherwise a
+        temporary file that is removed when this process exits.
+
+        """
+        if self.atlaspath:
+            try:
+                self._save_atlas(self.atlaspath)
+                self.unsaved = False
+                return
+            except OSError as e:
+                logging.debug("Couldn't update %s: %s", self.atlaspath, e)
+        fd, path = tempfile.mkstemp(prefix="overviewer-textures-", suffix=".atlas")
+        os.close(fd)
+        try:
+            self._save_atlas(path)
+        except OSError as e:
+            logging.warning("Couldn't save the textures to %s, every worker process will "
+                            "generate them again: %s", path, e)
+            _remove_file(path)
+            return
+        atexit.register(_remove_file, path)
+        self.atlaspath = path
+        self.unsaved = False
     
     ##
     ## Helpers for opening textures
@@ -164,9 +355,8 @@ class Textures(object):
         """Searches for the given file and returns an open handle to it.
         This searches the following locations in this order:
         
-        * In the directory textures_path given in the initializer if not already open
-        * In an already open resource pack or client jar file
-        * In the resource pack given by textures_path
+        * The overviewer_core/data/textures dir
+        * The directory or resource pack given by textures_path
         * The program dir (same dir as overviewer.py) for extracted textures
         * On Darwin, in /Applications/Minecraft for extracted textures
         * Inside a minecraft client jar. Client jars are searched for in the
@@ -177,120 +367,79 @@ class Textures(object):
                 $HOME/Library/Application Support/minecraft/versions
             * at $HOME/.minecraft/versions/
 
-          Only the latest non-snapshot version >1.6 is used
+          Only non-snapshot versions >=1.8 are used, the latest first
+
+        Where each file is found is looked up in an index of all these
+        locations, see _get_file_index().
 
-        * The overviewer_core/data/textures dir
-        
         """
         if verbose: logging.info("Starting search for {0}".format(filename))
 
+        source = self._get_file_index().get(filename)
+        if isinstance(source, zipfile.ZipFile):
+            try:
+                fileobj = source.open(filename)
+                if verbose: logging.info("Found %s in '%s'", filename, source.filename)
+                return fileobj
+            except (KeyError, IOError):
+                pass
+        elif source is not None:
+            try:
+                fileobj = open(source, mode)
+                if verbose: logging.info("Found %s in '%s'", filename, source)
+                return fileobj
+            except IOError:
+                pass
+
+        raise TextureException("Could not find the textures while searching for '{0}'. Try specifying the 'texturepath' option in your config file.\nSet it to the path to a Minecraft Resource pack.\nAlternately, install the Minecraft client (which includes textures)\nAlso see <http://docs.overviewer.org/en/latest/running/#installing-the-textures>\n(Remember, this version of Overviewer requires a 1.16-compatible resource pack)\n(Also note that I won't automatically use snapshots; you'll have to use the texturepath option to use a snapshot jar)".format(filename))
+
+    def _get_file_index(self):
+        """Returns a dict mapping the name of every file find_file() can find
+        to where it is: the path of the file, or the ZipFile it's in. The
+        index is built the first time it's needed, by listing all the
+        locations find_file() searches once, in reverse order, so files in
+        the earlier locations replace the others.
+
+        """
+        if self._file_index is not None:
+            return self._file_index
+
         # Look for the file is stored in with the overviewer
         # installation. We include a few files that aren't included with Minecraft
         # textures. This used to be for things such as water and lava, since
         # they were generated by the game and not stored as images. Nowdays I
         # believe that's not true, but we still have a few files distributed
         # with overviewer.
-        # Do this first so we don't try all .jar files for stuff like "water.png"
         programdir = util.get_program_path()
-        if verbose: logging.info("Looking for texture in overviewer_core/data/textures")
-        path = os.path.join(programdir, "overviewer_core", "data", "textures", filename)
-        if os.path.isfile(path):
-            if verbose: logging.info("Found %s in '%s'", filename, path)
-            return open(path, mode)
-        elif hasattr(sys, "frozen") or imp.is_frozen("__main__"):
+        sources = [(os.path.join(programdir, "overviewer_core", "data", "textures"), None)]
+        if hasattr(sys, "frozen") or imp.is_frozen("__main__"):
             # windows special case, when the package dir doesn't exist
-            path = os.path.join(programdir, "textures", filename)
-            if os.path.isfile(path):
-                if verbose: logging.info("Found %s in '%s'", filename, path)
-                return open(path, mode)
+            sources.append((os.path.join(programdir, "textures"), None))
 
-        # A texture path was given on the command line. Search this location
-        # for the file first.
+        # A texture path was given on the command line: a resource pack or a
+        # directory
         if self.find_file_local_path:
-            if (self.find_file_local_path not in self.jars
-                and os.path.isfile(self.find_file_local_path)):
-                # Must be a resource pack. Look for the requested file within
-                # it.
-                try:
-                    pack = zipfile.ZipFile(self.find_file_local_path)
-                    # pack.getinfo() will raise KeyError if the file is
-                    # not found.
-                    pack.getinfo(filename)
-                    if verbose: logging.info("Found %s in '%s'", filename,
-                                             self.find_file_local_path)
-                    self.jars[self.find_file_local_path] = pack
-                    # ok cool now move this to the start so we pick it first
-                    self.jars.move_to_end(self.find_file_local_path, last=False)
-                    return pack.open(filename)
-                except (zipfile.BadZipfile, KeyError, IOError):
-                    pass
-            elif os.path.isdir(self.find_file_local_path):
-                full_path = os.path.join(self.find_file_local_path, filename)
-                if os.path.isfile(full_path):
-                        if verbose: logging.info("Found %s in '%s'", filename, full_path)
-                        return open(full_path, mode)
-
-        # We already have some jars open, better use them.
-        if len(self.jars) > 0:
-            for jarpath in self.jars:
-                try:
-                    jar = self.jars[jarpath]
-                    jar.getinfo(filename)
-                    if verbose: logging.info("Found (cached) %s in '%s'", filename,
-                                             jarpath)
-                    return jar.open(filename)
-                except (KeyError, IOError) as e:
-                    pass
-
-        # If we haven't returned at this point, then the requested file was NOT
-        # found in the user-specified texture path or resource pack.
-        if verbose: logging.info("Did not find the file in specified texture path")
-
-
-        # Look in the location of the overviewer executable for the given path
-        path = os.path.join(programdir, filename)
-        if os.path.isfile(path):
-            if verbose: logging.info("Found %s in '%s'", filename, path)
-            return open(path, mode)
+            sources.append((self.find_file_local_path, None))
 
+        # Extracted textures in the location of the overviewer executable.
+        # Only files in there and in its assets dir are looked at, the rest
+        # of the program dir has nothing find_file() is asked for.
+        sources.append((programdir, "assets"))
         if sys.platform.startswith("darwin"):
-            path = os.path.join("/Applications/Minecraft", filename)
-            if os.path.isfile(path):
-                if verbose: logging.info("Found %s in '%s'", filename, path)
-                return open(path, mode)
-
-        if verbose: logging.info("Did not find the file in overviewer executable directory")
-        if verbose: logging.info("Looking for installed minecraft jar files...")
-
-        # Find an installed minecraft client jar and look in it for the texture
-        # file we need.
-        versiondir = ""
-        if "APPDATA" in os.environ and sys.platform.startswith("win"):
-            versiondir = os.path.join(os.environ['APPDATA'], ".minecraft", "versions")
-        elif "HOME" in os.environ:
-            # For linux:
-            versiondir = os.path.join(os.environ['HOME'], ".minecraft", "versions")
-            if not os.path.exists(versiondir) and sys.platform.startswith("darwin"):
-                # For Mac:
-                versiondir = os.path.join(os.environ['HOME'], "Library",
-                    "Application Support", "minecraft", "versions")
+            sources.append(("/Applications/Minecraft", "assets"))
 
+        # Installed minecraft client jars. Look for non-snapshots that are at
+        # least 1.8. This version is only compatible with >=1.8, and we
+        # cannot in general tell if a snapshot is more or less recent than a
+        # release.
+        versiondir = get_versiondir()
         try:
-            if verbose: logging.info("Looking in the following directory: \"%s\"" % versiondir)
             versions = os.listdir(versiondir)
-            if verbose: logging.info("Found these versions: {0}".format(versions))
         except OSError:
-            # Directory doesn't exist? Ignore it. It will find no versions and
-            # fall through the checks below to the error at the bottom of the
-            # method.
+            # Directory doesn't exist? Ignore it.
             versions = []
-
         available_versions = []
         for version in versions:
-            # Look for the latest non-snapshot that is at least 1.8. This
-            # version is only compatible with >=1.8, and we cannot in general
-            # tell if a snapshot is more or less recent than a release.
-
             # Allow two component names such as "1.8" and three component names
             # such as "1.8.1"
             if version.count(".") not in (1,2):
@@ -299,39 +448,56 @@ class Textures(object):
                 versionparts = [int(x) for x in version.split(".")]
             except ValueError:
                 continue
-
             if versionparts < [1,8]:
                 continue
-
             available_versions.append(versionparts)
-
         available_versions.sort(reverse=True)
-        if not available_versions:
-            if verbose: logging.info("Did not find any non-snapshot minecraft jars >=1.8.0")
-        while(available_versions):
-            most_recent_version = available_versions.pop(0)
-            if verbose: logging.info("Trying {0}. Searching it for the file...".format(".".join(str(x) for x in most_recent_version)))
-
-            jarname = ".".join(str(x) for x in most_recent_version)
-            jarpath = os.path.join(versiondir, jarname, jarname + ".jar")
-
-            if os.path.isfile(jarpath):
+        for versionparts in available_versions:
+            jarname = ".".join(str(x) for x in versionparts)
+            sources.append((os.path.join(versiondir, jarname, jarname + ".jar"), None))
+
+        index = {}
+        for path, subdir in reversed(sources):
+            if os.path.isdir(path):
+                index.update(self._index_dir(path, subdir))
+            elif os.path.isfile(path):
                 try:
-                    jar = zipfile.ZipFile(jarpath)
-                    jar.getinfo(filename)
-                    if verbose: logging.info("Found %s in '%s'", filename, jarpath)
-                    self.jars[jarpath] = jar
-                    return jar.open(filename)
-                except (KeyError, IOError) as e:
-                    pass
-                except (zipfile.BadZipFile) as e:
+                    jar = zipfile.ZipFile(path)
+                except (zipfile.BadZipFile, IOError):
                     logging.warning("Your jar {0} is corrupted, I'll be skipping it, but you "
-                                    "should probably look into that.".format(jarpath))
+                                    "should probably look into that.".format(path))
+                    continue
+                self.jars[path] = jar
+                for name in jar.namelist():
+                    if not name.endswith("/"):
+                        index[name] = jar
+        logging.debug("Indexed %d texture files.", len(index))
+        self._file_index = index
+        return index
 
-            if verbose: logging.info("Did not find file {0} in jar {1}".format(filename, jarpath))
-            
+    @staticmethod
+    def _index_dir(path, subdir=None):
+        """Returns a dict mapping the names of the files in the directory at
+        path, relative to it and with forward slashes, to their paths. If
+        subdir is given, only the files directly in path and the ones in its
+        subdir are listed.
 
-        raise TextureException("Could not find the textures while searching for '{0}'. Try specifying the 'texturepath' option in your config file.\nSet it to the path to a Minecraft Resource pack.\nAlternately, install the Minecraft client (which includes textures)\nAlso see <http://docs.overviewer.org/en/latest/running/#installing-the-textures>\n(Remember, this version of Overviewer requires a 1.16-compatible resource pack)\n(Also note that I won't automatically use snapshots; you'll have to use the texturepath option to use a snapshot jar)".format(filename))
+        """
+        index = {}
+        if subdir is None:
+            walkdirs = [path]
+        else:
+            walkdirs = [os.path.join(path, subdir)]
+            for name in os.listdir(path):
+                if os.path.isfile(os.path.join(path, name)):
+                    index[name] = os.path.join(path, name)
+        for walkdir in walkdirs:
+            for dirpath, dirnames, filenames in os.walk(walkdir):
+                reldir = os.path.relpath(dirpath, path).replace(os.sep, "/")
+                for name in filenames:
+                    relname = name if reldir == "." else reldir + "/" + name
+                    index[relname] = os.path.join(dirpath, name)
+        return index
 
     def load_image_texture(self, filename):
         # Textures may be animated or in a different resolution than 16x16.  
@@ -14,29 +14,34 @@
 #    with the Overviewer.  If not, see <http://www.gnu.org/licenses/>.
 
 import errno
-import functools
+import hashlib
 import itertools
 import logging
 import os
 import os.path
+import pickle
 import platform
 import random
-import shutil
-import stat
 import sys
+import threading
 import time
+import zlib
 from collections import namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
 from itertools import chain, product
 
 from PIL import Image
 
 from . import c_overviewer
 from . import rendermodes
-from .c_overviewer import resize_half
+from .c_overviewer import alpha_over, resize_half
 
 from . import nbt, world
+from .heightmap import HeightmapRenderer
 from .files import FileReplacer, get_fs_caps
-from .optimizeimages import optimize_image
+from .manifest import ChunkFingerprints, TileManifest
+from .optimizeimages import optimize_image, optimize_images
+from .storage import FileStorage, SQLiteStorage
 from .util import roundrobin
 
 
@@ -84,9 +89,17 @@ iterate_work_items(phase)
     the dependencies are met.
 
 do_work(workobj)
-    Does the work for a given work object. This method is not expected to
-    return anything, so the results of its work should be reflected on the
-    filesystem or by sending signals.
+    Does the work for a given work object. The results of its work should be
+    reflected on the filesystem or by sending signals. It may return a
+    concurrent.futures.Future if some of the work is still going on in the
+    background, in which case the dispatcher considers the work item finished
+    only once the Future is done. Otherwise it should return None.
+
+refresh()
+    Called in the worker processes when the world was found to have changed
+    between two renders with the same workers (see the watch option). It
+    should pick up the changes to the region files, e.g. by calling the
+    refresh() method of its RegionSet.
 
 
 """
@@ -174,7 +187,7 @@ Bounds = namedtuple("Bounds", ("mincol", "maxcol", "minrow", "maxrow"))
 # authoritive on what needs rendering. The do_work() method does not need to do
 # any additional checks.
 
-__all__ = ["TileSet"]
+__all__ = ["TileSet", "TileSetGroup", "group_tilesets"]
 
 
 class TileSet(object):
@@ -271,9 +284,27 @@ class TileSet(object):
         imglossless
             A boolean indicating whether to save a webp image in lossless mode.
 
+        zoomencoding
+            Optional: A dict mapping zoom levels (negative ones counting from
+            the deepest level) or "default" to dicts of encoder settings that
+            override the ones above for those levels. See
+            _get_encoder_settings().
+
+        texturegeneration
+            Optional: "eager", "lazy" or "prescan". With "prescan", the chunk
+            scan also collects the block ids in the changed chunks, and has
+            the textures object generate their sprites before the workers get
+            a copy of it.
+
         optimizeimg
             A list of optimizer instances to use.
 
+        optimizemode
+            Optional: When to run the optimizers. One of "inline" (the
+            default, each tile as it is saved), "background" (in batches,
+            while the rendering goes on) or "deferred" (in batches, after all
+            tiles are rendered). See iterate_work_items().
+
         rendermode
             Perhaps the most important/relevant option: a string indicating the
             render mode to render. This rendermode must have already been
@@ -284,11 +315,54 @@ class TileSet(object):
             that a tile which is not marked for render by any mtime checks will
             be rendered anyways. 0 disables this option.
 
+        chunkfingerprints
+            Optional: A boolean. If set, the chunk scan keeps fingerprints of
+            the chunks' contents in a ChunkFingerprints database, and ignores
+            chunks that were saved without changing. See _chunk_scan().
+
         changelist
             Optional: A file descriptor which will be opened and used as the
             changelist output: each tile written will get outputted to the
             specified fd.
 
+        layercache
+            Optional: A boolean indicating whether to keep a cache of the
+            rendered chunk columns of each render-tile, so only the columns
+            that changed are drawn again when a tile is updated.
+
+        tilemanifest
+            Optional: A boolean. If set, every tile written is recorded in a
+            TileManifest, and check-tiles mode uses it instead of looking at
+            the tiles on disk once it has a record of every tile.
+
+        storage
+            Optional: "files" or "sqlite". Where the tiles are kept, see
+            storage.py. Defaults to "files".
+
+        skipblank
+            Optional: A boolean. If set, tiles that are nothing but the
+            background color aren't stored, only recorded in a TileManifest.
+
+        deduplicate
+            Optional: A boolean. If set, a hash of every tile written is kept
+            in a TileManifest, and tiles that come out the same as one already
+            stored share its storage (see the storage's link()).
+
+        skipunchanged
+            Optional: A boolean. If set, a hash of every tile written is kept
+            in a TileManifest, and tiles that come out the same as what's
+            already on disk only get their mtime updated.
+
+        subtreelevels
+            Optional: An integer. If nonzero, the bottom this many levels of
+            the quadtree are handed to the workers a whole subtree at a time,
+            see iterate_work_items().
+
+        writethreads
+            Optional: An integer. If nonzero, finished tiles are encoded and
+            written by this many background threads in each worker process
+            (see TileWriter) while the worker goes on rendering.
+
         Other options that must be specified but aren't really documented
         (oops. consider it a TODO):
         * worldname_orig
@@ -304,6 +378,12 @@ class TileSet(object):
         self.textures = texturesobj
         self.outputdir = os.path.abspath(outputdir)
 
+        # Tiles are 16 blocks wide, so their size in pixels depends on the
+        # size of the block sprites. Which chunks go in which tile doesn't.
+        self.tilesize = 384
+        if texturesobj is not None:
+            self.tilesize = 16 * texturesobj.texture_size
+
         config = self.am.get_tileset_config(self.options.get("name"))
         self.config = config
 
@@ -367,7 +447,8 @@ class TileSet(object):
                     time.strftime("%x %X", time.localtime(self.last_rendertime)))
                 self.options['renderchecks'] = 0
 
-        if not os.path.exists(self.outputdir):
+        self.new_outputdir = not os.path.exists(self.outputdir)
+        if self.new_outputdir:
             if self.options['renderchecks'] != 2:
                 logging.warning(
                     "The tile directory didn't exist, but you have specified "
@@ -380,6 +461,32 @@ class TileSet(object):
         # must wait until outputdir exists
         self.fs_caps = get_fs_caps(self.outputdir)
 
+        if self.options.get('storage') == "sqlite":
+            self.storage = SQLiteStorage(self.outputdir)
+        else:
+            self.storage = FileStorage(self.outputdir, self.fs_caps)
+
+        if any(self.options.get(opt) for opt in
+               ('skipunchanged', 'tilemanifest', 'skipblank', 'deduplicate')):
+            self.manifest = TileManifest(self.outputdir)
+        else:
+            self.manifest = None
+        # Whether the manifest has a record of every tile, so it can be used
+        # instead of looking at the tiles. See _get_tile_mtime().
+        self.manifest_complete = bool(
+            self.options.get('tilemanifest') and config.get('tilemanifest_complete') and
+            os.path.exists(self.manifest.path))
+
+        # Tiles of different sizes can't be put together into composite-tiles,
+        # so a render at a new tile size has to redo all of them
+        if config and self.options['renderchecks'] in (0, 1) and \
+                config.get('tilesize', 384) != self.tilesize:
+            logging.warning(
+                "The tiles of render '%s' are %dpx, but the texturesize now makes "
+                "them %dpx. I'll be doing a --forcerender.", self.options['name'],
+                config.get('tilesize', 384), self.tilesize)
+            self.options['renderchecks'] = 2
+
         if self.options['renderchecks'] == 2:
             # Set forcerendertime so that upon an interruption the next render
             # will continue where we left off.
@@ -398,6 +505,20 @@ class TileSet(object):
         # This sets self.treedepth, self.xradius, and self.yradius
         self._set_map_size()
 
+        # The batches for a deferred optimizemode, see iterate_work_items()
+        self._optimize_batches = []
+
+        # The render-tiles put off for later by prepare_update(), and the
+        # last_rendertime from before the changes they come from
+        self._postponed = None
+        self._postponed_since = None
+
+        # The chunk fingerprints found by the last chunk scan, saved by
+        # get_persistent_data() once their tiles are rendered, and whether
+        # the old ones are to be forgotten
+        self._new_fingerprints = None
+        self._clear_fingerprints = False
+
     # Only pickle the initial state. Don't pickle anything resulting from the
     # do_preprocessing step
     def __getstate__(self):
@@ -431,23 +552,134 @@ class TileSet(object):
         # from the asset-manager, which typically indicates this is a new
         # render
         if self.config:
-            self._rearrange_tiles()
+            self._rearrange_tiles(self.config.get('zoomLevels'))
+
+        self.storage.cleanup()
 
         # Do the chunk scan here
         self.dirtytree = self._chunk_scan()
 
+    def refresh(self):
+        """Picks up changes to the region files, see the Worker interface.
+        Returns what the RegionSet's refresh() does.
+
+        """
+        return self.regionset.refresh()
+
+    def prepare_update(self, layout_changed=True, budget=0):
+        """Gets this TileSet ready to render again after its RegionSet was
+        refreshed, for the watch option. This takes the place of
+        do_preprocessing(): from now on, only the tiles with chunks changed
+        since the last render are rendered, whatever the rendercheck mode
+        was at first.
+
+        layout_changed tells whether any region files were added or removed,
+        in which case the size of the map is worked out again. If budget is
+        nonzero, at most that many render-tiles are rendered and the rest
+        are postponed to the next update (see has_postponed_tiles()).
+
+        Returns True if the depth of the tree changed, which means copies of
+        this TileSet in the worker processes are out of date.
+
+        """
+        if self.options['renderchecks'] == 3:
+            return False
+
+        # What get_persistent_data() reported for the render that was just done
+        if self.options.get('tilemanifest') and (
+                self.options['renderchecks'] == 1 or
+                (self.options['renderchecks'] == 2 and self.new_outputdir)):
+            self.manifest_complete = True
+        self.new_outputdir = False
+        self.options['renderchecks'] = 0
+        self.last_rendertime = max(self.last_rendertime, self.max_chunk_mtime)
+
+        curdepth = self.treedepth
+        if layout_changed:
+            self._set_map_size()
+        if self.treedepth != curdepth:
+            self._rearrange_tiles(curdepth)
+            if self._postponed is not None:
+                # The postponed tiles moved, have them found by their mtimes
+                self.options['renderchecks'] = 1
+                self._postponed = None
+
+        since = self.last_rendertime
+        if self._postponed is not None:
+            since = self._postponed_since
+        self.dirtytree = self._chunk_scan()
+        # Nothing newer may have turned up
+        self.max_chunk_mtime = max(self.max_chunk_mtime, self.last_rendertime)
+        if self.options['renderchecks'] != 0:
+            return self.treedepth != curdepth
+
+        if self._postponed is not None:
+            for path in self._postponed:
+                self.dirtytree.add(path)
+            self._postponed = None
+        if budget and self.dirtytree.count() > budget:
+            # Render-tiles come out of the tree in order, so the ones
+            # rendered now are close together and share their upper tiles
+            dirtytree = RendertileSet(self.treedepth)
+            self._postponed = RendertileSet(self.treedepth)
+            for i, path in enumerate(self.dirtytree):
+                (dirtytree if i < budget else self._postponed).add(path)
+            self.dirtytree = dirtytree
+            self._postponed_since = since
+            logging.info("Postponing %d of the tiles of %s that need rendering.",
+                         self._postponed.count(), self.options['name'])
+        return self.treedepth != curdepth
+
+    def has_postponed_tiles(self):
+        """Returns True if prepare_update() put off rendering some tiles."""
+        return self._postponed is not None
+
     def get_num_phases(self):
-        """Returns the number of levels in the quadtree, which is equal to the
-        number of phases of work that need to be done.
+        """Returns the number of phases of work that need to be done: one, plus
+        one for the optimizers if they are deferred.
 
         """
+        if self._get_optimizemode() == "deferred":
+            return 2
         return 1
 
+    def _get_optimizemode(self):
+        """Returns the optimizemode option, or "inline" if there are no
+        optimizers to run anyways.
+
+        """
+        if not self.options['optimizeimg'] or self.options['renderchecks'] == 3:
+            return "inline"
+        return self.options.get('optimizemode', "inline")
+
     def get_phase_length(self, phase):
         """Returns the number of work items in a given phase.
         """
+        if phase == 1:
+            # The deferred optimizers, known once phase 0 was iterated
+            return len(self._optimize_batches)
+        length = self._get_tiles_phase_length(phase)
+        if self._get_optimizemode() == "background":
+            length += -(-length // OptimizeBatcher.batchsize)
+        return length
+
+    def _get_tiles_phase_length(self, phase):
+        """Returns the number of work items that render tiles in a given
+        phase.
+        """
         # Yeah functional programming!
         # and by functional we mean a bastardized python switch statement
+        levels = self.options.get('subtreelevels', 0)
+        if levels:
+            # Each subtree is one work item, see iterate_work_items()
+            rootdepth = max(0, self.treedepth - levels)
+            return {
+                0: lambda: sum(1 for p in self.dirtytree.posttraversal() if len(p) <= rootdepth),
+                1: lambda: (4**(rootdepth + 1) - 1) / 3,
+                2: lambda: sum(1 for p in self.dirtytree.posttraversal() if len(p) <= rootdepth),
+                3: lambda: 0,
+            }[self.options['renderchecks']]()
+
         return {
             0: lambda: self.dirtytree.count_all(),
             # there is no good way to guess this so just give total count
@@ -461,6 +693,73 @@ class TileSet(object):
         appropriate order with the appropriate dependencies.
 
         This method returns an iterator over (obj, [dependencies, ...])
+
+        If the subtreelevels option is set, the tiles in the bottom levels of
+        the tree are handed out as SubtreeWorkItems holding all the tiles of
+        a subtree that need rendering, so one worker renders the whole subtree
+        and can build its composite-tiles from the images in memory.
+
+        If the optimizemode option is not "inline", the tiles that were
+        rendered are also handed out in OptimizeWorkItems, a batch of them at
+        a time. In "background" mode these are mixed in with the tiles to
+        render, depending on the parents of the tiles in them, since the
+        parents read their children from disk. In "deferred" mode they are
+        saved up for phase 1.
+        """
+        if phase == 1:
+            for batch in self._optimize_batches:
+                yield batch, []
+            return
+
+        mode = self._get_optimizemode()
+        if mode == "inline":
+            yield from self._iterate_work_items(phase)
+            return
+
+        batcher = OptimizeBatcher(self)
+        self._optimize_batches = []
+        for workitem, dependencies in self._iterate_work_items(phase):
+            yield workitem, dependencies
+            if isinstance(workitem, SubtreeWorkItem):
+                batcher.add(workitem, workitem.tiles)
+            else:
+                batcher.add(workitem, [workitem])
+            for batch in batcher.get_batches():
+                if mode == "background":
+                    yield batch, batch.dependencies
+                else:
+                    self._optimize_batches.append(batch)
+        for batch in batcher.get_batches(flush=True):
+            if mode == "background":
+                yield batch, batch.dependencies
+            else:
+                self._optimize_batches.append(batch)
+
+    def _iterate_work_items(self, phase):
+        """Does the work of iterate_work_items(), without the optimizers.
+        """
+        levels = self.options.get('subtreelevels', 0)
+        if not levels:
+            yield from self._iterate_tiles(phase)
+            return
+
+        rootdepth = max(0, self.treedepth - levels)
+        subtrees = {}
+        for tilepath, dependencies in self._iterate_tiles(phase):
+            if len(tilepath) < rootdepth:
+                yield tilepath, dependencies
+                continue
+
+            root = tilepath[:rootdepth]
+            subtrees.setdefault(root, []).append(tilepath)
+            if len(tilepath) == rootdepth:
+                # Tiles come in post-traversal order, and a tile is always
+                # rendered if any of its descendants is. So the root comes
+                # last, and once it's here the subtree is complete.
+                yield SubtreeWorkItem(root, subtrees.pop(root)), []
+
+    def _iterate_tiles(self, phase):
+        """Does the work of iterate_work_items(), one tile at a time.
         """
 
         # skip if asked to
@@ -472,25 +771,6 @@ class TileSet(object):
         if fd:
             logging.debug("Changelist activated for %s (fileno %s)", self, fd)
 
-            # This re-implements some of the logic from do_work()
-            def write_out(tilepath):
-                if len(tilepath) == self.treedepth:
-                    rt = RenderTile.from_path(tilepath)
-                    imgpath = rt.get_filepath(self.outputdir, self.imgextension)
-                elif len(tilepath) == 0:
-                    imgpath = os.path.join(self.outputdir, "base." + self.imgextension)
-                else:
-                    dest = os.path.join(self.outputdir, *(str(x) for x in tilepath[:-1]))
-                    name = str(tilepath[-1])
-                    imgpath = os.path.join(dest, name) + "." + self.imgextension
-                # We use low-level file output because we don't want open file
-                # handles being passed to subprocesses. fd is just an integer.
-                # This method is only called from the master process anyways.
-                # We don't use os.fdopen() because this fd may be shared by
-                # many tileset objects, and as soon as this method exists the
-                # file object may be garbage collected, closing the file.
-                os.write(fd, (imgpath + "\n").encode())
-
         # See note at the top of this file about the rendercheck modes for an
         # explanation of what this method does in different situations.
         #
@@ -506,7 +786,7 @@ class TileSet(object):
                 for i in range(4):
                     dependencies.append(tilepath + (i,))
                 if fd:
-                    write_out(tilepath)
+                    self._write_changelist(tilepath)
                 yield tilepath, dependencies
 
         else:
@@ -519,19 +799,80 @@ class TileSet(object):
                     for i in range(4):
                         dependencies.append(tilepath + (i,))
                     if fd:
-                        write_out(tilepath)
+                        self._write_changelist(tilepath)
                     yield tilepath, dependencies
 
+    def _get_imgpath(self, tilepath):
+        """Returns the path of the image file of the given tile."""
+        # This re-implements some of the logic from do_work()
+        if len(tilepath) == self.treedepth:
+            rt = RenderTile.from_path(tilepath)
+            return rt.get_filepath(self.outputdir, self.imgextension)
+        elif len(tilepath) == 0:
+            return os.path.join(self.outputdir, "base." + self.imgextension)
+        else:
+            dest = os.path.join(self.outputdir, *(str(x) for x in tilepath[:-1]))
+            name = str(tilepath[-1])
+            return os.path.join(dest, name) + "." + self.imgextension
+
+    def _write_changelist(self, tilepath):
+        """Writes the image path of the given tile to the changelist. Only
+        call this if a changelist was given in the options.
+
+        """
+        imgpath = self._get_imgpath(tilepath)
+        # We use low-level file output because we don't want open file
+        # handles being passed to subprocesses. fd is just an integer.
+        # This method is only called from the master process anyways.
+        # We don't use os.fdopen() because this fd may be shared by
+        # many tileset objects, and as soon as this method exists the
+        # file object may be garbage collected, closing the file.
+        os.write(self.options["changelist"], (imgpath + "\n").encode())
+
     def do_work(self, tilepath):
         """Renders the given tile.
 
         tilepath is yielded by iterate_work_items and is an iterable of
-        integers representing the path of the tile to render.
+        integers representing the path of the tile to render, a
+        SubtreeWorkItem or an OptimizeWorkItem.
+
+        """
+        if isinstance(tilepath, OptimizeWorkItem):
+            self._optimize_tiles(tilepath.imgpaths)
+        elif isinstance(tilepath, SubtreeWorkItem):
+            self._render_subtree(tilepath.tiles)
+        else:
+            self._render_tile(tilepath)
+        return collect_writes()
+
+    def _optimize_tiles(self, imgpaths):
+        """Runs the optimizers on the given tiles, for an OptimizeWorkItem.
+        Tiles that were already optimized, and then left alone by
+        _write_tile() because they didn't change, are skipped.
+
+        """
+        if self.manifest is not None:
+            imgpaths = [imgpath for imgpath in imgpaths if not self.manifest.is_optimized(
+                imgpath, self.storage.get_stat(imgpath))]
+        with self.storage.local_copies(imgpaths) as localpaths:
+            optimize_images(localpaths, self.imgextension, self.options['optimizeimg'])
+        if self.manifest is not None:
+            # The optimizers change the sizes the manifest knows the tiles by
+            for imgpath in imgpaths:
+                stat = self.storage.get_stat(imgpath)
+                if stat is not None:
+                    self.manifest.set_optimized(imgpath, stat)
+
+    def _render_tile(self, tilepath, children=None):
+        """Renders the tile at the given path, and returns (image, mtime) of
+        the result, or None if there was nothing to render.
+
+        children is passed on to _render_compositetile().
 
         """
         if len(tilepath) == self.treedepth:
             # A render-tile
-            self._render_rendertile(RenderTile.from_path(tilepath))
+            return self._render_rendertile(RenderTile.from_path(tilepath))
         else:
             # A composite-tile
             if len(tilepath) == 0:
@@ -542,39 +883,93 @@ class TileSet(object):
                 # All others
                 dest = os.path.join(self.outputdir, *(str(x) for x in tilepath[:-1]))
                 name = str(tilepath[-1])
-            self._render_compositetile(dest, name)
+            return self._render_compositetile(dest, name, children)
+
+    def _render_subtree(self, tiles):
+        """Renders the given list of tile paths, in order. The images of the
+        tiles rendered are kept until their parent is rendered, so
+        composite-tiles only read the children that weren't rendered here
+        from disk.
+
+        """
+        rendered = {}
+        for tilepath in tiles:
+            children = {}
+            for childnum in range(4):
+                childpath = tilepath + (childnum,)
+                if childpath in rendered:
+                    children[childnum] = rendered.pop(childpath)
+
+            result = self._render_tile(tilepath, children)
+            if result is not None:
+                rendered[tilepath] = result
 
     def get_initial_data(self):
         """This is called similarly to get_persistent_data, but is called after
         do_preprocessing but before any work is acutally done.
 
         """
-        d = self.get_persistent_data()
         # This is basically the same as get_persistent_data() with the
         # following exceptions:
         # * last_rendertime is not changed
         # * A key "render_in_progress" is set to True
         # * forcerendertime is set so that an interrupted mode=2 render will
         #   finish properly.
+        # * tilemanifest_complete is not changed
+        # * the chunk fingerprints are not saved
+        d = self._get_persistent_data()
         d['last_rendertime'] = self.last_rendertime
         d['render_in_progress'] = True
         d['forcerendertime'] = self.forcerendertime
+        # The manifest isn't complete until a check-tiles render has gone
+        # through every tile, or everything was rendered from scratch
+        d['tilemanifest_complete'] = self.manifest_complete
         return d
 
     def get_persistent_data(self):
         """Returns a dictionary representing the persistent data of this
-        TileSet. Typically this is called by AssetManager
+        TileSet. Typically this is called by AssetManager, once the render is
+        done, so this also saves the chunk fingerprints of the render.
+
+        """
+        self._save_fingerprints()
+        return self._get_persistent_data()
+
+    def _save_fingerprints(self):
+        """Saves the chunk fingerprints found by the last chunk scan, see
+        _chunk_scan().
 
         """
+        if self._new_fingerprints is None:
+            return
+        # Postponed tiles aren't rendered yet, so the fingerprints of their
+        # chunks can't be saved. Chunks of tiles that were rendered will be
+        # rendered again, which is the safe side.
+        if self._postponed is None:
+            fingerprints = ChunkFingerprints(self.outputdir)
+            if self._clear_fingerprints:
+                fingerprints.clear()
+            for (chunkx, chunkz), fingerprint in self._new_fingerprints.items():
+                fingerprints.set(chunkx, chunkz, fingerprint)
+            fingerprints.commit()
+            fingerprints.close()
+        self._new_fingerprints = None
+        self._clear_fingerprints = False
+
+    def _get_persistent_data(self):
         def bgcolorformat(color):
             return "#%02x%02x%02x" % color[0:3]
         isOverlay = self.options.get("overlay") or \
-            (not any(isinstance(x, rendermodes.Base) for x in self.options.get("rendermode")))
+            (not any(isinstance(x, (rendermodes.Base, rendermodes.Heightmap))
+                     for x in self.options.get("rendermode")))
 
         # don't update last render time if we're leaving this alone
         last_rendertime = self.last_rendertime
         if self.options['renderchecks'] != 3:
             last_rendertime = self.max_chunk_mtime
+            if self._postponed is not None:
+                # The next render has to find the postponed tiles again
+                last_rendertime = self._postponed_since
 
         d = dict(
             name=self.options.get('title'),
@@ -587,12 +982,19 @@ class TileSet(object):
             world=None,
             last_rendertime=last_rendertime,
             imgextension=self.imgextension,
+            tilesize=self.tilesize,
             isOverlay=isOverlay,
             poititle=self.options.get("poititle"),
             showlocationmarker=self.options.get("showlocationmarker"),
             center=(self.options.get("center") or self.options.get("spawn")
-                    or [0, 64, 0])
+                    or [0, 64, 0]),
+            tilemanifest_complete=bool(self.options.get('tilemanifest') and (
+                self.manifest_complete or self.options['renderchecks'] == 1 or
+                (self.options['renderchecks'] == 2 and self.new_outputdir)))
         )
+        if self.options['renderchecks'] == 3:
+            # the tiles were left alone
+            d['tilesize'] = self.config.get('tilesize', 384)
         d['maxZoom'] = self.options.get('maxzoom', self.treedepth)
         if d['maxZoom'] < 0:
             d['maxZoom'] = self.treedepth + self.options.get('maxzoom')
@@ -667,14 +1069,12 @@ class TileSet(object):
         self.xradius = xradius
         self.yradius = yradius
 
-    def _rearrange_tiles(self):
+    def _rearrange_tiles(self, curdepth):
         """If the target size of the tree is not the same as the existing size
-        on disk, do some re-arranging
+        on disk, curdepth, do some re-arranging
 
         """
-        try:
-            curdepth = self.config['zoomLevels']
-        except KeyError:
+        if curdepth is None:
             return
 
         if curdepth == 1:
@@ -685,131 +1085,27 @@ class TileSet(object):
             "Current tree depth for %s is reportedly %s. Target tree depth is %s.",
             self.options['name'], curdepth, self.treedepth)
         if self.treedepth != curdepth:
+            if self.manifest is not None:
+                # The tiles are about to move
+                self.manifest.clear()
+                self.manifest_complete = False
             if self.treedepth > curdepth:
                 logging.warning("Your map seems to have expanded beyond its previous bounds.")
                 logging.warning("Doing some tile re-arrangements... just a sec...")
                 for _ in range(self.treedepth - curdepth):
-                    self._increase_depth()
+                    self.storage.increase_depth(self.imgextension)
             elif self.treedepth < curdepth:
                 logging.warning(
                     "Your map seems to have shrunk. Did you delete some "
                     "chunks? No problem. Re-arranging tiles, just a sec...")
                 for _ in range(curdepth - self.treedepth):
-                    self._decrease_depth()
+                    self.storage.decrease_depth(self.imgextension)
                 logging.info(
                     "There, done. I'm switching to --check-tiles mode for "
                     "this one render. This will make sure any old tiles that "
                     "should no longer exist are deleted.")
                 self.options['renderchecks'] = 1
 
-    def _increase_depth(self):
-        """Moves existing tiles into place for a larger tree"""
-        getpath = functools.partial(os.path.join, self.outputdir)
-
-        # At top level of the tree:
-        # quadrant 0 is now 0/3
-        # 1 is now 1/2
-        # 2 is now 2/1
-        # 3 is now 3/0
-        # then all that needs to be done is to regenerate the new top level
-
-        def rollback_mkdir(dnum):
-            p = getpath("new" + str(dnum))
-            if os.path.exists(p):
-                os.rmdir(p)
-
-        def rollback_filerename(dnum):
-            newnum = (3, 2, 1, 0)[dnum]
-            qimg = getpath("new%d/%d.%s" % (dnum, newnum, self.imgextension))
-            qdir = getpath("new%d/%d" % (dnum, newnum))
-
-            if os.path.exists(qimg):
-                os.rename(qimg, getpath("%d.%s" % (dnum, self.imgextension)))
-            if os.path.exists(qdir):
-                os.rename(qdir, getpath(str(dnum)))
-
-        def rollback_dirrename(dnum):
-            os.rename(getpath(str(dnum)), getpath("new" + str(dnum)))
-
-        for dirnum in range(4):
-            newnum = (3, 2, 1, 0)[dirnum]
-
-            newdir = "new" + str(dirnum)
-            newdirpath = getpath(newdir)
-
-            files = [str(dirnum) + "." + self.imgextension, str(dirnum)]
-            newfiles = [str(newnum) + "." + self.imgextension, str(newnum)]
-
-            try:
-                try:
-                    os.mkdir(newdirpath)
-                    try:
-                        for f, newf in zip(files, newfiles):
-                            p = getpath(f)
-                            if os.path.exists(p):
-                                os.rename(p, getpath(newdir, newf))
-                    # We're catching BaseException here since we'll also want to do this on
-                    # exit.
-                    except BaseException:
-                        rollback_filerename(dirnum)
-                        raise
-                except BaseException:
-                    rollback_mkdir(dirnum)
-                    raise
-                os.rename(newdirpath, getpath(str(dirnum)))
-            except BaseException:
-                logging.warning("Overviewer was interrupted during tile "
-                                "re-arrangement.")
-                logging.warning("Rolling back changes...")
-                # Moonwalk the fuck out of here
-                for lastdir in range(dirnum - 1, -1, -1):
-                    rollback_dirrename(lastdir)
-                    rollback_filerename(lastdir)
-                    rollback_mkdir(lastdir)
-                raise
-
-    def _decrease_depth(self):
-        """If the map size decreases, or perhaps the user has a depth override
-        in effect, re-arrange existing tiles for a smaller tree"""
-        getpath = functools.partial(os.path.join, self.outputdir)
-
-        # quadrant 0/3 goes to 0
-        # 1/2 goes to 1
-        # 2/1 goes to 2
-        # 3/0 goes to 3
-        # Just worry about the directories here, the files at the top two
-        # levels are cheap enough to replace
-        if os.path.exists(getpath("0", "3")):
-            os.rename(getpath("0", "3"), getpath("new0"))
-            shutil.rmtree(getpath("0"))
-            os.rename(getpath("new0"), getpath("0"))
-
-        if os.path.exists(getpath("1", "2")):
-            os.rename(getpath("1", "2"), getpath("new1"))
-            shutil.rmtree(getpath("1"))
-            os.rename(getpath("new1"), getpath("1"))
-
-        if os.path.exists(getpath("2", "1")):
-            os.rename(getpath("2", "1"), getpath("new2"))
-            shutil.rmtree(getpath("2"))
-            os.rename(getpath("new2"), getpath("2"))
-
-        if os.path.exists(getpath("3", "0")):
-            os.rename(getpath("3", "0"), getpath("new3"))
-            shutil.rmtree(getpath("3"))
-            os.rename(getpath("new3"), getpath("3"))
-
-        # Delete the files in the top directory to make sure they get re-created.
-        files = [str(num) + "." + self.imgextension for num in range(4)] + \
-            ["base." + self.imgextension]
-        for f in files:
-            try:
-                os.unlink(getpath(f))
-            except OSError as e:
-                # Ignore file doesn't exist errors
-                if e.errno != errno.ENOENT:
-                    raise
-
     def _chunk_scan(self):
         """Scans the chunks of this TileSet's world to determine which
         render-tiles need rendering. Returns a RendertileSet object.
@@ -821,6 +1117,16 @@ class TileSet(object):
         For rendercheck modes 1 and 2: marks every tile in the tileset
         unconditionally, does not check any mtimes.
 
+        With the chunkfingerprints option, in mode 0 chunks with a greater
+        mtime only count if their fingerprint differs from the one recorded
+        the last time they changed. The fingerprints of the changed chunks
+        are kept in self._new_fingerprints, and only saved once the render is
+        done (see get_persistent_data()), so the chunks of an interrupted
+        render are still found changed the next time.
+
+        With the "prescan" texturegeneration option, in mode 0 the sprites of
+        the blocks in the changed chunks are generated at the end of the scan.
+
         As a side-effect, the scan sets self.max_chunk_mtime to the max of all
         the chunks' mtimes
 
@@ -847,6 +1153,20 @@ class TileSet(object):
 
         max_chunk_mtime = 0
 
+        fingerprints = None
+        new_fingerprints = None
+        if self.options.get('chunkfingerprints'):
+            fingerprints = ChunkFingerprints(self.outputdir)
+            new_fingerprints = {}
+            # If everything gets rendered, the fingerprints are recorded again
+            # as chunks change
+            self._clear_fingerprints = markall
+        unchanged = 0
+
+        prescan = None
+        if self.options.get('texturegeneration') == "prescan" and not markall:
+            prescan = set()
+
         # For each chunk, do this:
         #   For each tile that the chunk touches, do this:
         #       Compare the last modified time of the chunk and tile. If the
@@ -860,6 +1180,19 @@ class TileSet(object):
             if chunkmtime > max_chunk_mtime:
                 max_chunk_mtime = chunkmtime
 
+            changed = chunkmtime > last_rendertime
+            if changed and fingerprints is not None and not markall:
+                # Only count it as changed if its contents did
+                fingerprint = self.regionset.get_chunk_fingerprint(chunkx, chunkz)
+                if fingerprint is not None:
+                    if fingerprint == fingerprints.get(chunkx, chunkz):
+                        changed = False
+                        unchanged += 1
+                    else:
+                        new_fingerprints[chunkx, chunkz] = fingerprint
+            if changed and prescan is not None:
+                prescan.update(self.regionset.get_chunk_blockids(chunkx, chunkz))
+
             # Convert to diagonal coordinates
             chunkcol, chunkrow = convert_coords(chunkx, chunkz)
 
@@ -902,14 +1235,25 @@ class TileSet(object):
                     continue
 
                 # Check mtimes and conditionally add tile to the set
-                if chunkmtime > last_rendertime:
+                if changed:
                     dirty.add(tile.path)
 
+        if fingerprints is not None:
+            fingerprints.close()
+        self._new_fingerprints = new_fingerprints
+
         t = int(time.time() - stime)
         logging.debug(
             "Finished chunk scan for %s. %s chunks scanned in %s second%s.",
             self.options['name'], chunkcount, t,
             "s" if t != 1 else "")
+        if unchanged:
+            logging.debug("%s saved chunks of %s had nothing changed in them.",
+                          unchanged, self.options['name'])
+        if prescan:
+            self.textures.generate_blocks(prescan)
+            logging.debug("Generated the sprites of %d kinds of blocks for %s.",
+                          len(prescan), self.options['name'])
 
         self.max_chunk_mtime = max_chunk_mtime
         return dirty
@@ -917,77 +1261,98 @@ class TileSet(object):
     def __str__(self):
         return "<TileSet for %s>" % os.path.basename(self.outputdir)
 
-    def _render_compositetile(self, dest, name):
+    def _render_compositetile(self, dest, name, children=None):
         """
         Renders a tile at os.path.join(dest, name)+".ext" by taking tiles from
         os.path.join(dest, name, "{0,1,2,3}.png")
 
         If name is "base" then render tile at os.path.join(dest, "base.png") by
         taking tiles from os.path.join(dest, "{0,1,2,3}.png")
+
+        children optionally maps child numbers to (image, mtime) tuples of
+        children that were just rendered, which are used instead of reading
+        them back from disk.
+
+        Returns (image, mtime) of the new tile, or None if it has no children.
         """
+        if children is None:
+            children = {}
         imgformat = self.imgextension
         imgpath = os.path.join(dest, name) + "." + imgformat
 
+        half = self.tilesize // 2
         if name == "base":
             # Special case for the base tile. Its children are in the same
             # directory instead of in a sub-directory
             quadPath = [
                 ((0, 0), os.path.join(dest, "0." + imgformat)),
-                ((192, 0), os.path.join(dest, "1." + imgformat)),
-                ((0, 192), os.path.join(dest, "2." + imgformat)),
-                ((192, 192), os.path.join(dest, "3." + imgformat)),
+                ((half, 0), os.path.join(dest, "1." + imgformat)),
+                ((0, half), os.path.join(dest, "2." + imgformat)),
+                ((half, half), os.path.join(dest, "3." + imgformat)),
             ]
         else:
             quadPath = [
                 ((0, 0), os.path.join(dest, name, "0." + imgformat)),
-                ((192, 0), os.path.join(dest, name, "1." + imgformat)),
-                ((0, 192), os.path.join(dest, name, "2." + imgformat)),
-                ((192, 192), os.path.join(dest, name, "3." + imgformat)),
+                ((half, 0), os.path.join(dest, name, "1." + imgformat)),
+                ((0, half), os.path.join(dest, name, "2." + imgformat)),
+                ((half, half), os.path.join(dest, name, "3." + imgformat)),
             ]
 
         # Check each of the 4 child tiles, getting their existance and mtime
         # infomation. Also keep track of the max mtime of all children
         max_mtime = 0
         quadPath_filtered = []
-        for path in quadPath:
-            try:
-                quad_mtime = os.stat(path[1])[stat.ST_MTIME]
-            except OSError:
-                # This tile doesn't exist or some other error with the stat
-                # call. Move on.
-                continue
+        for childnum, path in enumerate(quadPath):
+            if childnum in children:
+                quad_mtime = children[childnum][1]
+            else:
+                st = self.storage.get_stat(path[1])
+                if st is not None:
+                    quad_mtime = st[1]
+                else:
+                    quad_mtime = self._get_blank_mtime(path[1])
+                    if quad_mtime is None:
+                        # This tile doesn't exist. Move on.
+                        continue
+                    # It's blank, so there's nothing to draw, but it still
+                    # counts as a child
+                    path = None
             # The tile exists, so we need to use it in our rendering of this
             # composite tile
-            quadPath_filtered.append(path)
+            quadPath_filtered.append((childnum, path))
             if quad_mtime > max_mtime:
                 max_mtime = quad_mtime
 
         # If no children exist, delete this tile
         if not quadPath_filtered:
-            try:
-                os.unlink(imgpath)
-            except OSError as e:
-                # Ignore errors if it's "file doesn't exist"
-                if e.errno != errno.ENOENT:
-                    raise
+            self.storage.remove(imgpath)
+            if self.manifest is not None:
+                self.manifest.remove(imgpath)
             logging.warning(
                 "Tile %s was requested for render, but no children were found! "
                 "This is probably a bug.", imgpath)
-            return
+            return None
 
         # Create the actual image now
-        img = Image.new("RGBA", (384, 384), self.options['bgcolor'])
+        img = Image.new("RGBA", (self.tilesize, self.tilesize), self.options['bgcolor'])
         # We'll use paste (NOT alpha_over) for quadtree generation because
         # this is just straight image stitching, not alpha blending
-        for path in quadPath_filtered:
+        for childnum, path in quadPath_filtered:
+            if path is None:
+                continue
             try:
-                src = Image.open(path[1])
-                # optimizeimg may have converted them to a palette image in the meantime
-                if src.mode != "RGB" and src.mode != "RGBA":
-                    src = src.convert("RGBA")
-                src.load()
-
-                quad = Image.new("RGBA", (192, 192), self.options['bgcolor'])
+                if childnum in children:
+                    src = children[childnum][0]
+                else:
+                    with self.storage.open(path[1]) as f:
+                        src = Image.open(f)
+                        # optimizeimg may have converted them to a palette image in the
+                        # meantime
+                        if src.mode != "RGB" and src.mode != "RGBA":
+                            src = src.convert("RGBA")
+                        src.load()
+
+                quad = Image.new("RGBA", (half, half), self.options['bgcolor'])
                 resize_half(quad, src)
                 img.paste(quad, path[0])
             except Exception as e:
@@ -996,36 +1361,175 @@ class TileSet(object):
                     "I'm going to try and delete it. You will need to run "
                     "the render again and with --check-tiles.")
                 try:
-                    os.unlink(path[1])
+                    self.storage.remove(path[1])
                 except Exception as e:
                     logging.error(
                         "While attempting to delete corrupt image %s, an error was encountered. "
                         "You will need to delete it yourself. Error was '%s'", path[1], e)
 
         # Save it
-        with FileReplacer(imgpath, capabilities=self.fs_caps) as tmppath:
+        self._save_tile(img, imgpath, max_mtime)
+        return img, max_mtime
+
+    def _save_tile(self, img, imgpath, mtime):
+        """Encodes img in this tileset's image format, runs the configured
+        optimizers on it and atomically replaces imgpath with the result,
+        setting its mtime to the given value.
+
+        With the writethreads option this is handed to the process's writer
+        threads instead and happens in the background, see collect_writes().
+        The image must not be changed afterwards.
+
+        """
+        threads = self.options.get('writethreads', 0)
+        if threads:
+            _get_writer(threads).submit(self._write_tile, img, imgpath, mtime)
+        else:
+            self._write_tile(img, imgpath, mtime)
+
+    def _write_tile(self, img, imgpath, mtime):
+        """Does the actual work of _save_tile()."""
+        if self.options.get('skipblank') and self._is_blank(img):
+            # The web viewer shows blank.<ext> for tiles that aren't there
+            self.storage.remove(imgpath)
+            self.manifest.set_blank(imgpath, mtime)
+            return
+
+        settings = self._get_encoder_settings(self._get_zoom_level(imgpath))
+        digest = None
+        if self.options.get('skipunchanged') or self.options.get('deduplicate'):
+            digest = self._get_tile_digest(img, settings)
+        if self.options.get('skipunchanged'):
+            if self.manifest.is_unchanged(imgpath, digest, self.storage.get_stat(imgpath)):
+                # The same image is already there, so leave it alone. It
+                # still needs the new mtime for the render checks.
+                self.storage.set_mtime(imgpath, mtime)
+                self.manifest.set_unchanged(imgpath, self.storage.get_stat(imgpath))
+                return
+        if self.options.get('deduplicate') and self._link_duplicate(imgpath, digest, mtime):
+            return
+
+        imgformat = self.imgextension
+        with self.storage.writer(imgpath, mtime) as tmppath:
             if imgformat == 'jpg':
-                img.convert('RGB').save(tmppath, "jpeg", quality=self.options['imgquality'],
+                img.convert('RGB').save(tmppath, "jpeg", quality=settings['quality'],
                                         subsampling=0)
             elif imgformat == 'png':   # PNG
-                img.save(tmppath, "png")
+                if settings['compress_level'] is None:
+                    img.save(tmppath, "png")
+                else:
+                    img.save(tmppath, "png", compress_level=settings['compress_level'])
             elif imgformat == 'webp':
-                img.save(tmppath, "webp", quality=self.options['imgquality'],
-                         lossless=self.options['imglossless'])
+                if settings['method'] is None:
+                    img.save(tmppath, "webp", quality=settings['quality'],
+                             lossless=settings['lossless'])
+                else:
+                    img.save(tmppath, "webp", quality=settings['quality'],
+                             lossless=settings['lossless'], method=settings['method'])
 
-            if self.options['optimizeimg']:
+            optimized = (self._get_optimizemode() == "inline" and
+                         bool(self.options['optimizeimg']) and settings['optimize'])
+            if optimized:
                 optimize_image(tmppath, imgformat, self.options['optimizeimg'])
 
-            try:
-                os.utime(tmppath, (max_mtime, max_mtime))
-            except OSError as e:
-                # Ignore errno ENOENT: file does not exist. Due to a race
-                # condition, two processes could conceivably try and update
-                # the same temp file at the same time
-                if e.errno != errno.ENOENT:
-                    raise
+        if self.manifest is not None:
+            self.manifest.set(imgpath, self.storage.get_stat(imgpath), digest, optimized)
+
+    def _is_blank(self, img):
+        """Returns True if every pixel of the given image is the background
+        color.
+
+        """
+        bgcolor = Image.new(img.mode, (1, 1), self.options['bgcolor']).getpixel((0, 0))
+        if not isinstance(bgcolor, tuple):
+            bgcolor = (bgcolor,)
+        extrema = img.getextrema()
+        if not isinstance(extrema[0], tuple):
+            extrema = (extrema,)
+        return all(lo == hi == c for (lo, hi), c in zip(extrema, bgcolor))
+
+    def _get_blank_mtime(self, imgpath):
+        """Returns the mtime of the given tile if it is a blank tile that
+        wasn't stored (see _write_tile()), or None.
+
+        """
+        if not self.options.get('skipblank'):
+            return None
+        return self.manifest.get_blank_mtime(imgpath)
 
-    def _render_rendertile(self, tile):
+    def _link_duplicate(self, imgpath, digest, mtime):
+        """Looks in the manifest for a tile that was written with the same
+        digest, and makes imgpath share its storage if there is one. Returns
+        True if it did.
+
+        """
+        if self.storage.links_share_mtime:
+            candidates = self.manifest.find(digest, mtime)
+        else:
+            candidates = self.manifest.find(digest)
+        for srcpath, stat in candidates:
+            # Make sure it wasn't changed behind the manifest's back
+            if srcpath == imgpath or self.storage.get_stat(srcpath) != stat:
+                continue
+            if self.storage.link(srcpath, imgpath, mtime):
+                self.manifest.set(imgpath, self.storage.get_stat(imgpath), digest)
+                return True
+        return False
+
+    def _get_zoom_level(self, imgpath):
+        """Returns the zoom level of the given tile: 0 for the base tile, and
+        treedepth for the render-tiles.
+
+        """
+        relpath = os.path.relpath(imgpath, self.outputdir)
+        if relpath.startswith("base."):
+            return 0
+        return relpath.count(os.sep) + 1
+
+    def _get_encoder_settings(self, level):
+        """Returns the encoder settings for tiles of the given zoom level, as
+        configured by the zoomencoding option. Negative levels in there count
+        from the deepest level, -1 being the render-tiles. A dict with these
+        keys is returned:
+
+        compress_level
+            zlib compression level for png, or None for Pillow's default
+        quality
+            quality for jpg and webp, defaults to the imgquality option
+        method
+            effort for webp (0-6), or None for Pillow's default
+        lossless
+            lossless webp, defaults to the imglossless option
+        optimize
+            whether to run the optimizeimg optimizers, defaults to True
+
+        """
+        settings = {
+            'compress_level': None,
+            'quality': self.options.get('imgquality', 95),
+            'method': None,
+            'lossless': self.options.get('imglossless', True),
+            'optimize': True,
+        }
+        zoomencoding = self.options.get('zoomencoding') or {}
+        for key in ("default", level - self.treedepth - 1, level):
+            settings.update(zoomencoding.get(key, {}))
+        return settings
+
+    def _get_tile_digest(self, img, settings):
+        """Returns a hash of the pixels of the given image, and of the options
+        and encoder settings that decide how it's saved.
+
+        """
+        h = hashlib.blake2b(digest_size=16)
+        h.update(repr((img.mode, img.size, self.imgextension, sorted(settings.items()),
+                       self._get_optimizemode(),
+                       [(opt.__class__.__name__, sorted(vars(opt).items()))
+                        for opt in self.options['optimizeimg'] or []])).encode())
+        h.update(img.tobytes())
+        return h.digest()
+
+    def _render_rendertile(self, tile, others=()):
         """Renders the given render-tile.
 
         This function is called from the public do_work() method in the child
@@ -1037,9 +1541,16 @@ class TileSet(object):
         The image is rendered and saved to disk in the place this tileset is
         configured to save images.
 
-        """
+        others is an optional list of more TileSets using the same regionset
+        as this one (see TileSetGroup). The same tile is rendered for each of
+        them too, drawing every chunk section into all of the tiles before
+        moving on to the next, so chunks are only loaded once.
 
-        imgpath = tile.get_filepath(self.outputdir, self.imgextension)
+        Returns (image, mtime) of this TileSet's tile, or None if there was
+        nothing to render.
+
+        """
+        tilesets = [self] + list(others)
 
         # Calculate which chunks are relevant to this tile
         # This is a list of (col, row, chunkx, chunkz, chunk_mtime)
@@ -1049,76 +1560,230 @@ class TileSet(object):
             # No chunks were found in this tile
             logging.warning("%s was requested for render, but no chunks found! "
                             "This may be a bug.", tile)
-            try:
-                os.unlink(imgpath)
-            except OSError as e:
-                # ignore only if the error was "file not found"
-                if e.errno != errno.ENOENT:
-                    raise
+            for ts in tilesets:
+                imgpath = tile.get_filepath(ts.outputdir, ts.imgextension)
+                ts.storage.remove(imgpath)
+                if ts.manifest is not None:
+                    ts.manifest.remove(imgpath)
+            return None
+
+        tileimgs = []
+        for ts in tilesets:
+            # Create the directory if not exists
+            ts.storage.makedirs(os.path.dirname(tile.get_filepath(ts.outputdir, ts.imgextension)))
+
+            # Compile this image
+            tileimgs.append(Image.new("RGBA", (ts.tilesize, ts.tilesize), ts.options['bgcolor']))
+
+        # For the TileSets keeping a layer cache (see _load_layercache), the
+        # previous layers of each chunk column that can be reused. Columns
+        # that can't are drawn into a new layer of their own
+        layercaches = []
+        newlayers = []
+        for ts in tilesets:
+            if ts.options.get('layercache'):
+                layercaches.append(ts._load_layercache(tile))
+                newlayers.append({})
             else:
-                logging.debug("%s deleted", tile)
-            return
-
-        # Create the directory if not exists
-        dirdest = os.path.dirname(imgpath)
-        if not os.path.exists(dirdest):
-            try:
-                os.makedirs(dirdest)
-            except OSError as e:
-                # Ignore errno EEXIST: file exists. Due to a race condition,
-                # two processes could conceivably try and create the same
-                # directory at the same time
-                if e.errno != errno.EEXIST:
-                    raise
-
-        # Compile this image
-        tileimg = Image.new("RGBA", (384, 384), self.options['bgcolor'])
+                layercaches.append(None)
+                newlayers.append(None)
+        column_mtimes = {}
 
         colstart = tile.col
         rowstart = tile.row
         # col colstart will get drawn on the image starting at x coordinates -(384/2)
         # row rowstart will get drawn on the image starting at y coordinates -(192/2)
+        # (with 24px block sprites; everything scales with the tile size)
+        half = self.tilesize // 2
+        quarter = self.tilesize // 4
         max_chunk_mtime = 0
         for col, row, chunkx, chunky, chunkz, chunk_mtime in chunks:
-            xpos = -192 + (col - colstart) * 192
-            ypos = -96 + (row - rowstart) * 96 + (16 - 1 - chunky) * 192
+            xpos = -half + (col - colstart) * half
+            ypos = -quarter + (row - rowstart) * quarter + (16 - 1 - chunky) * half
 
             if chunk_mtime > max_chunk_mtime:
                 max_chunk_mtime = chunk_mtime
 
+            column = (chunkx, chunkz)
+            if column not in column_mtimes:
+                # A column's layer depends on its neighbours too (lighting,
+                # occlusion, ...)
+                column_mtimes[column] = tuple(
+                    self.regionset.get_chunk_mtime(chunkx + dx, chunkz + dz)
+                    for dx in (-1, 0, 1) for dz in (-1, 0, 1))
+
             # draw the chunk!
-            try:
-                c_overviewer.render_loop(
-                    self.world, self.regionset, chunkx, chunky, chunkz, tileimg, xpos, ypos,
-                    self.options['rendermode'], self.textures)
-            except nbt.CorruptionError:
-                # A warning and traceback was already printed by world.py's
-                # get_chunk()
-                logging.debug("Skipping the render of corrupt chunk at %s,%s "
-                              "and moving on.", chunkx, chunkz)
-            except world.ChunkDoesntExist:
-                # Some chunks are present on disk but not fully initialized.
-                # This is okay.
-                pass
-            except Exception as e:
-                logging.error("Could not render chunk %s,%s for some reason. "
-                              "This is likely a render primitive option error.", chunkx, chunkz)
-                logging.error("Full error was:", exc_info=1)
-                sys.exit(1)
+            for i, (ts, tileimg) in enumerate(zip(tilesets, tileimgs)):
+                if layercaches[i] is not None:
+                    cached = layercaches[i].get(column)
+                    if cached is not None and cached[0] == column_mtimes[column]:
+                        continue
+                    if column not in newlayers[i]:
+                        newlayers[i][column] = Image.new("RGBA", (ts.tilesize, ts.tilesize),
+                                                         (0, 0, 0, 0))
+                    tileimg = newlayers[i][column]
+
+                try:
+                    heightmap = ts._get_heightmap()
+                    if heightmap is not None:
+                        heightmap.render_chunk(ts.regionset, chunkx, chunky, chunkz, tileimg,
+                                               xpos, ypos)
+                    else:
+                        c_overviewer.render_loop(
+                            ts.world, ts.regionset, chunkx, chunky, chunkz, tileimg, xpos, ypos,
+                            ts.options['rendermode'], ts.textures)
+                except nbt.CorruptionError:
+                    # A warning and traceback was already printed by world.py's
+                    # get_chunk()
+                    logging.debug("Skipping the render of corrupt chunk at %s,%s "
+                                  "and moving on.", chunkx, chunkz)
+                    break
+                except world.ChunkDoesntExist:
+                    # Some chunks are present on disk but not fully initialized.
+                    # This is okay.
+                    break
+                except Exception as e:
+                    logging.error("Could not render chunk %s,%s for some reason. "
+                                  "This is likely a render primitive option error.", chunkx, chunkz)
+                    logging.error("Full error was:", exc_info=1)
+                    sys.exit(1)
+
+        # Put together the tiles of the TileSets using layers, back to front
+        for i, ts in enumerate(tilesets):
+            if layercaches[i] is not None:
+                layers = {}
+                for column in column_mtimes:
+                    if column in newlayers[i]:
+                        layer = newlayers[i][column]
+                        bbox = layer.getbbox()
+                        if bbox:
+                            layer = layer.crop(bbox)
+                            layers[column] = (column_mtimes[column], bbox[:2], layer.size,
+                                              zlib.compress(layer.tobytes(), 1))
+                        else:
+                            layers[column] = (column_mtimes[column], None, None, None)
+                    elif column in layercaches[i] and \
+                            layercaches[i][column][0] == column_mtimes[column]:
+                        layers[column] = layercaches[i][column]
+                    else:
+                        # Nothing was drawn for this column (it failed to load)
+                        layers[column] = (column_mtimes[column], None, None, None)
+
+                ts._composite_layers(tileimgs[i], layers)
+                ts._save_layercache(tile, layers)
 
         # Save them
-        with FileReplacer(imgpath, capabilities=self.fs_caps) as tmppath:
-            if self.imgextension == 'jpg':
-                tileimg.convert('RGB').save(tmppath, "jpeg", quality=self.options['imgquality'],
-                                            subsampling=0)
-            elif self.imgextension == 'png':   # PNG
-                tileimg.save(tmppath, "png")
-            elif self.imgextension == 'webp':
-                tileimg.save(tmppath, "webp", quality=self.options['imgquality'],
-                         lossless=self.options['imglossless'])
-            if self.options['optimizeimg']:
-                optimize_image(tmppath, self.imgextension, self.options['optimizeimg'])
-            os.utime(tmppath, (max_chunk_mtime, max_chunk_mtime))
+        for ts, tileimg in zip(tilesets, tileimgs):
+            ts._save_tile(tileimg, tile.get_filepath(ts.outputdir, ts.imgextension),
+                          max_chunk_mtime)
+        return tileimgs[0], max_chunk_mtime
+
+    def _get_heightmap(self):
+        """Returns the HeightmapRenderer drawing the chunks of this TileSet if
+        its rendermode is a heightmap, or None if they're drawn by the C
+        extension.
+
+        """
+        try:
+            return self._heightmap
+        except AttributeError:
+            pass
+        self._heightmap = None
+        rendermode = self.options['rendermode']
+        if rendermode and isinstance(rendermode[0], rendermodes.Heightmap):
+            self._heightmap = HeightmapRenderer(rendermode[0], self.textures)
+        return self._heightmap
+
+    def _get_layercache_path(self, tile):
+        """Returns the path of the layer cache file for the given RenderTile.
+        """
+        return os.path.join(self.outputdir, ".layercache",
+                            *(str(x) for x in tile.path)) + ".layers"
+
+    def _get_layercache_key(self):
+        """Returns a string identifying everything besides the chunks that
+        goes into a layer: the rendermode and its options, the textures and
+        the C extension.
+
+        The textures are identified by Textures.get_cache_key(), which also
+        covers the files they are loaded from, so replacing a jar or resource
+        pack at the same path doesn't keep stale layers around.
+
+        """
+        try:
+            return self._layercache_key
+        except AttributeError:
+            pass
+        rendermode = [(p.name, sorted(p.option_values.items())) for p in self.options['rendermode']]
+        key = repr((rendermode, self.textures.get_cache_key(), c_overviewer.extension_version()))
+        self._layercache_key = hashlib.sha1(key.encode()).hexdigest()
+        return self._layercache_key
+
+    def _load_layercache(self, tile):
+        """Loads the cached chunk column layers of the given RenderTile.
+
+        Returns a dict mapping (chunkx, chunkz) to (mtimes, offset, size, data)
+        tuples, where mtimes are the chunk mtimes of the column and its
+        neighbours when the layer was drawn, offset and size give the layer's
+        place in the tile and data is the zlib-compressed RGBA layer. Offset,
+        size and data are None for empty layers.
+
+        Returns an empty dict if there is no usable cache for this tile, or
+        if every tile is rendered again (--forcerender), so that the layers
+        are all drawn anew.
+
+        """
+        if self.options['renderchecks'] == 2:
+            return {}
+        try:
+            with open(self._get_layercache_path(tile), "rb") as f:
+                cache = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return {}
+        except Exception as e:
+            logging.debug("Couldn't read the layer cache of %s: %s", tile, e)
+            return {}
+
+        # The same tile path can end up meaning a different tile if the map
+        # is re-arranged, so check the tile too
+        if cache.get('key') != self._get_layercache_key() or \
+                cache.get('tile') != (tile.col, tile.row):
+            return {}
+        return cache['layers']
+
+    def _save_layercache(self, tile, layers):
+        """Saves the chunk column layers of the given RenderTile, as returned
+        by _load_layercache().
+
+        """
+        cachepath = self._get_layercache_path(tile)
+        dirdest = os.path.dirname(cachepath)
+        if not os.path.exists(dirdest):
+            try:
+                os.makedirs(dirdest)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+        cache = {'key': self._get_layercache_key(), 'tile': (tile.col, tile.row), 'layers': layers}
+        with FileReplacer(cachepath, capabilities=self.fs_caps) as tmppath:
+            with open(tmppath, "wb") as f:
+                pickle.dump(cache, f, pickle.HIGHEST_PROTOCOL)
+
+    def _composite_layers(self, tileimg, layers):
+        """Draws the given chunk column layers onto tileimg.
+
+        Columns are drawn back to front. A chunk column can only cover
+        columns with a smaller row (z - x) than its own, and columns in the
+        same row never overlap, so sorting by row is enough.
+
+        """
+        for column in sorted(layers, key=lambda c: c[1] - c[0]):
+            _, offset, size, data = layers[column]
+            if data is None:
+                continue
+            layer = Image.frombytes("RGBA", size, zlib.decompress(data))
+            alpha_over(tileimg, layer, offset, layer)
 
     def _iterate_and_check_tiles(self, path):
         """A generator function over all tiles that should exist in the subtree
@@ -1154,12 +1819,7 @@ class TileSet(object):
             # Render this tile if any of its chunks are greater than its mtime
             tileobj = RenderTile.from_path(path)
             imgpath = tileobj.get_filepath(self.outputdir, self.imgextension)
-            try:
-                tile_mtime = os.stat(imgpath)[stat.ST_MTIME]
-            except OSError as e:
-                if e.errno != errno.ENOENT:
-                    raise
-                tile_mtime = 0
+            tile_mtime = self._get_tile_mtime(imgpath)
 
             try:
                 max_chunk_mtime = max(c[5] for c in get_chunks_by_tile(tileobj, self.regionset))
@@ -1238,12 +1898,7 @@ class TileSet(object):
                 imgpath = os.path.join(self.outputdir, *(str(x) for x in path))
                 imgpath += "." + self.imgextension
                 logging.debug("Testing mtime for composite-tile %s", imgpath)
-                try:
-                    tile_mtime = os.stat(imgpath)[stat.ST_MTIME]
-                except OSError as e:
-                    if e.errno != errno.ENOENT:
-                        raise
-                    tile_mtime = 0
+                tile_mtime = self._get_tile_mtime(imgpath)
 
                 if tile_mtime < max_child_mtime:
                     # If any child was updated more recently than ourself, then
@@ -1253,30 +1908,431 @@ class TileSet(object):
                     # Nope.
                     yield path, max_child_mtime, False
 
+    def _get_tile_mtime(self, imgpath):
+        """Returns the mtime of the given tile, or 0 if it doesn't exist. This
+        is called by _iterate_and_check_tiles() as a helper-method.
+
+        If the tile manifest is complete, the mtime comes from there instead
+        of the filesystem. If it's in use but not complete yet, the tile is
+        recorded in it.
+
+        """
+        if self.manifest_complete:
+            return self.manifest.get_mtime(imgpath) or 0
+
+        st = self.storage.get_stat(imgpath)
+        if st is None:
+            return self._get_blank_mtime(imgpath) or 0
+        if self.options.get('tilemanifest'):
+            self.manifest.set_stat(imgpath, st)
+        return st[1]
+
     def _nuke_path(self, path):
         """Given a quadtree path, erase it from disk. This is called by
         _iterate_and_check_tiles() as a helper-method.
 
         """
+        if self.manifest_complete:
+            # Only look on disk for tiles the manifest knows about
+            def exists(imgpath):
+                return self.manifest.get_mtime(imgpath) is not None
+
+            def tree_exists(dirpath):
+                return self.manifest.has_tree(dirpath)
+        elif self.options.get('skipblank'):
+            # Blank tiles are only in the manifest
+            def exists(imgpath):
+                return (self.storage.exists(imgpath) or
+                        self.manifest.get_blank_mtime(imgpath) is not None)
+
+            def tree_exists(dirpath):
+                return self.storage.tree_exists(dirpath) or self.manifest.has_tree(dirpath)
+        else:
+            exists = self.storage.exists
+            tree_exists = self.storage.tree_exists
+
         if len(path) == self.treedepth:
             # path referrs to a single tile
             tileobj = RenderTile.from_path(path)
             imgpath = tileobj.get_filepath(self.outputdir, self.imgextension)
-            if os.path.exists(imgpath):
-                # No need to catch ENOENT since this is only called from the
-                # master process
+            if exists(imgpath):
                 logging.debug("Found an image that shouldn't exist. Deleting it: %s", imgpath)
-                os.remove(imgpath)
+                self._remove_tile(imgpath)
         else:
             # path referrs to a composite tile, and by extension a directory
             dirpath = os.path.join(self.outputdir, *(str(x) for x in path))
             imgpath = dirpath + "." + self.imgextension
-            if os.path.exists(imgpath):
+            if exists(imgpath):
                 logging.debug("Found an image that shouldn't exist. Deleting it: %s", imgpath)
-                os.remove(imgpath)
-            if os.path.exists(dirpath):
+                self._remove_tile(imgpath)
+            if tree_exists(dirpath):
                 logging.debug("Found a subtree that shouldn't exist. Deleting it: %s", dirpath)
-                shutil.rmtree(dirpath)
+                self.storage.remove_tree(dirpath)
+                if self.manifest is not None:
+                    self.manifest.remove_tree(dirpath)
+
+    def _remove_tile(self, imgpath):
+        """Deletes the given tile, and its record in the manifest."""
+        self.storage.remove(imgpath)
+        if self.manifest is not None:
+            self.manifest.remove(imgpath)
+
+
+class SubtreeWorkItem(tuple):
+    """The path of the root of a subtree, along with the paths of all tiles
+    in that subtree that need rendering (in post-traversal order). Like
+    GroupWorkItem, it compares and hashes like the plain path tuple.
+
+    """
+    def __new__(cls, path, tiles):
+        item = super(SubtreeWorkItem, cls).__new__(cls, path)
+        item.tiles = tiles
+        return item
+
+    def __reduce__(self):
+        return SubtreeWorkItem, (tuple(self), self.tiles)
+
+
+class GroupWorkItem(tuple):
+    """A tile path tagged with the indexes of the TileSets in a TileSetGroup
+    that need that tile rendered. It compares and hashes like the plain path
+    tuple, so the dispatcher's dependency tracking works on it unchanged.
+
+    """
+    def __new__(cls, path, members):
+        item = super(GroupWorkItem, cls).__new__(cls, path)
+        item.members = members
+        return item
+
+    def __reduce__(self):
+        return GroupWorkItem, (tuple(self), self.members)
+
+
+class OptimizeWorkItem(object):
+    """A batch of image paths for the optimizers, see OptimizeBatcher. Unlike
+    the other work items this never compares equal to a tile path.
+    dependencies is only used by the master process and isn't pickled.
+
+    """
+    def __init__(self, imgpaths, member=None, dependencies=()):
+        self.imgpaths = imgpaths
+        self.member = member
+        self.dependencies = list(dependencies)
+
+    def __eq__(self, other):
+        return (isinstance(other, OptimizeWorkItem) and
+                (self.imgpaths, self.member) == (other.imgpaths, other.member))
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(tuple(self.imgpaths))
+
+    def __reduce__(self):
+        return OptimizeWorkItem, (self.imgpaths, self.member)
+
+
+class OptimizeBatcher(object):
+    """Collects the tiles that are handed out for rendering into batches for
+    the optimizers, as OptimizeWorkItems. A tile can only be optimized once
+    its parent is done, because the parent is built from it, so each batch
+    depends on the work items that rendered the parents of its tiles.
+
+    Which tiles were actually written, rather than left alone by the
+    skipunchanged option, is only known once they're rendered, so
+    TileSet._optimize_tiles() leaves those out when the batch is run.
+
+    """
+    # Gather at least this many tiles per batch
+    batchsize = 64
+
+    def __init__(self, tileset, member=None):
+        self.tileset = tileset
+        self.member = member
+        # maps the tiles rendered whose parent wasn't rendered yet to the work
+        # item that rendered them
+        self.rendered = {}
+        self.imgpaths = []
+        self.dependencies = []
+
+    def add(self, workitem, tiles):
+        """Adds the tiles rendered by the given work item."""
+        for tilepath in tiles:
+            self.rendered[tilepath] = workitem
+            ready = [tilepath + (i,) for i in range(4) if tilepath + (i,) in self.rendered]
+            if not tilepath:
+                # Nothing reads the base tile
+                ready.append(tilepath)
+            for path in ready:
+                del self.rendered[path]
+                if self.tileset._get_encoder_settings(len(path))['optimize']:
+                    self.imgpaths.append(self.tileset._get_imgpath(path))
+            if ready and workitem not in self.dependencies:
+                self.dependencies.append(workitem)
+
+    def get_batches(self, flush=False):
+        """Returns a list of the batches that are ready. If flush is True,
+        everything that was added goes into a batch.
+
+        """
+        if flush:
+            # Tiles whose parents weren't rendered. This doesn't normally
+            # happen, since the parents of rendered tiles are rendered too.
+            for path, workitem in sorted(self.rendered.items()):
+                if self.tileset._get_encoder_settings(len(path))['optimize']:
+                    self.imgpaths.append(self.tileset._get_imgpath(path))
+                if workitem not in self.dependencies:
+                    self.dependencies.append(workitem)
+            self.rendered.clear()
+        if not self.imgpaths or (len(self.imgpaths) < self.batchsize and not flush):
+            return []
+
+        batch = OptimizeWorkItem(self.imgpaths, self.member, self.dependencies)
+        self.imgpaths = []
+        self.dependencies = []
+        return [batch]
+
+
+class TileSetGroup(object):
+    """Implements the Worker interface for several TileSets that use the same
+    RegionSet object (and therefore the same tile grid), so each tile is
+    rendered for all of them in a single pass. Each chunk is then loaded once
+    per tile and drawn with every rendermode, instead of once per TileSet.
+
+    The member TileSets still do their own preprocessing, and are still the
+    ones handed to the asset manager; only the dispatcher sees the group.
+
+    """
+
+    def __init__(self, tilesets):
+        self.tilesets = list(tilesets)
+        self.regionset = self.tilesets[0].regionset
+        self.treedepth = self.tilesets[0].treedepth
+        for ts in self.tilesets:
+            assert ts.regionset is self.regionset and ts.treedepth == self.treedepth
+
+    def __str__(self):
+        return "<TileSetGroup for %s>" % ", ".join(
+            os.path.basename(ts.outputdir) for ts in self.tilesets)
+
+    def do_preprocessing(self):
+        """The member TileSets are preprocessed separately, there is nothing
+        to do here.
+
+        """
+        pass
+
+    def refresh(self):
+        # The member TileSets all share the RegionSet
+        return self.regionset.refresh()
+
+    def get_num_phases(self):
+        return max(ts.get_num_phases() for ts in self.tilesets)
+
+    def get_phase_length(self, phase):
+        if phase == 1:
+            return sum(len(ts._optimize_batches) for ts in self.tilesets
+                       if ts.get_num_phases() > 1)
+        length = self._get_tiles_phase_length(phase)
+        if any(ts._get_optimizemode() == "background" for ts in self.tilesets):
+            length += -(-length // OptimizeBatcher.batchsize)
+        return length
+
+    def _get_tiles_phase_length(self, phase):
+        # A check-tiles member doesn't know its length until it's iterated,
+        # use its estimate instead
+        checked = [ts.get_phase_length(phase) for ts in self.tilesets
+                   if ts.options['renderchecks'] == 1]
+        if checked:
+            return max(checked)
+        return self._get_dirtytree().count_all()
+
+    def _get_dirtytree(self):
+        """Returns the union of all members' dirty trees."""
+        dirtytree = RendertileSet(self.treedepth)
+        for ts in self.tilesets:
+            if ts.options['renderchecks'] != 3:
+                for path in ts.dirtytree:
+                    dirtytree.add(path)
+        return dirtytree
+
+    def iterate_work_items(self, phase):
+        """Iterates over the union of the tiles the members need rendered,
+        in post-traversal order. Each work item is a GroupWorkItem listing the
+        members that need it.
+
+        The members' OptimizeWorkItems are handed out as in
+        TileSet.iterate_work_items(), tagged with the index of their member.
+
+        """
+        if phase == 1:
+            for ts in self.tilesets:
+                if ts.get_num_phases() > 1:
+                    for batch in ts._optimize_batches:
+                        yield batch, []
+            return
+
+        batchers = {}
+        for i, ts in enumerate(self.tilesets):
+            if ts._get_optimizemode() != "inline":
+                batchers[i] = OptimizeBatcher(ts, i)
+                ts._optimize_batches = []
+
+        def get_batches(flush=False):
+            for i, batcher in batchers.items():
+                for batch in batcher.get_batches(flush):
+                    if self.tilesets[i]._get_optimizemode() == "background":
+                        yield batch, batch.dependencies
+                    else:
+                        self.tilesets[i]._optimize_batches.append(batch)
+
+        for workitem, dependencies in self._iterate_tiles(phase):
+            yield workitem, dependencies
+            for i in workitem.members:
+                if i in batchers:
+                    batchers[i].add(workitem, [tuple(workitem)])
+            yield from get_batches()
+        yield from get_batches(flush=True)
+
+    def _iterate_tiles(self, phase):
+        """Does the work of iterate_work_items(), without the optimizers.
+        """
+        # Members in check-tiles mode decide which tiles to render as they
+        # are iterated, so collect their answers first. For the others, the
+        # dirty tree is authoritative (see the note at the top of this file)
+        needed = []
+        for ts in self.tilesets:
+            if ts.options['renderchecks'] in (0, 2):
+                needed.append(None)
+            else:
+                needed.append(set(path for path, _ in ts._iterate_tiles(phase)))
+
+        for tilepath in self._get_dirtytree().posttraversal(robin=True):
+            members = []
+            for i, ts in enumerate(self.tilesets):
+                if needed[i] is None:
+                    if not ts.dirtytree.query_path(tilepath):
+                        continue
+                    if ts.options.get("changelist", None):
+                        ts._write_changelist(tilepath)
+                elif tilepath not in needed[i]:
+                    continue
+                members.append(i)
+
+            if members:
+                dependencies = [tilepath + (i,) for i in range(4)]
+                yield GroupWorkItem(tilepath, tuple(members)), dependencies
+
+    def do_work(self, workitem):
+        """Renders the given tile for every member listed in the work item.
+
+        """
+        if isinstance(workitem, OptimizeWorkItem):
+            return self.tilesets[workitem.member].do_work(workitem)
+
+        tilesets = [self.tilesets[i] for i in workitem.members]
+        if len(workitem) == self.treedepth:
+            # Render-tiles share the chunk loading
+            tilesets[0]._render_rendertile(RenderTile.from_path(workitem), tilesets[1:])
+        else:
+            # Composite-tiles have nothing to share
+            for ts in tilesets:
+                ts._render_tile(tuple(workitem))
+        return collect_writes()
+
+
+class TileWriter(object):
+    """A small pool of threads that encode, optimize and write out finished
+    tiles, so the worker process can go on rendering the next tile meanwhile.
+    Pillow releases the GIL while encoding, and the optimizers are external
+    programs, so this overlaps well with the rendering.
+
+    At most twice as many tiles as there are threads are queued up; submit()
+    blocks when the queue is full, so a slow disk can't make the worker pile
+    up images in memory.
+
+    """
+
+    def __init__(self, threads):
+        self.pool = ThreadPoolExecutor(threads)
+        self.slots = threading.BoundedSemaphore(threads * 2)
+
+    def submit(self, func, *args):
+        self.slots.acquire()
+        try:
+            future = self.pool.submit(func, *args)
+        except Exception:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda f: self.slots.release())
+        _pending_writes.append(future)
+        return future
+
+
+# One TileWriter per thread count per process, created on first use. They are
+# never pickled: a worker process makes its own.
+_writers = {}
+# Writes submitted since the last call to collect_writes()
+_pending_writes = []
+
+
+def _get_writer(threads):
+    if threads not in _writers:
+        _writers[threads] = TileWriter(threads)
+    return _writers[threads]
+
+
+def collect_writes():
+    """Returns a Future that is done once all the tiles submitted to a
+    TileWriter since the last call have been written, or None if there were
+    none. do_work() returns this, so the dispatcher only considers a job
+    finished (and starts the jobs that depend on it) once its tiles are on
+    disk.
+
+    """
+    if not _pending_writes:
+        return None
+    futures = list(_pending_writes)
+    del _pending_writes[:]
+
+    done = Future()
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def finished(f):
+        with lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last:
+            for write in futures:
+                if write.exception() is not None:
+                    done.set_exception(write.exception())
+                    return
+            done.set_result(None)
+    for f in futures:
+        f.add_done_callback(finished)
+    return done
+
+
+def group_tilesets(tilesets):
+    """Returns a list of workers for the dispatcher that renders the given
+    TileSets, with each set of TileSets that share a RegionSet object
+    combined into a single TileSetGroup. The TileSets of a group must also
+    have the same tree depth and tile size.
+
+    """
+    groups = []
+    for ts in tilesets:
+        for group in groups:
+            if group[0].regionset is ts.regionset and group[0].treedepth == ts.treedepth \
+                    and group[0].tilesize == ts.tilesize:
+                group.append(ts)
+                break
+        else:
+            groups.append([ts])
+
+    return [TileSetGroup(group) if len(group) > 1 else group[0] for group in groups]
 
 
 #
@@ -39,6 +39,22 @@ def get_program_path():
             return os.path.dirname(sys.argv[0])
 
 
+def get_cache_dir():
+    """Returns the directory to keep Overviewer's caches in for the current
+    user, like the generated textures. It may not exist yet.
+
+    """
+    if sys.platform.startswith("win"):
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser(
+            os.path.join("~", "AppData", "Local"))
+        return os.path.join(base, "Minecraft Overviewer", "Cache")
+    if sys.platform.startswith("darwin"):
+        return os.path.expanduser(os.path.join("~", "Library", "Caches",
+                                               "Minecraft Overviewer"))
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser(os.path.join("~", ".cache"))
+    return os.path.join(base, "minecraft-overviewer")
+
+
 def findGitHash():
     try:
         p = Popen('git rev-parse HEAD', stdout=PIPE, stderr=PIPE, shell=True)
@@ -14,6 +14,7 @@
 #    with the Overviewer.  If not, see <http://www.gnu.org/licenses/>.
 
 import functools
+import hashlib
 import os
 import os.path
 import logging
@@ -280,18 +281,15 @@ class RegionSet(object):
 
         logging.debug("Scanning regions.  Type is %r" % self.type)
 
-        # This is populated below. It is a mapping from (x,y) region coords to filename
-        self.regionfiles = {}
-
         # This holds a cache of open regionfile objects
         self.regioncache = cache.LRUCache(size=16, destructor=lambda regionobj: regionobj.close())
 
-        for x, y, regionfile in self._iterate_regionfiles():
-            # regionfile is a pathname
-            if os.path.getsize(regionfile) != 0:
-                self.regionfiles[(x,y)] = (regionfile, os.path.getmtime(regionfile))
-            else:
-                logging.debug("Skipping zero-size region file {}".format(regionfile))
+        # A mapping from (x,y) region coords to (filename, mtime)
+        self.regionfiles = self._scan_regionfiles()
+
+        # Bumped every time refresh() finds changes, so anything that caches
+        # chunks from this regionset can tell when to drop them
+        self.version = 0
 
         self.empty_chunk = [None,None]
         logging.debug("Done scanning regions")
@@ -1558,6 +1556,66 @@ class RegionSet(object):
             for chunkx, chunky in mcr.get_chunks():
                 yield chunkx+32*regionx, chunky+32*regiony, mcr.get_chunk_timestamp(chunkx, chunky)
 
+    def get_chunk_fingerprint(self, x, z):
+        """Returns a hash of the parts of the chunk that affect how it's
+        rendered: the sections, biomes and status. Minecraft saves chunks
+        (bumping their timestamp) when only entities or tick counters changed,
+        this can tell those apart from real changes.
+
+        Returns None if the chunk doesn't exist or can't be read.
+
+        """
+        regionfile = self._get_region_path(x, z)
+        if regionfile is None:
+            return None
+        try:
+            data = self._get_regionobj(regionfile).load_chunk(x, z)
+        except nbt.CorruptionError:
+            return None
+        if data is None:
+            return None
+
+        level = data[1].get('Level', {})
+        h = hashlib.blake2b(digest_size=16)
+        _hash_nbt(h, [data[1].get('DataVersion', 0), level.get('Status', ""),
+                      level.get('Biomes', b""), level.get('Sections', [])])
+        return h.digest()
+
+    def get_chunk_blockids(self, x, z):
+        """Returns the set of block ids used in the given chunk. For chunks
+        with palettes these come straight from the palettes, without
+        unpacking the block arrays. This is for the prescan texture
+        generation option.
+
+        Returns an empty set if the chunk doesn't exist or can't be read.
+
+        """
+        regionfile = self._get_region_path(x, z)
+        if regionfile is None:
+            return set()
+        try:
+            data = self._get_regionobj(regionfile).load_chunk(x, z)
+        except nbt.CorruptionError:
+            return set()
+        if data is None:
+            return set()
+
+        blockids = set()
+        for section in data[1].get('Level', {}).get('Sections', []):
+            if 'Palette' in section:
+                for entry in section['Palette']:
+                    try:
+                        blockids.add(int(self._get_block(entry)[0]))
+                    except KeyError:
+                        pass
+            elif 'Blocks' in section and 'Data' in section:
+                try:
+                    blocks = self._get_blockdata_v112(section)[0]
+                except ValueError:
+                    continue
+                blockids.update(int(b) for b in numpy.unique(blocks))
+        return blockids
+
     def get_chunk_mtime(self, x, z):
         """Returns a chunk's mtime, or False if the chunk does not exist.  This
         is therefore a dual purpose method. It corrects for the given north
@@ -1586,6 +1644,55 @@ class RegionSet(object):
         (regionfile,filemtime) = self.regionfiles.get((chunkX//32, chunkY//32),(None, None))
         return regionfile
 
+    def refresh(self):
+        """Scans the region directory again, for region files that were
+        added, changed or removed since this RegionSet was created or last
+        refreshed. Changed regions are dropped from the region cache, so their
+        headers are read again; the others stay loaded.
+
+        Returns a tuple (changed, layout_changed): the set of (x, z)
+        coordinates of the regions that changed, and whether any region was
+        added or removed, which may change the size of the map.
+
+        """
+        regionfiles = self._scan_regionfiles()
+        changed = set()
+        for coords in set(regionfiles) | set(self.regionfiles):
+            old = self.regionfiles.get(coords)
+            if regionfiles.get(coords) == old:
+                continue
+            changed.add(coords)
+            if old is not None:
+                try:
+                    del self.regioncache[old[0]]
+                except KeyError:
+                    pass
+
+        layout_changed = regionfiles.keys() != self.regionfiles.keys()
+        self.regionfiles = regionfiles
+        if changed:
+            self.version += 1
+            logging.debug("%d region files changed in %s", len(changed), self.regiondir)
+        return changed, layout_changed
+
+    def _scan_regionfiles(self):
+        """Returns a mapping from (x,y) region coords to (filename, mtime)
+        for all the region files with anything in them.
+
+        """
+        regionfiles = {}
+        for x, y, regionfile in self._iterate_regionfiles():
+            # regionfile is a pathname
+            try:
+                if os.path.getsize(regionfile) != 0:
+                    regionfiles[(x,y)] = (regionfile, os.path.getmtime(regionfile))
+                else:
+                    logging.debug("Skipping zero-size region file {}".format(regionfile))
+            except OSError:
+                # removed since it was listed
+                pass
+        return regionfiles
+
     def _iterate_regionfiles(self):
         """Returns an iterator of all of the region files, along with their
         coordinates
@@ -1603,6 +1710,31 @@ class RegionSet(object):
                     logging.warning("Holy shit what is up with region file %s !?" % f)
                 yield (x, y, os.path.join(self.regiondir, f))
 
+def _hash_nbt(h, value):
+    """Feeds the given NBT value into the hash object h, in a way that doesn't
+    depend on the order of compound tags.
+
+    """
+    if isinstance(value, dict):
+        h.update(b"{")
+        for key in sorted(value):
+            h.update(key.encode("utf-8") + b":")
+            _hash_nbt(h, value[key])
+        h.update(b"}")
+    elif isinstance(value, list):
+        h.update(b"[")
+        for item in value:
+            _hash_nbt(h, item)
+        h.update(b"]")
+    elif isinstance(value, tuple):
+        # int and long arrays, hashed all at once
+        h.update(b"(%d:" % len(value) + repr(value).encode("ascii"))
+    elif isinstance(value, bytes):
+        h.update(b"b%d:" % len(value) + value)
+    else:
+        h.update(repr(value).encode("utf-8") + b",")
+
+
 class RegionSetWrapper(object):
     """This is the base class for all "wrappers" of RegionSet objects. A
     wrapper is an object that acts similarly to a subclass: some methods are
@@ -1648,6 +1780,12 @@ class RegionSetWrapper(object):
         return self._r.iterate_newer_chunks(filemtime)
     def get_chunk_mtime(self, x, z):
         return self._r.get_chunk_mtime(x,z)
+    def get_chunk_fingerprint(self, x, z):
+        return self._r.get_chunk_fingerprint(x,z)
+    def get_chunk_blockids(self, x, z):
+        return self._r.get_chunk_blockids(x,z)
+    def refresh(self):
+        return self._r.refresh()
 
 # see RegionSet.rotate.  These values are chosen so that they can be
 # passed directly to rot90; this means that they're the number of
@@ -1732,6 +1870,14 @@ class RotatedRegionSet(RegionSetWrapper):
         x,z = self.unrotate(x,z)
         return super(RotatedRegionSet, self).get_chunk_mtime(x, z)
 
+    def get_chunk_fingerprint(self, x, z):
+        x,z = self.unrotate(x,z)
+        return super(RotatedRegionSet, self).get_chunk_fingerprint(x, z)
+
+    def get_chunk_blockids(self, x, z):
+        x,z = self.unrotate(x,z)
+        return super(RotatedRegionSet, self).get_chunk_blockids(x, z)
+
     def iterate_chunks(self):
         for x,z,mtime in super(RotatedRegionSet, self).iterate_chunks():
             x,z = self.rotate(x,z)
@@ -1805,6 +1951,8 @@ class CachedRegionSet(RegionSetWrapper):
             s += obj.__class__.__name__ + "."
             obj = obj._r
         # obj should now be the actual RegionSet object
+        self._base = obj
+        self._version = getattr(obj, "version", 0)
         try:
             s += obj.regiondir
         except AttributeError:
@@ -1815,6 +1963,16 @@ class CachedRegionSet(RegionSetWrapper):
         self.key = s
 
     def get_chunk(self, x, z):
+        version = getattr(self._base, "version", 0)
+        if version != self._version:
+            # Region files changed since these chunks were cached. Which of
+            # them are out of date isn't known here, so forget them all.
+            for cache in self.caches:
+                for key in cache:
+                    if key[0] == self.key:
+                        del cache[key]
+            self._version = version
+
         key = (self.key, x, z)
         for i, cache in enumerate(self.caches):
             try:
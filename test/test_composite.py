@@ -0,0 +1,80 @@
+import unittest
+import random
+
+from PIL import Image
+
+from overviewer_core import c_overviewer
+
+
+def random_image(rand, mode, size, alphas=None):
+    """Returns an image of random pixels. If alphas is given, the alpha
+    channel (or the whole image, for "L") is drawn from it instead.
+
+    """
+    channels = len(mode)
+    data = bytearray(rand.getrandbits(8) for _ in range(size[0] * size[1] * channels))
+    if alphas is not None:
+        for i in range(channels - 1, len(data), channels):
+            data[i] = rand.choice(alphas)
+    return Image.frombytes(mode, size, bytes(data))
+
+
+class CompositeTest(unittest.TestCase):
+    """Checks that every set of vectorized compositing kernels gives exactly
+    the same output as the plain C ones.
+
+    """
+    # alpha values that hit the opaque / transparent shortcuts, mixed in
+    # with ones that need the general case
+    shortcut_alphas = [0, 0, 0, 255, 255, 255, 17, 128]
+
+    def setUp(self):
+        self.default_impl = c_overviewer.composite_impl()
+        self.impls = [i for i in c_overviewer.composite_impls() if i != "scalar"]
+        self.rand = random.Random(1234)
+
+    def tearDown(self):
+        c_overviewer.set_composite_impl(self.default_impl)
+
+    def compare(self, func):
+        c_overviewer.set_composite_impl("scalar")
+        expected = func().tobytes()
+        for impl in self.impls:
+            c_overviewer.set_composite_impl(impl)
+            self.assertEqual(func().tobytes(), expected, "%s differs from scalar" % impl)
+
+    def test_scalar_always_available(self):
+        self.assertIn("scalar", c_overviewer.composite_impls())
+        self.assertRaises(ValueError, c_overviewer.set_composite_impl, "no-such-kernels")
+
+    def test_alpha_over(self):
+        for _ in range(50):
+            size = (self.rand.randint(1, 70), self.rand.randint(1, 8))
+            destsize = (self.rand.randint(1, 90), self.rand.randint(1, 10))
+            pos = (self.rand.randint(-10, 20), self.rand.randint(-4, 6))
+            overall = self.rand.choice([1.0, 1.0, 0.5, 0.1, 0.99])
+            alphas = self.rand.choice([None, self.shortcut_alphas])
+            dest = random_image(self.rand, "RGBA", destsize, alphas)
+            src = random_image(self.rand, self.rand.choice(["RGBA", "RGB"]), size, alphas)
+            mask = random_image(self.rand, self.rand.choice(["RGBA", "L"]), size, alphas)
+
+            def blend():
+                out = dest.copy()
+                c_overviewer.alpha_over(out, src, pos, mask, overall)
+                return out
+            self.compare(blend)
+
+    def test_resize_half(self):
+        for _ in range(50):
+            size = (self.rand.randint(2, 140), self.rand.randint(2, 12))
+            src = random_image(self.rand, self.rand.choice(["RGBA", "RGB"]), size)
+
+            def resize():
+                out = Image.new("RGBA", (size[0] // 2, size[1] // 2))
+                c_overviewer.resize_half(out, src)
+                return out
+            self.compare(resize)
+
+
+if __name__ == "__main__":
+    unittest.main()
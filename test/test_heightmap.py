@@ -0,0 +1,93 @@
+import unittest
+from collections import defaultdict
+
+import numpy
+from PIL import Image
+
+from overviewer_core import heightmap, rendermodes, textures
+
+
+class FakeTextures(object):
+    texture_size = 24
+
+    def __init__(self):
+        self.blockmap = defaultdict(lambda: None)
+        for blockid, color in [(1, (100, 100, 100, 255)), (2, (200, 200, 200, 255))]:
+            sprite = Image.new("RGBA", (24, 24), color)
+            self.blockmap[blockid * textures.max_data] = (sprite, sprite.split()[3])
+
+    def load_grass_color(self):
+        return [(0, 255, 0, 255)] * (256 * 256)
+
+    def load_foliage_color(self):
+        return [(0, 0, 255, 255)] * (256 * 256)
+
+    def load_water_color(self):
+        return [(0, 0, 255, 255)] * (256 * 256)
+
+
+def make_section(y, blocks):
+    return {'Y': y, 'Blocks': blocks, 'Data': numpy.zeros((16, 16, 16), dtype=numpy.uint8),
+            'SkyLight': numpy.full((16, 16, 16), 15, dtype=numpy.uint8),
+            'BlockLight': numpy.zeros((16, 16, 16), dtype=numpy.uint8)}
+
+
+class HeightmapTest(unittest.TestCase):
+    def setUp(self):
+        # Stone up to y=63, with grass on top at x=3, z=5 and nothing at x=0, z=0
+        lower = numpy.ones((16, 16, 16), dtype=numpy.uint16)
+        upper = numpy.zeros((16, 16, 16), dtype=numpy.uint16)
+        upper[15, 5, 3] = 2
+        lower[:, 0, 0] = 0
+        upper[15, 0, 0] = 0
+        self.chunk = {'Sections': [make_section(2, lower.copy()), make_section(3, upper)]}
+
+    def test_columns(self):
+        renderer = heightmap.HeightmapRenderer(rendermodes.Heightmap(shading="none"),
+                                               FakeTextures())
+        blocks, data, height, light = renderer.get_columns(self.chunk)
+        self.assertEqual(blocks[5, 3], 2)
+        self.assertEqual(height[5, 3], 63)
+        self.assertEqual(blocks[1, 1], 1)
+        self.assertEqual(height[1, 1], 47)
+        self.assertEqual(height[0, 0], -1)
+        self.assertEqual(light[1, 1], 15)
+
+        img = renderer.get_chunk_image(self.chunk)
+        self.assertEqual(img.getpixel((1, 1)), (100, 100, 100, 255))
+        # Grass is tinted with the grass color
+        self.assertEqual(img.getpixel((3, 5)), (0, 200, 0, 255))
+        self.assertEqual(img.getpixel((0, 0))[3], 0)
+
+    def test_shading(self):
+        renderer = heightmap.HeightmapRenderer(rendermodes.Heightmap(), FakeTextures())
+        img = renderer.get_chunk_image(self.chunk)
+        # Lower blocks are darker
+        self.assertLess(img.getpixel((1, 1))[0], 100)
+
+    def test_render_chunk(self):
+        class FakeRegionSet(object):
+            def get_chunk(regionset, x, z):
+                return self.chunk
+
+        renderer = heightmap.HeightmapRenderer(rendermodes.Heightmap(shading="none"),
+                                               FakeTextures())
+        img = Image.new("RGBA", (384, 384), (0, 0, 0, 0))
+        renderer.render_chunk(FakeRegionSet(), 0, 3, 0, img, 0, 0)
+        self.assertIsNone(img.getbbox())
+
+        renderer.render_chunk(FakeRegionSet(), 0, 4, 0, img, 0, 0)
+        # The chunk is a diamond in the plane of the top faces at y=64
+        top = 8 * 24 - 24 // 2
+        bbox = img.getbbox()
+        self.assertEqual((bbox[1], bbox[3]), (top, top + 192))
+        self.assertEqual(img.getpixel((192, top + 96)), (100, 100, 100, 255))
+        # x=0, z=0 is the left corner, and empty
+        self.assertEqual(img.getpixel((2, top + 96))[3], 0)
+        # x=3, z=5 is the grass
+        self.assertEqual(img.getpixel((12 * (3 + 5 + 1), top + 6 * (5 - 3 + 16))),
+                         (0, 200, 0, 255))
+
+
+if __name__ == "__main__":
+    unittest.main()
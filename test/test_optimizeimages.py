@@ -0,0 +1,45 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from PIL import Image
+
+from overviewer_core.optimizeimages import pilquantize
+
+
+class PilQuantizeTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="OVTEST")
+        self.imgpath = os.path.join(self.tmpdir, "0.png")
+
+        # a tile with a transparent half and a few hundred colors
+        img = Image.new("RGBA", (384, 384), (0, 0, 0, 0))
+        for x in range(192):
+            for y in range(0, 384, 4):
+                img.putpixel((x, y), (x, y // 2, 100, 255))
+        img.save(self.imgpath)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_quantize(self):
+        for dither in ("n", "f"):
+            pilquantize(colors=64, dither=dither).optimize(self.imgpath)
+            img = Image.open(self.imgpath)
+            self.assertEqual(img.mode, "P")
+            self.assertTrue(len(img.getcolors()) <= 64)
+
+            img = img.convert("RGBA")
+            self.assertEqual(img.getpixel((300, 300)), (0, 0, 0, 0))
+            self.assertEqual(img.getpixel((10, 0))[3], 255)
+        self.assertFalse(os.path.exists(self.imgpath + ".tmp"))
+
+    def test_bad_options(self):
+        self.assertRaises(Exception, pilquantize, colors=1)
+        self.assertRaises(Exception, pilquantize, colors=257)
+        self.assertRaises(Exception, pilquantize, dither="x")
+
+
+if __name__ == "__main__":
+    unittest.main()
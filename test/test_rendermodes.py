@@ -0,0 +1,189 @@
+import os.path
+import types
+import unittest
+
+import numpy
+from PIL import Image
+
+from overviewer_core import c_overviewer, rendermodes, textures, world
+
+DATADIR = os.path.join(os.path.dirname(__file__), "data", "rendermodes")
+
+# Set this to write the golden images again, after a change that's meant to
+# change the output
+UPDATE_GOLDEN = os.environ.get("OVERVIEWER_UPDATE_GOLDEN")
+
+# A world seed that makes chunk 0,0 a slime chunk
+SLIME_SEED = 7
+
+
+class FakeTextures(object):
+    """Plain colored block sprites for the blocks in make_world()"""
+    texture_size = 24
+    blockmap = None
+
+    def __init__(self):
+        if FakeTextures.blockmap is None:
+            blockmap = [None] * (textures.max_blockid * textures.max_data)
+            for blockid, color in [(1, (128, 128, 128, 255)), (4, (100, 100, 100, 255)),
+                                   (27, (200, 150, 0, 255)), (28, (150, 100, 50, 255)),
+                                   (66, (120, 90, 60, 255)), (157, (180, 40, 40, 255))]:
+                sprite = Image.new("RGBA", (24, 24), color)
+                blockmap[blockid * textures.max_data] = (sprite, sprite.split()[3])
+            FakeTextures.blockmap = blockmap
+
+
+class FakeRegionSet(object):
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def get_chunk(self, x, z):
+        try:
+            return self.chunks[x, z]
+        except KeyError:
+            raise world.ChunkDoesntExist("Chunk %s,%s doesn't exist" % (x, z))
+
+
+def make_chunk(blocks):
+    """Returns a chunk like RegionSet.get_chunk() does, from an array of block
+    ids indexed [y, z, x]"""
+    sections = []
+    for y in range(blocks.shape[0] // 16):
+        sections.append({
+            'Y': y,
+            'Blocks': numpy.ascontiguousarray(blocks[y * 16:(y + 1) * 16], dtype=numpy.uint16),
+            'Data': numpy.zeros((16, 16, 16), dtype=numpy.uint8),
+            'SkyLight': numpy.full((16, 16, 16), 15, dtype=numpy.uint8),
+            'BlockLight': numpy.zeros((16, 16, 16), dtype=numpy.uint8),
+        })
+    return {'Sections': sections, 'Biomes': numpy.zeros((16, 16), dtype=numpy.uint8),
+            'NewBiomes': False}
+
+
+def make_world(seed, light=False):
+    """Returns a FakeRegionSet of 3x3 chunks (less the one at 1,1) of two
+    sections each, with random stone, cobblestone, rails and slabs. With
+    light, the sky and block light is random too."""
+    rand = numpy.random.RandomState(seed)
+    chunks = {}
+    for chunkx in (-1, 0, 1):
+        for chunkz in (-1, 0, 1):
+            if (chunkx, chunkz) == (1, 1):
+                continue
+            blocks = numpy.zeros((32, 16, 16), dtype=numpy.uint16)
+            blocks[:4] = rand.choice([1, 1, 1, 4], size=(4, 16, 16))
+            blocks[4:20] = rand.choice([0] * 6 + [1, 4, 4, 66, 27, 28, 157], size=(16, 16, 16))
+            chunk = make_chunk(blocks)
+            if light:
+                for section in chunk['Sections']:
+                    section['SkyLight'] = rand.randint(0, 16, size=(16, 16, 16)).astype(numpy.uint8)
+                    section['BlockLight'] = rand.randint(0, 9,
+                                                         size=(16, 16, 16)).astype(numpy.uint8)
+            chunks[chunkx, chunkz] = chunk
+    return FakeRegionSet(chunks)
+
+
+class RenderModeTest(unittest.TestCase):
+    """Renders a small random world with a few rendermodes, and compares the
+    output with the golden images in test/data/rendermodes.
+
+    """
+    def render(self, rendermode, seed=1, light=False, world=None, regionset=None):
+        if regionset is None:
+            regionset = make_world(seed, light)
+        tex = FakeTextures()
+        img = Image.new("RGBA", (384, 576), (0, 0, 0, 0))
+        for chunky in (0, 1):
+            c_overviewer.render_loop(world, regionset, 0, chunky, 0, img, 0, (1 - chunky) * 192,
+                                     rendermode, tex)
+        return img
+
+    def check_golden(self, name, img):
+        path = os.path.join(DATADIR, name + ".png")
+        if UPDATE_GOLDEN:
+            img.save(path)
+        golden = Image.open(path)
+        self.assertEqual(golden.mode, img.mode)
+        self.assertEqual(golden.size, img.size)
+        self.assertTrue(golden.tobytes() == img.tobytes(), "%s differs from %s" % (name, path))
+
+    def test_structure_overlay(self):
+        img = self.render([rendermodes.ClearBase(), rendermodes.StructureOverlay()])
+        self.assertIsNotNone(img.getbbox())
+        self.check_golden("overlay-structure", img)
+
+    def test_structure_overlay_options(self):
+        structures = [
+            # reaching into the neighbouring chunks, and below
+            (((0, 0, 0, 66), (1, 0, 0, 4), (0, -1, -1, 1)), (255, 0, 0, 255)),
+            (((0, -2, 0, 28), (0, 0, 0, 4), (-1, 0, 0, 157)), (255, 255, 0, 128)),
+            # air above
+            (((0, 1, 0, 0), (0, 0, 0, 27)), (0, 0, 255, 200)),
+            (((0, 0, 0, 157),), (255, 0, 255, 255)),
+            (((0, 0, 0, 66), (0, -1, 0, 4)), (0, 255, 0, 100)),
+            # no conditions, but not first: never matches
+            ((), (0, 255, 255, 255)),
+        ]
+        img = self.render([rendermodes.ClearBase(),
+                           rendermodes.StructureOverlay(structures=structures)], seed=2)
+        self.check_golden("overlay-structure-options", img)
+
+    def test_mineral_overlay(self):
+        minerals = [(157, (255, 0, 0)), (4, (0, 255, 0)), (28, (0, 0, 255))]
+        img = self.render([rendermodes.ClearBase(), rendermodes.MineralOverlay(minerals=minerals)])
+        self.check_golden("overlay-mineral", img)
+
+    def test_spawn_overlay(self):
+        img = self.render([rendermodes.ClearBase(), rendermodes.SpawnOverlay()], light=True)
+        self.assertIsNotNone(img.getbbox())
+        self.check_golden("overlay-spawn", img)
+
+    def test_slime_overlay(self):
+        # chunk 0,0 is a slime chunk with this seed, but not with seed 1
+        img = self.render([rendermodes.ClearBase(), rendermodes.SlimeOverlay()],
+                          world=types.SimpleNamespace(seed=SLIME_SEED))
+        self.assertIsNotNone(img.getbbox())
+        self.check_golden("overlay-slime", img)
+        img = self.render([rendermodes.ClearBase(), rendermodes.SlimeOverlay()],
+                          world=types.SimpleNamespace(seed=1))
+        self.assertIsNone(img.getbbox())
+
+    def test_smooth_lighting(self):
+        img = self.render([rendermodes.Base(), rendermodes.SmoothLighting(strength=0.8)],
+                          light=True)
+        self.check_golden("smooth-lighting", img)
+
+    def test_cave(self):
+        regionset = make_world(1, light=True)
+        # cave mode hides everything next to skylight, so make it dark below
+        # y=28
+        for chunk in regionset.chunks.values():
+            chunk['Sections'][0]['SkyLight'][:] = 0
+            chunk['Sections'][1]['SkyLight'][:12] = 0
+        img = self.render([rendermodes.Base(), rendermodes.Cave(), rendermodes.Lighting()],
+                          regionset=regionset)
+        self.assertIsNotNone(img.getbbox())
+        self.check_golden("cave", img)
+
+    def test_exposed(self):
+        img = self.render([rendermodes.Base(), rendermodes.Exposed(), rendermodes.EdgeLines()])
+        self.check_golden("exposed", img)
+        img = self.render([rendermodes.Base(), rendermodes.Exposed(mode=1)])
+        self.check_golden("exposed-inverted", img)
+
+    def test_mineral_summary(self):
+        blocks = numpy.zeros((32, 16, 16), dtype=numpy.uint16)
+        blocks[3, 5, 2] = 4
+        blocks[20, 5, 2] = 157
+        blocks[25, 5, 2] = 4
+        regionset = FakeRegionSet({(0, 0): make_chunk(blocks)})
+        overlay = rendermodes.MineralOverlay()
+        best, lowest = overlay.get_mineral_summary(regionset, 0, 0, (157, 4))
+        self.assertEqual(list(lowest[:, 5, 2]), [20, 3])
+        self.assertEqual(lowest[0, 0, 0], 0xffff)
+        self.assertEqual([best[y, 5, 2] for y in (2, 3, 19, 20, 256)], [255, 1, 1, 0, 0])
+        self.assertIs(overlay.get_mineral_summary(regionset, 0, 0, (157, 4))[0], best)
+
+
+if __name__ == "__main__":
+    unittest.main()
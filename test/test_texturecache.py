@@ -0,0 +1,165 @@
+import unittest
+import tempfile
+import shutil
+import os.path
+import pickle
+from unittest import mock
+
+from PIL import Image
+
+from overviewer_core import texturecache, textures
+
+
+class TextureCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix="OVTEST")
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_roundtrip(self):
+        sprite = Image.new("RGBA", (24, 24), (10, 20, 30, 40))
+        sprite.putpixel((3, 5), (255, 0, 0, 255))
+        mask = sprite.split()[3]
+        blockmap = [None, (sprite, mask), None, (mask.convert("RGBA"), mask)]
+        colormap = Image.new("RGBA", (4, 2), (1, 2, 3, 4))
+        path = os.path.join(self.tempdir, "test.atlas")
+        texturecache.save_atlas(path, blockmap, {'colormap': colormap})
+
+        loaded, images = texturecache.load_atlas(path)
+        self.assertEqual(len(loaded), len(blockmap))
+        self.assertEqual(loaded[0], None)
+        self.assertEqual(loaded[2], None)
+        for expected, tex in zip(blockmap, loaded):
+            if expected is None:
+                continue
+            for expectedimg, img in zip(expected, tex):
+                self.assertEqual(img.mode, expectedimg.mode)
+                self.assertEqual(img.size, expectedimg.size)
+                self.assertEqual(img.tobytes(), expectedimg.tobytes())
+        self.assertEqual(images['colormap'].tobytes(), colormap.tobytes())
+
+    def test_placeholders(self):
+        sprite = Image.new("RGBA", (24, 24), (10, 20, 30, 40))
+        blockmap = [None, textures.LAZY, (sprite, sprite.split()[3])]
+        path = os.path.join(self.tempdir, "test.atlas")
+        texturecache.save_atlas(path, blockmap, {})
+
+        loaded, images = texturecache.load_atlas(path, textures.LAZY)
+        self.assertIsNone(loaded[0])
+        self.assertIs(loaded[1], textures.LAZY)
+        self.assertEqual(loaded[2][0].tobytes(), sprite.tobytes())
+
+    def test_bad_files(self):
+        path = os.path.join(self.tempdir, "test.atlas")
+        self.assertIsNone(texturecache.load_atlas(path))
+        with open(path, "wb") as f:
+            f.write(b"not an atlas")
+        self.assertIsNone(texturecache.load_atlas(path))
+
+        texturecache.save_atlas(path, [(Image.new("L", (8, 8)),)], {})
+        with open(path, "r+b") as f:
+            f.truncate(os.path.getsize(path) - 1)
+        self.assertIsNone(texturecache.load_atlas(path))
+
+    def test_cache_key(self):
+        path = os.path.join(self.tempdir, "texture.png")
+        with open(path, "wb") as f:
+            f.write(b"1234")
+        stats = texturecache.get_source_stats([self.tempdir, None])
+        self.assertEqual([s[:2] for s in stats], [(path, 4)])
+        key = texturecache.get_cache_key(1, stats)
+        self.assertEqual(key, texturecache.get_cache_key(1, stats))
+        self.assertNotEqual(key, texturecache.get_cache_key(2, stats))
+
+    def test_remove_old_atlases(self):
+        old = os.path.join(self.tempdir, "old.atlas")
+        new = os.path.join(self.tempdir, "new.atlas")
+        other = os.path.join(self.tempdir, "other.png")
+        for path in (old, new, other):
+            open(path, "wb").close()
+            os.utime(path, (0, 0))
+        os.utime(new)
+        texturecache.remove_old_atlases(self.tempdir)
+        self.assertEqual(sorted(os.listdir(self.tempdir)), ["new.atlas", "other.png"])
+
+        texturecache.remove_old_atlases(os.path.join(self.tempdir, "missing"))
+
+    def test_generate_cached(self):
+        """Tests that generate() loads the textures from the atlas with its
+        cache key, keeps that atlas, and removes atlases not used for long
+
+        """
+        sprite = Image.new("RGBA", (24, 24), (10, 20, 30, 40))
+        blockmap = [None] * (textures.max_blockid * textures.max_data)
+        blockmap[5] = (sprite, sprite.split()[3])
+        images = dict((name, Image.new("RGBA", (4, 4))) for name in textures.Textures._colormaps)
+        images['biome_grass_texture'] = sprite
+        path = os.path.join(self.tempdir, "key.atlas")
+        texturecache.save_atlas(path, blockmap, images)
+        stale = os.path.join(self.tempdir, "stale.atlas")
+        shutil.copy(path, stale)
+        os.utime(path, (0, 0))
+        os.utime(stale, (0, 0))
+
+        tex = textures.Textures(cachedir=self.tempdir, lazy=True)
+        with mock.patch.object(textures.Textures, "get_cache_key", return_value="key"), \
+                mock.patch.object(textures.Textures, "_generate_base",
+                                  side_effect=AssertionError("_generate_base() was called")):
+            tex.generate()
+        self.assertEqual(tex.blockmap[5][0].tobytes(), sprite.tobytes())
+        self.assertEqual(os.listdir(self.tempdir), ["key.atlas"])
+
+    def test_pickle(self):
+        """Tests that unpickled Textures load the sprites from an atlas file
+        instead of generating them again
+
+        """
+        tex = textures.Textures()
+        sprite = Image.new("RGBA", (24, 24), (10, 20, 30, 40))
+        tex.blockmap = [None] * (textures.max_blockid * textures.max_data)
+        tex.blockmap[5] = tex.generate_texture_tuple(sprite)
+        tex.biome_grass_texture = sprite
+        for name, filename in tex._colormaps.items():
+            tex.texture_cache[filename] = Image.new("RGBA", (4, 4), (1, 2, 3, 4))
+        tex.generated = True
+
+        state = pickle.dumps(tex)
+        self.assertTrue(os.path.isfile(tex.atlaspath))
+        self.addCleanup(os.remove, tex.atlaspath)
+
+        with mock.patch.object(textures.Textures, "generate",
+                               side_effect=AssertionError("generate() was called")):
+            copy = pickle.loads(state)
+        self.assertEqual(copy.blockmap[5][0].tobytes(), sprite.tobytes())
+        self.assertEqual(copy.grasscolor, [(1, 2, 3, 4)] * 16)
+
+    def test_lazy(self):
+        """Tests that generate_blocks() only generates the sprites of the
+        given blocks that are still LAZY
+
+        """
+        tex = textures.Textures(lazy=True)
+        sprite = Image.new("RGBA", (24, 24), (10, 20, 30, 40))
+        calls = []
+
+        def texgen(texobj, blockid, data):
+            calls.append((blockid, data))
+            return sprite
+
+        tex.blockmap = [None] * (textures.max_blockid * textures.max_data)
+        tex.blockmap[textures.max_data] = textures.LAZY
+        tex.blockmap[textures.max_data + 1] = textures.LAZY
+        tex.blockmap[2 * textures.max_data] = textures.LAZY
+        with mock.patch.dict(textures.blockmap_generators, {(1, 0): texgen, (1, 1): texgen,
+                                                            (2, 0): texgen}):
+            tex.generate_block(textures.max_data + 1)
+            tex.generate_blocks([1, textures.max_blockid])
+        self.assertEqual(calls, [(1, 1), (1, 0)])
+        self.assertEqual(tex.blockmap[textures.max_data][0].tobytes(), sprite.tobytes())
+        self.assertIs(tex.blockmap[2 * textures.max_data], textures.LAZY)
+        self.assertTrue(tex.unsaved)
+
+
+if __name__ == "__main__":
+    unittest.main()
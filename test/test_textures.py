@@ -0,0 +1,69 @@
+import unittest
+import tempfile
+import shutil
+import os
+import os.path
+import zipfile
+from unittest import mock
+
+from overviewer_core import textures
+
+STONE = "assets/minecraft/textures/block/stone.png"
+DIRT = "assets/minecraft/textures/block/dirt.png"
+
+
+class FindFileTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix="OVTEST")
+        # Two client jars, the latest one has no dirt
+        self.versiondir = os.path.join(self.tempdir, "versions")
+        for version, files in [("1.16.1", [STONE, DIRT]), ("1.16.5", [STONE])]:
+            os.makedirs(os.path.join(self.versiondir, version))
+            jarpath = os.path.join(self.versiondir, version, version + ".jar")
+            with zipfile.ZipFile(jarpath, "w") as jar:
+                for name in files:
+                    jar.writestr(name, version)
+        patcher = mock.patch.object(textures, "get_versiondir", return_value=self.versiondir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def read(self, tex, filename):
+        fileobj = tex.find_file(filename)
+        try:
+            return fileobj.read()
+        finally:
+            fileobj.close()
+
+    def test_jars(self):
+        tex = textures.Textures()
+        self.assertEqual(self.read(tex, STONE), b"1.16.5")
+        self.assertEqual(self.read(tex, DIRT), b"1.16.1")
+        self.assertRaises(textures.TextureException, tex.find_file, "nonexistent.png")
+
+    def test_texturepath(self):
+        packdir = os.path.join(self.tempdir, "pack")
+        os.makedirs(os.path.dirname(os.path.join(packdir, STONE)))
+        with open(os.path.join(packdir, STONE), "wb") as f:
+            f.write(b"pack")
+        # water.png comes with the Overviewer, and takes precedence
+        with open(os.path.join(packdir, "water.png"), "wb") as f:
+            f.write(b"pack")
+
+        tex = textures.Textures(texturepath=packdir)
+        self.assertEqual(self.read(tex, STONE), b"pack")
+        self.assertEqual(self.read(tex, DIRT), b"1.16.1")
+        self.assertNotEqual(self.read(tex, "water.png"), b"pack")
+
+        packpath = os.path.join(self.tempdir, "pack.zip")
+        with zipfile.ZipFile(packpath, "w") as pack:
+            pack.writestr(DIRT, "pack")
+        tex = textures.Textures(texturepath=packpath)
+        self.assertEqual(self.read(tex, STONE), b"1.16.5")
+        self.assertEqual(self.read(tex, DIRT), b"pack")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -5,8 +5,14 @@ from collections import defaultdict
 import os
 import os.path
 import random
+import sqlite3
+from unittest import mock
 
-from overviewer_core import tileset
+from PIL import Image, ImageDraw
+
+from overviewer_core import manifest, optimizeimages, rendermodes, storage, tileset
+from overviewer_core.dispatcher import Dispatcher
+from overviewer_core.observer import Observer
 
 # Supporing data
 # chunks list: chunkx, chunkz mapping to chunkmtime
@@ -45,6 +51,7 @@ chunks = {
 class FakeRegionset(object):
     def __init__(self, chunks):
         self.chunks = dict(chunks)
+        self.fingerprints = {}
 
     def get_chunk(self, x,z):
         return NotImplementedError()
@@ -63,6 +70,9 @@ class FakeRegionset(object):
         except KeyError:
             return None
 
+    def get_chunk_fingerprint(self, x, z):
+        return self.fingerprints.get((x,z))
+
 class FakeAssetmanager(object):
     def __init__(self, lastrendertime):
         self.lrm = lastrendertime
@@ -156,6 +166,28 @@ class TilesetTest(unittest.TestCase):
         ts.do_preprocessing()
         return ts
 
+    def stub_render(self, ts):
+        """Makes the given TileSet save a red tile of its size, with mtime 5,
+        for every render-tile instead of drawing the chunks
+
+        """
+        def render(tile):
+            img = Image.new("RGBA", (ts.tilesize, ts.tilesize), (255, 0, 0, 255))
+            imgpath = tile.get_filepath(ts.outputdir, ts.imgextension)
+            ts.storage.makedirs(os.path.dirname(imgpath))
+            ts._save_tile(img, imgpath, 5)
+            return img, 5
+        ts._render_rendertile = render
+
+    def finish_render(self, ts):
+        """Does what happens to the given TileSet once its render is done:
+        the AssetManager gets its persistent data
+
+        """
+        # The config itself needs more options than the tests set
+        with mock.patch.object(ts, "_get_persistent_data"):
+            ts.get_persistent_data()
+
     def compare_iterate_to_expected(self, ts, chunks):
         """Runs iterate_work_items on the tileset object and compares its
         output to what we'd expect if it was run with the given chunks
@@ -225,6 +257,79 @@ class TilesetTest(unittest.TestCase):
                 lambda ts: setattr(ts, 'last_rendertime', 5))
         self.compare_iterate_to_expected(ts, updated_chunks)
 
+    def test_chunk_fingerprints(self):
+        """Tests that with chunkfingerprints set, chunks that were saved again
+        without changing don't cause tiles to be rendered
+
+        """
+        outputdir = self.get_outputdir()
+        self.rs.fingerprints.update({(0,0): b"a", (2,2): b"b"})
+        self.rs.chunks.update({(0,0): 6, (2,2): 6})
+        ts = self.get_tileset({'renderchecks': 0, 'chunkfingerprints': True}, outputdir,
+                lambda ts: setattr(ts, 'last_rendertime', 5))
+        self.compare_iterate_to_expected(ts, {(0,0): 6, (2,2): 6})
+        self.finish_render(ts)
+
+        # Both saved again, but only one changed
+        self.rs.fingerprints[2,2] = b"c"
+        self.rs.chunks.update({(0,0): 7, (2,2): 7})
+        ts = self.get_tileset({'renderchecks': 0, 'chunkfingerprints': True}, outputdir,
+                lambda ts: setattr(ts, 'last_rendertime', 6))
+        self.compare_iterate_to_expected(ts, {(2,2): 7})
+
+    def test_chunk_fingerprints_failed_render(self):
+        """Tests that the chunk fingerprints are only saved once the render is
+        done, so the chunks of a failed render are still found changed
+
+        """
+        outputdir = self.get_outputdir()
+        options = {'renderchecks': 0, 'chunkfingerprints': True}
+
+        def preprocess(ts):
+            ts.last_rendertime = 5
+
+        self.rs.fingerprints.update({(0, 0): b"a", (2, 2): b"b"})
+        self.rs.chunks.update({(0, 0): 6, (2, 2): 6})
+        ts = self.get_tileset(options, outputdir, preprocess)
+        self.compare_iterate_to_expected(ts, {(0, 0): 6, (2, 2): 6})
+
+        # The render failed, so last_rendertime and the fingerprints stay
+        ts = self.get_tileset(options, outputdir, preprocess)
+        self.compare_iterate_to_expected(ts, {(0, 0): 6, (2, 2): 6})
+        self.finish_render(ts)
+
+        ts = self.get_tileset(options, outputdir, preprocess)
+        self.compare_iterate_to_expected(ts, {})
+
+    def test_prepare_update(self):
+        """Tests that after a render, prepare_update() finds just the tiles
+        changed since, and sticks to the budget by postponing tiles
+
+        """
+        ts = self.get_tileset({'renderchecks': 2}, self.get_outputdir())
+        self.compare_iterate_to_expected(ts, self.rs.chunks)
+
+        self.rs.chunks.update({(0,0): 6, (4,4): 6})
+        self.assertFalse(ts.prepare_update(layout_changed=False))
+        self.assertEqual(ts.options['renderchecks'], 0)
+        self.compare_iterate_to_expected(ts, {(0,0): 6, (4,4): 6})
+
+        # Nothing changed
+        ts.prepare_update(layout_changed=False)
+        self.assertEqual(list(ts.iterate_work_items(0)), [])
+
+        updated = dict((key, 7) for key in self.rs.chunks)
+        self.rs.chunks.update(updated)
+        rendered = set()
+        for _ in range(100):
+            ts.prepare_update(layout_changed=False, budget=3)
+            self.assertLessEqual(ts.dirtytree.count(), 3)
+            rendered.update(ts.dirtytree)
+            if not ts.has_postponed_tiles():
+                break
+        expected = set(path for path in get_tile_set(updated) if len(path) == 5)
+        self.assertEqual(rendered, expected)
+
     def test_rendercheckmode_1(self):
         """Tests that an interrupted render will correctly pick up tiles that
         need rendering
@@ -275,3 +380,474 @@ class TilesetTest(unittest.TestCase):
 
         for tilepath in expected:
             self.assertTrue(tilepath in paths, "%s was expected to be returned but wasn't: %s" % (tilepath, paths))
+
+    def test_rendercheckmode_1_manifest(self):
+        """Tests that check-tiles mode fills in the tile manifest, and uses it
+        instead of the files once it's complete
+
+        """
+        outdated_tiles = [(0,3,3,3,3), (2,1,1)]
+        outputdir = self.get_outputdir()
+        all_tiles = get_tile_set(self.rs.chunks)
+        all_tiles.update(dict((x,3) for x in outdated_tiles))
+        create_fakedir(outputdir, all_tiles)
+
+        ts = self.get_tileset({'renderchecks': 1, 'tilemanifest': True}, outputdir)
+        expected = set(x[0] for x in ts.iterate_work_items(0))
+        self.assertTrue(set(outdated_tiles) <= expected)
+        self.assertEqual(ts.manifest.get_mtime(os.path.join(outputdir, "0", "3", "3", "3", "3.png")), 3)
+        ts.manifest.close()
+
+        # Now the files are gone, but the manifest knows what was there
+        for name in os.listdir(outputdir):
+            if not name.startswith("."):
+                path = os.path.join(outputdir, name)
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+        am = FakeAssetmanager(0)
+        am.get_tileset_config = lambda _: {'tilemanifest_complete': True}
+        ts = tileset.TileSet(None, self.rs, am, None, dict(ts.options), outputdir)
+        self.assertTrue(ts.manifest_complete)
+        ts.do_preprocessing()
+        self.assertEqual(set(x[0] for x in ts.iterate_work_items(0)), expected)
+        ts.manifest.close()
+
+    def test_manifest_journal(self):
+        """Tests that the manifest isn't in WAL mode, which doesn't work on
+        network filesystems, even if an older version made it in WAL mode
+
+        """
+        outputdir = self.get_outputdir()
+        path = os.path.join(outputdir, manifest.TileManifest.filename)
+        conn = sqlite3.connect(path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.close()
+
+        tilemanifest = manifest.TileManifest(outputdir)
+        imgpath = os.path.join(outputdir, "0", "0.png")
+        tilemanifest.set(imgpath, (10, 5), b"a")
+        self.assertTrue(tilemanifest.is_unchanged(imgpath, b"a", (10, 5)))
+        conn = tilemanifest._get_connection()
+        self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], "truncate")
+        self.assertFalse(os.path.exists(path + "-wal"))
+        tilemanifest.close()
+
+    def test_group_iterate(self):
+        """Tests that a TileSetGroup iterates over the union of its members'
+        tiles, and tags each tile with the members that need it
+
+        """
+        self.rs.chunks.update({(0,0): 6})
+        updated = self.get_tileset({'renderchecks': 0}, self.get_outputdir(),
+                lambda ts: setattr(ts, 'last_rendertime', 5))
+        forced = self.get_tileset({'renderchecks': 2}, self.get_outputdir())
+        group = tileset.TileSetGroup([updated, forced])
+
+        self.assertEqual(group.get_phase_length(0), len(get_tile_set(self.rs.chunks)))
+
+        expected_updated = get_tile_set({(0,0): 6})
+        items = dict((item, item.members) for item, _ in group.iterate_work_items(0))
+        self.assertEqual(set(items), set(get_tile_set(self.rs.chunks)))
+        for tilepath, members in items.items():
+            if tilepath in expected_updated:
+                self.assertEqual(members, (0, 1))
+            else:
+                self.assertEqual(members, (1,))
+
+        # work items are interchangeable with plain paths for the dispatcher
+        item = tileset.GroupWorkItem((0, 1), (1,))
+        self.assertEqual(item, (0, 1))
+        self.assertEqual(hash(item), hash((0, 1)))
+
+    def test_subtree_iterate(self):
+        """Tests that with subtreelevels set, the bottom levels of the tree
+        are returned as whole subtrees, and the rest as plain tiles
+
+        """
+        ts = self.get_tileset({'renderchecks': 2, 'subtreelevels': 2}, self.get_outputdir())
+        expected = get_tile_set(self.rs.chunks)
+
+        paths = []
+        items = list(ts.iterate_work_items(0))
+        self.assertEqual(ts.get_phase_length(0), len(items))
+        for item, deps in items:
+            if isinstance(item, tileset.SubtreeWorkItem):
+                self.assertEqual(len(item), 3)
+                self.assertEqual(item.tiles[-1], item)
+                self.assertEqual(deps, [])
+                for tilepath in item.tiles:
+                    self.assertEqual(tilepath[:3], item)
+                paths.extend(item.tiles)
+            else:
+                self.assertTrue(len(item) < 3)
+                paths.append(item)
+
+        self.assertEqual(len(paths), len(set(paths)))
+        self.assertEqual(set(paths), set(expected))
+
+    def test_optimize_batches(self):
+        """Tests that with a batched optimizemode every rendered tile ends up
+        in exactly one batch, after the tile that reads it from disk
+
+        """
+        outputdir = self.get_outputdir()
+        ts = self.get_tileset({'renderchecks': 2, 'optimizeimg': [None],
+                               'optimizemode': 'background'}, outputdir)
+        tiles = get_tile_set(self.rs.chunks)
+        imgpaths = dict((ts._get_imgpath(tilepath), tilepath) for tilepath in tiles)
+
+        yielded = []
+        optimized = []
+        for item, deps in ts.iterate_work_items(0):
+            if isinstance(item, tileset.OptimizeWorkItem):
+                for imgpath in item.imgpaths:
+                    tilepath = imgpaths[imgpath]
+                    parent = tilepath[:-1] if tilepath else tilepath
+                    self.assertIn(parent, deps)
+                    optimized.append(tilepath)
+                for dep in deps:
+                    self.assertIn(dep, yielded)
+            yielded.append(item)
+        self.assertEqual(len(optimized), len(tiles))
+        self.assertEqual(set(optimized), set(tiles))
+
+        ts = self.get_tileset({'renderchecks': 2, 'optimizeimg': [None],
+                               'optimizemode': 'deferred'}, outputdir)
+        self.assertEqual(ts.get_num_phases(), 2)
+        for item, deps in ts.iterate_work_items(0):
+            self.assertFalse(isinstance(item, tileset.OptimizeWorkItem))
+        batches = list(ts.iterate_work_items(1))
+        self.assertEqual(ts.get_phase_length(1), len(batches))
+        self.assertEqual(sum(len(item.imgpaths) for item, _ in batches), len(tiles))
+
+    def test_skip_unchanged(self):
+        """Tests that with skipunchanged set, saving the same image again
+        only changes the mtime of the tile
+
+        """
+        outputdir = self.get_outputdir()
+        ts = self.get_tileset({'renderchecks': 2, 'skipunchanged': True}, outputdir)
+        imgpath = os.path.join(outputdir, "base.png")
+        img = Image.new("RGBA", (384, 384), (255, 0, 0, 255))
+
+        ts._save_tile(img, imgpath, 5)
+        inode = os.stat(imgpath).st_ino
+        ts._save_tile(img.copy(), imgpath, 6)
+        self.assertEqual(os.stat(imgpath).st_ino, inode)
+        self.assertEqual(os.stat(imgpath).st_mtime, 6)
+
+        # a different image is written
+        ts._save_tile(Image.new("RGBA", (384, 384)), imgpath, 6)
+        self.assertNotEqual(os.stat(imgpath).st_ino, inode)
+
+        # and so is a tile that was changed behind the manifest's back
+        ts._save_tile(img, imgpath, 7)
+        inode = os.stat(imgpath).st_ino
+        Image.new("RGBA", (384, 384)).save(imgpath)
+        os.utime(imgpath, (7, 7))
+        ts._save_tile(img, imgpath, 7)
+        self.assertNotEqual(os.stat(imgpath).st_ino, inode)
+        ts.manifest.close()
+
+    def test_skip_unchanged_optimized(self):
+        """Tests that skipunchanged still works when the optimizers change the
+        tiles afterwards, and that unchanged tiles aren't optimized again
+
+        """
+        class FakeOptimizer(optimizeimages.PNGOptimizer):
+            def __init__(self):
+                self.optimized = []
+
+            def optimize_batch(self, imgpaths):
+                for imgpath in imgpaths:
+                    self.optimized.append(imgpath)
+                    with open(imgpath, "ab") as f:
+                        f.write(b"\0" * 16)
+
+        outputdir = self.get_outputdir()
+        optimizer = FakeOptimizer()
+        options = {'renderchecks': 2, 'skipunchanged': True, 'optimizeimg': [optimizer],
+                   'optimizemode': 'deferred'}
+        tiles = get_tile_set(self.rs.chunks)
+
+        def render_all():
+            ts = self.get_tileset(dict(options), outputdir)
+            self.stub_render(ts)
+            Dispatcher().render_all([ts], Observer())
+            ts.manifest.close()
+            return dict((ts._get_imgpath(tilepath), os.stat(ts._get_imgpath(tilepath)))
+                        for tilepath in tiles)
+
+        stats = render_all()
+        self.assertEqual(sorted(optimizer.optimized), sorted(stats))
+        optimizer.optimized = []
+
+        # Nothing changed, so nothing is written or optimized again
+        for imgpath, stat in render_all().items():
+            self.assertEqual(stat.st_ino, stats[imgpath].st_ino)
+            self.assertEqual(stat.st_size, stats[imgpath].st_size)
+        self.assertEqual(optimizer.optimized, [])
+
+    def test_zoom_encoding(self):
+        """Tests that the encoder settings are picked by zoom level, counting
+        negative levels from the deepest one
+
+        """
+        outputdir = self.get_outputdir()
+        ts = self.get_tileset({'renderchecks': 2, 'zoomencoding': {
+            'default': {'compress_level': 0, 'optimize': False},
+            -1: {'compress_level': 9, 'optimize': True},
+            1: {'compress_level': 5}}}, outputdir)
+        self.assertEqual(ts._get_encoder_settings(0)['compress_level'], 0)
+        self.assertEqual(ts._get_encoder_settings(1)['compress_level'], 5)
+        self.assertFalse(ts._get_encoder_settings(1)['optimize'])
+        self.assertEqual(ts._get_encoder_settings(ts.treedepth)['compress_level'], 9)
+        self.assertTrue(ts._get_encoder_settings(ts.treedepth)['optimize'])
+        self.assertEqual(ts._get_zoom_level(os.path.join(outputdir, "base.png")), 0)
+        self.assertEqual(ts._get_zoom_level(os.path.join(outputdir, "0", "3", "1.png")), 3)
+
+        img = Image.frombytes("RGBA", (384, 384), bytes(range(256)) * 2304)
+        os.makedirs(os.path.join(outputdir, "0", "0", "0", "0"))
+        ts._save_tile(img, os.path.join(outputdir, "0.png"), 5)
+        ts._save_tile(img, os.path.join(outputdir, "0", "0", "0", "0", "0.png"), 5)
+        self.assertLess(os.stat(os.path.join(outputdir, "0", "0", "0", "0", "0.png")).st_size,
+                        os.stat(os.path.join(outputdir, "0.png")).st_size)
+
+    def test_texture_size(self):
+        """Tests that the tiles are 16 block sprites wide, and that tilesets
+        with different tile sizes aren't rendered together
+
+        """
+        outputdir = self.get_outputdir()
+        ts = self.get_tileset({'renderchecks': 2}, outputdir)
+        self.assertEqual(ts.tilesize, 384)
+        small = tileset.TileSet(None, self.rs, FakeAssetmanager(0),
+                                mock.Mock(texture_size=12), dict(ts.options), outputdir)
+        self.assertEqual(small.tilesize, 192)
+        self.assertEqual(len(tileset.group_tilesets([ts, small])), 2)
+
+        os.mkdir(os.path.join(outputdir, "0"))
+        Image.new("RGBA", (192, 192), (255, 0, 0, 255)).save(
+            os.path.join(outputdir, "0", "0.png"))
+        img, mtime = small._render_compositetile(outputdir, "0")
+        self.assertEqual(img.size, (192, 192))
+        self.assertEqual(img.getpixel((0, 0)), (255, 0, 0, 255))
+
+    def test_texture_size_change(self):
+        """Tests that changing the texturesize of an existing render renders
+        every tile again, instead of mixing tiles of different sizes
+
+        """
+        outputdir = self.get_outputdir()
+
+        def render_all(ts):
+            self.stub_render(ts)
+            Dispatcher().render_all([ts], Observer())
+
+        ts = self.get_tileset({'renderchecks': 2}, outputdir)
+        render_all(ts)
+        tiles = get_tile_set(self.rs.chunks)
+        imgpaths = [ts._get_imgpath(tilepath) for tilepath in tiles]
+
+        # One chunk changed since, and the tiles are now 192px
+        self.rs.chunks[0, 0] = 10
+        am = mock.Mock()
+        am.get_tileset_config.return_value = {'last_rendertime': 5, 'tilesize': 384}
+        options = dict(ts.options)
+        del options['renderchecks']
+        small = tileset.TileSet(None, self.rs, am, mock.Mock(texture_size=12), dict(options),
+                                outputdir)
+        self.assertEqual(small.options['renderchecks'], 2)
+        small.do_preprocessing()
+        with mock.patch.object(small.storage, "remove") as remove:
+            render_all(small)
+        remove.assert_not_called()
+        for imgpath in imgpaths:
+            self.assertEqual(Image.open(imgpath).size, (192, 192))
+
+        # The same tile size is just an update
+        am.get_tileset_config.return_value = {'last_rendertime': 5, 'tilesize': 192}
+        small = tileset.TileSet(None, self.rs, am, mock.Mock(texture_size=12), dict(options),
+                                outputdir)
+        self.assertEqual(small.options['renderchecks'], 0)
+
+    def test_layercache(self):
+        """Tests that cached chunk column layers give the same tile as drawing
+        the chunks, and that they're drawn again when the textures change or
+        with --forcerender
+
+        """
+        outputdir = self.get_outputdir()
+        drawn = []
+
+        def render_loop(world, regionset, chunkx, chunky, chunkz, tileimg, xpos, ypos,
+                        rendermode, textures):
+            drawn.append((chunkx, chunky, chunkz))
+            half = tileimg.size[0] // 2
+            color = (chunkx * 40 % 256, chunkz * 40 % 256, chunky * 16, 255)
+            ImageDraw.Draw(tileimg).rectangle(
+                (xpos + half - 20, ypos + half - 20, xpos + half + 20, ypos + half + 20), color)
+
+        def render(renderchecks, texturekey):
+            textures = mock.Mock(texture_size=24)
+            textures.get_cache_key.return_value = texturekey
+            options = {'name': 'world name', 'bgcolor': '#000000', 'imgformat': 'png',
+                       'optimizeimg': 0, 'rendermode': [rendermodes.Base()],
+                       'rerenderprob': 0, 'renderchecks': renderchecks, 'layercache': True}
+            ts = tileset.TileSet(None, self.rs, FakeAssetmanager(0), textures, options,
+                                 outputdir)
+            del drawn[:]
+            with mock.patch.object(tileset.c_overviewer, "render_loop", render_loop):
+                img, _ = ts._render_rendertile(tile)
+            return img.tobytes(), len(drawn)
+
+        # A render-tile with sections of 6 chunk columns in it
+        tile = tileset.RenderTile.compute_path(0, 8, 5)
+
+        first, count = render(2, "textures")
+        self.assertTrue(count)
+        self.assertNotEqual(first, Image.new("RGBA", (384, 384), "#000000").tobytes())
+        self.assertTrue(os.listdir(os.path.join(outputdir, ".layercache")))
+
+        # Nothing changed, so every layer comes from the cache
+        self.assertEqual(render(0, "textures"), (first, 0))
+
+        # Different textures, so every chunk is drawn again
+        self.assertEqual(render(0, "other textures"), (first, count))
+        self.assertEqual(render(0, "other textures"), (first, 0))
+
+        # --forcerender doesn't use the cache
+        self.assertEqual(render(2, "other textures"), (first, count))
+
+    def test_skip_blank(self):
+        """Tests that blank tiles aren't stored, but still count as children
+        of their composite-tile, and have an mtime for the render checks
+
+        """
+        outputdir = self.get_outputdir()
+        ts = self.get_tileset({'renderchecks': 2, 'skipblank': True}, outputdir)
+        os.mkdir(os.path.join(outputdir, "0"))
+        blank = Image.new("RGBA", (384, 384), ts.options['bgcolor'])
+        imgpath = os.path.join(outputdir, "0", "0.png")
+        Image.new("RGBA", (384, 384), (255, 0, 0, 255)).save(imgpath)
+
+        ts._save_tile(blank, imgpath, 5)
+        self.assertFalse(os.path.exists(imgpath))
+        self.assertEqual(ts._get_tile_mtime(imgpath), 5)
+
+        self.assertTrue(ts._render_compositetile(outputdir, "0") is not None)
+        self.assertFalse(os.path.exists(os.path.join(outputdir, "0.png")))
+        self.assertEqual(ts._get_tile_mtime(os.path.join(outputdir, "0.png")), 5)
+
+        ts._save_tile(Image.new("RGBA", (384, 384), (255, 0, 0, 255)), imgpath, 6)
+        self.assertEqual(ts._render_compositetile(outputdir, "0")[1], 6)
+        self.assertTrue(os.path.exists(os.path.join(outputdir, "0.png")))
+        ts.manifest.close()
+
+    def test_deduplicate(self):
+        """Tests that identical tiles share storage, but only if that doesn't
+        change their mtimes
+
+        """
+        outputdir = self.get_outputdir()
+        ts = self.get_tileset({'renderchecks': 2, 'deduplicate': True}, outputdir)
+        img = Image.new("RGBA", (384, 384), (255, 0, 0, 255))
+        imgpaths = [os.path.join(outputdir, "%d.png" % i) for i in range(4)]
+
+        ts._save_tile(img, imgpaths[0], 5)
+        ts._save_tile(img.copy(), imgpaths[1], 5)
+        ts._save_tile(img.copy(), imgpaths[2], 6)
+        self.assertEqual(os.stat(imgpaths[1]).st_ino, os.stat(imgpaths[0]).st_ino)
+        self.assertNotEqual(os.stat(imgpaths[2]).st_ino, os.stat(imgpaths[0]).st_ino)
+        self.assertEqual(os.stat(imgpaths[2]).st_mtime, 6)
+
+        # Changing the mtime of one doesn't change the others
+        ts.storage.set_mtime(imgpaths[1], 7)
+        self.assertEqual(os.stat(imgpaths[0]).st_mtime, 5)
+        self.assertEqual(os.stat(imgpaths[1]).st_mtime, 7)
+        ts.manifest.close()
+
+        # In an SQLite store, mtimes don't matter
+        outputdir = os.path.join(self.get_outputdir(), "render")
+        ts = self.get_tileset({'renderchecks': 2, 'deduplicate': True, 'storage': 'sqlite'},
+                              outputdir)
+        imgpaths = [os.path.join(outputdir, "%d.png" % i) for i in range(4)]
+        for i, imgpath in enumerate(imgpaths):
+            ts._save_tile(img.copy(), imgpath, i)
+        for i, imgpath in enumerate(imgpaths):
+            self.assertEqual(ts.storage.get_stat(imgpath)[1], i)
+        conn = ts.storage._get_connection()
+        self.assertEqual(conn.execute("SELECT count(*) FROM blobs").fetchone()[0], 1)
+        ts.storage.remove(imgpaths[0])
+        ts.storage.cleanup()
+        self.assertEqual(conn.execute("SELECT count(*) FROM blobs").fetchone()[0], 1)
+        ts.manifest.close()
+
+    def test_background_writes(self):
+        """Tests that with writethreads set, a job only finishes once its
+        tiles are on disk, so composite-tiles always find their children
+
+        """
+        outputdir = self.get_outputdir()
+        ts = self.get_tileset({'renderchecks': 2, 'writethreads': 2}, outputdir)
+        self.stub_render(ts)
+
+        item, _ = next(ts.iterate_work_items(0))
+        future = ts.do_work(item)
+        self.assertTrue(tileset.collect_writes() is None)
+        future.result()
+        self.assertTrue(future.done())
+
+        Dispatcher().render_all([ts], Observer())
+        for tilepath in get_tile_set(self.rs.chunks):
+            if tilepath:
+                imgpath = os.path.join(outputdir, *(str(x) for x in tilepath)) + ".png"
+            else:
+                imgpath = os.path.join(outputdir, "base.png")
+            self.assertEqual(os.stat(imgpath).st_mtime, 5)
+
+    def test_sqlite_storage(self):
+        """Tests rendering into an SQLite tile store, re-arranging it, and
+        exporting it to the usual directory layout
+
+        """
+        destdir = self.get_outputdir()
+        outputdir = os.path.join(destdir, "render")
+        ts = self.get_tileset({'renderchecks': 2, 'storage': 'sqlite'}, outputdir)
+        self.stub_render(ts)
+        Dispatcher().render_all([ts], Observer())
+
+        tiles = get_tile_set(self.rs.chunks)
+        self.assertEqual(os.listdir(outputdir), [])
+        def get_imgpath(tilepath):
+            if tilepath:
+                return os.path.join(outputdir, *(str(x) for x in tilepath)) + ".png"
+            return os.path.join(outputdir, "base.png")
+        for tilepath in tiles:
+            self.assertEqual(ts.storage.get_stat(get_imgpath(tilepath))[1], 5)
+        with ts.storage.open(get_imgpath(())) as f:
+            self.assertEqual(Image.open(f).size, (384, 384))
+
+        # One level deeper and back again
+        ts.storage.increase_depth("png")
+        self.assertTrue(ts.storage.exists(get_imgpath((0, 3, 3, 3, 3, 3))))
+        self.assertFalse(ts.storage.exists(get_imgpath((0,))))
+        ts.storage.decrease_depth("png")
+        for tilepath in tiles:
+            self.assertEqual(ts.storage.exists(get_imgpath(tilepath)), len(tilepath) > 1)
+
+        ts.storage.remove_tree(get_imgpath((0, 3))[:-4])
+        self.assertFalse(ts.storage.tree_exists(get_imgpath((0, 3))[:-4]))
+        self.assertTrue(ts.storage.tree_exists(get_imgpath((0,))[:-4]))
+
+        exportdir = self.get_outputdir()
+        exported = [t for t in tiles if len(t) > 1 and (len(t) == 2 or t[:2] != (0, 3))]
+        self.assertEqual(storage.export_tiles(os.path.join(destdir, "tiles.sqlite"), exportdir),
+                         len(exported))
+        for tilepath in exported:
+            imgpath = os.path.join(exportdir, "render", *(str(x) for x in tilepath)) + ".png"
+            self.assertEqual(os.stat(imgpath).st_mtime, 5)
+        # Nothing changed since
+        self.assertEqual(storage.export_tiles(os.path.join(destdir, "tiles.sqlite"), exportdir), 0)